@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compares DDI poll and download throughput of DDIClient across asyncio event
+loop implementations (default asyncio loop and uvloop, if installed).
+
+Usage: PYTHONPATH=. python3 benchmarks/bench_event_loops.py [--polls N] [--downloads N]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from rauc_hawkbit.ddi.client import DDIClient
+
+POLL_RESPONSE = {
+    'config': {'polling': {'sleep': '00:00:10'}},
+    '_links': {
+        'deploymentBase': {
+            'href': 'http://localhost/DEFAULT/controller/v1/bench/deploymentBase/3?c=-2129030598'
+        }
+    }
+}
+
+
+def create_app(artifact):
+    async def poll(request):
+        return web.json_response(POLL_RESPONSE)
+
+    async def download(request):
+        return web.Response(body=artifact)
+
+    app = web.Application()
+    app.router.add_route('GET', '/DEFAULT/controller/v1/bench', poll)
+    app.router.add_route('GET', '/artifact', download)
+    return app
+
+
+async def bench(polls, downloads, size, concurrency):
+    runner = web.AppRunner(create_app(os.urandom(size)))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host = '127.0.0.1:{}'.format(runner.addresses[0][1])
+
+    results = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            ddi = DDIClient(session, host, False, 'token', 'DEFAULT', 'bench')
+
+            async def poll_worker(count):
+                for _ in range(count):
+                    await ddi()
+
+            start = time.monotonic()
+            await asyncio.gather(*[poll_worker(polls // concurrency)
+                                   for _ in range(concurrency)])
+            results['polls/s'] = polls / (time.monotonic() - start)
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                dl_location = os.path.join(tmpdir, 'bundle.raucb')
+                start = time.monotonic()
+                for _ in range(downloads):
+                    await ddi.get_binary(ddi.build_api_url('/artifact'),
+                                         dl_location)
+                elapsed = time.monotonic() - start
+                results['download MiB/s'] = \
+                    downloads * size / elapsed / 1024 / 1024
+    finally:
+        await runner.cleanup()
+
+    return results
+
+
+def event_loops():
+    yield 'asyncio', asyncio.new_event_loop
+    try:
+        import uvloop
+        yield 'uvloop', uvloop.new_event_loop
+    except ImportError:
+        print('uvloop not installed, skipping')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polls', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--downloads', type=int, default=10)
+    parser.add_argument('--size', type=int, default=32,
+                        help='artifact size in MiB')
+    args = parser.parse_args()
+
+    for name, new_event_loop in event_loops():
+        loop = new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(
+                bench(args.polls, args.downloads, args.size * 1024 * 1024,
+                      args.concurrency))
+        finally:
+            loop.close()
+        print('{:<8} {}'.format(name, '  '.join(
+            '{}: {:.1f}'.format(k, v) for k, v in results.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measures end-to-end latency from RAUC D-Bus events to hawkBit feedback of
+RaucDBUSDDIClient, using a fake RAUC installer service on a private D-Bus
+session bus and a local fake hawkBit server. Requires PyGObject and
+dbus-daemon.
+
+Usage: PYTHONPATH=. python3 benchmarks/bench_install_feedback.py [--events N] [--burst-size N] [--burst-interval S]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from rauc_hawkbit.fake_rauc import FakeRaucInstaller, PrivateBus
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+TARGET = '/DEFAULT/controller/v1/bench'
+ARTIFACT = os.urandom(1024 * 1024)
+
+
+def create_app():
+    async def base(request):
+        links = {}
+        if not request.app['done']:
+            links['deploymentBase'] = {
+                'href': 'http://{}{}/deploymentBase/1?c=1'.format(
+                    request.host, TARGET)}
+        return web.json_response({
+            'config': {'polling': {'sleep': '00:00:01'}},
+            '_links': links,
+        })
+
+    async def deployment(request):
+        return web.json_response({'deployment': {'chunks': [{'artifacts': [{
+            'filename': 'bundle.raucb',
+            'hashes': {'md5': hashlib.md5(ARTIFACT).hexdigest()},
+            '_links': {'download-http': {
+                'href': 'http://{}/artifact'.format(request.host)}},
+        }]}]}})
+
+    async def artifact(request):
+        return web.Response(body=ARTIFACT)
+
+    async def feedback(request):
+        data = await request.json()
+        request.app['feedback'].append((time.monotonic(), data))
+        if data['status']['execution'] == 'closed':
+            request.app['done'] = True
+        return web.Response()
+
+    app = web.Application()
+    app['done'] = False
+    app['feedback'] = []
+    app.router.add_route('GET', TARGET, base)
+    app.router.add_route('GET', TARGET + '/deploymentBase/1', deployment)
+    app.router.add_route('POST', TARGET + '/deploymentBase/1/feedback',
+                         feedback)
+    app.router.add_route('GET', '/artifact', artifact)
+    return app
+
+
+async def bench(bus_address, events, burst_size, burst_interval):
+    rauc = FakeRaucInstaller(bus_address, progress_events=events,
+                             burst_size=burst_size,
+                             burst_interval=burst_interval)
+    rauc.start()
+
+    app = create_app()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host = '127.0.0.1:{}'.format(runner.addresses[0][1])
+
+    completed = asyncio.Event()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            async with aiohttp.ClientSession() as session:
+                client = RaucDBUSDDIClient(
+                    session, host, False, 'DEFAULT', 'bench', 'token',
+                    {'MAC': 'ff:ff:ff:ff:ff:ff'},
+                    os.path.join(tmpdir, 'bundle.raucb'),
+                    lambda result: completed.set(), lazy_dbus=True,
+                    bus_address=bus_address)
+                polling = asyncio.ensure_future(client.start_polling())
+                try:
+                    await completed.wait()
+                finally:
+                    polling.cancel()
+                    await asyncio.wait([polling])
+                    client.cleanup_dbus()
+    finally:
+        await runner.cleanup()
+        rauc.stop()
+
+    # progress feedback is sent in order of the D-Bus events
+    received = [at for at, data in app['feedback']
+                if data['status']['details'] == ['Installing']]
+    latencies = [fb - emitted for (_, emitted), fb in zip(rauc.emitted,
+                                                          received)]
+    return {
+        'events': len(rauc.emitted),
+        'feedback': len(received),
+        'mean ms': statistics.mean(latencies) * 1000,
+        'median ms': statistics.median(latencies) * 1000,
+        'max ms': max(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=100)
+    parser.add_argument('--burst-size', type=int, default=10)
+    parser.add_argument('--burst-interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    bus = PrivateBus()
+    bus.start()
+    try:
+        loop = asyncio.get_event_loop()
+        results = loop.run_until_complete(
+            bench(bus.address, args.events, args.burst_size,
+                  args.burst_interval))
+    finally:
+        bus.stop()
+    print('  '.join('{}: {:.1f}'.format(k, v) for k, v in results.items()))
+
+
+if __name__ == '__main__':
+    main()
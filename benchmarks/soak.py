@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Soak test of RaucDBUSDDIClient: runs the poll loop against a local DDI
+stand-in on a virtual clock (weeks of polls and deployments in minutes) and
+fails if RSS, open file descriptors, asyncio tasks, traced memory, queued
+D-Bus events or D-Bus subscriptions grow.
+
+Installations are simulated through the client's D-Bus event queue, with
+--fake-rauc they are run by a fake RAUC service on a private D-Bus session
+bus (requires PyGObject and dbus-daemon).
+
+Usage: PYTHONPATH=. python3 benchmarks/soak.py [--days N] [--poll-interval S] [--deployment-every N] [--fake-rauc]
+"""
+
+import argparse
+import sys
+
+from rauc_hawkbit.soak import METRICS, SoakError, SoakHarness
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--poll-interval', type=int, default=12 * 3600)
+    parser.add_argument('--deployment-every', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--fake-rauc', action='store_true')
+    args = parser.parse_args()
+
+    cycles = int(args.days * 24 * 3600 / args.poll_interval)
+    harness = SoakHarness(cycles=cycles, poll_interval=args.poll_interval,
+                          deployment_every=args.deployment_every,
+                          warmup=args.warmup)
+
+    bus = rauc = None
+    if args.fake_rauc:
+        from rauc_hawkbit.fake_rauc import FakeRaucInstaller, PrivateBus
+        bus = PrivateBus()
+        bus.start()
+        rauc = FakeRaucInstaller(bus.address, progress_events=10)
+        rauc.start()
+        harness.bus_address = bus.address
+        # leave time for events from the fake RAUC thread
+        harness.grace = 0.01
+
+    try:
+        report = harness.run()
+    finally:
+        if rauc:
+            rauc.stop()
+        if bus:
+            bus.stop()
+
+    print('cycle  days  ' + '  '.join(METRICS))
+    for sample in report.samples:
+        print('{:5d} {:5.1f}  '.format(sample.cycle, sample.time / 86400) +
+              '  '.join(str(getattr(sample, metric)) for metric in METRICS))
+    print('{:.1f} virtual days in {:.1f}s, {} deployments'.format(
+        report.virtual_time / 86400, report.elapsed, len(report.results)))
+    print('growth: ' + '  '.join('{}: {:.0f}'.format(metric, value)
+                                 for metric, value in report.growth().items()))
+    try:
+        report.check()
+    except SoakError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-from gi.repository import Gio
 import logging
 import traceback
 
@@ -11,12 +10,18 @@ class DBUSException(Exception):
 
 
 class AsyncDBUSClient(object):
-    def __init__(self):
+    """
+    Base class for asyncio based D-Bus clients.
+
+    Connects to the system bus, or to the bus at ``bus_address`` if set
+    (e.g. a private bus running a fake RAUC service).
+    """
+    def __init__(self, connect=True, bus_address=None):
         self.logger = logging.getLogger('rauc_hawkbit')
         self.dbus_events = asyncio.Queue()
-        loop = asyncio.get_event_loop()
+        self.loop = asyncio.get_event_loop()
         # handle dbus events in async way
-        self.dbus_event_task = loop.create_task(self.handle_dbus_event())
+        self.dbus_event_task = self.loop.create_task(self.handle_dbus_event())
         # holds active subscriptions
         self.signal_subscriptions = []
         # ({interface}, {signal}): {callback}
@@ -24,13 +29,50 @@ class AsyncDBUSClient(object):
         # ({interface}, {property}): {callback}
         self.property_callbacks = {}
 
-        self.system_bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        # GLib callbacks are dispatched in the bridge thread, so any asyncio
+        # event loop can be used
+        self.glib_bridge = None
+        self.bus_address = bus_address
+        self.system_bus = None
+        if connect:
+            self.connect_dbus()
+
+    @property
+    def dbus_connected(self):
+        return self.system_bus is not None
+
+    def connect_dbus(self):
+        """
+        Connect to the bus. Gio is only imported here, so that clients can
+        start working before the D-Bus layer is needed.
+        """
+        if self.dbus_connected:
+            return
+
+        self.glib_bridge, self.system_bus = self.open_bus()
 
         # always subscribe to property changes by default
         self.new_signal_subscription('org.freedesktop.DBus.Properties',
                                      'PropertiesChanged',
                                      self.property_changed_callback)
 
+    def open_bus(self):
+        """Returns the started GLibBridge and the bus connection."""
+        from gi.repository import Gio
+        from .glib_bridge import GLibBridge
+
+        glib_bridge = GLibBridge(self.loop)
+        glib_bridge.start()
+        if self.bus_address:
+            flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | \
+                Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+            bus = glib_bridge.call(Gio.DBusConnection.new_for_address_sync,
+                                   self.bus_address, flags, None, None)
+        else:
+            bus = glib_bridge.call(Gio.bus_get_sync, Gio.BusType.SYSTEM,
+                                   None)
+        return glib_bridge, bus
+
     def __del__(self):
         self.cleanup_dbus()
 
@@ -38,12 +80,19 @@ class AsyncDBUSClient(object):
         """Unsubscribe on deletion."""
         for subscription in self.signal_subscriptions:
             self.system_bus.signal_unsubscribe(subscription)
+        self.signal_subscriptions = []
+
+        if self.glib_bridge:
+            self.glib_bridge.stop()
 
         self.dbus_event_task.cancel()
 
     def on_dbus_event(self, *args):
-        """Generic sync callback for all DBUS events."""
-        self.dbus_events.put_nowait(args)
+        """
+        Generic sync callback for all DBUS events, called in the GLib bridge
+        thread.
+        """
+        self.loop.call_soon_threadsafe(self.dbus_events.put_nowait, args)
 
     async def handle_dbus_event(self):
         """
@@ -62,10 +111,13 @@ class AsyncDBUSClient(object):
 
     def new_proxy(self, interface, object_path):
         """Returns a new managed proxy."""
+        from gi.repository import Gio
         # assume name is interface without last part
         name = '.'.join(interface.split('.')[:-1])
-        proxy = Gio.DBusProxy.new_sync(self.system_bus, 0, None, name,
-                                       object_path, interface, None)
+        # create in bridge thread to get property updates dispatched there
+        proxy = self.glib_bridge.call(Gio.DBusProxy.new_sync, self.system_bus,
+                                      0, None, name, object_path, interface,
+                                      None)
 
         # FIXME: check for methods
         if len(proxy.get_cached_property_names()) == 0:
@@ -75,11 +127,36 @@ class AsyncDBUSClient(object):
 
     def new_signal_subscription(self, interface, signal, callback):
         """Add new signal subscription."""
-        signal_subscription = self.system_bus.signal_subscribe(
+        # subscribe in bridge thread, callbacks are dispatched there
+        signal_subscription = self.glib_bridge.call(
+            self.system_bus.signal_subscribe,
             None, interface, signal, None, None, 0, self.on_dbus_event)
         self.signal_callbacks[(interface, signal)] = callback
         self.signal_subscriptions.append(signal_subscription)
 
+    async def call_method(self, proxy, method, parameters, timeout=-1):
+        """
+        Call D-Bus method asynchronously, the reply is handed from the GLib
+        bridge thread to the asyncio event loop.
+
+        Args:
+            proxy(Gio.DBusProxy): proxy to call method on
+            method(str): method name
+            parameters(GLib.Variant): method parameters tuple
+        Keyword Args:
+            timeout: timeout in milliseconds (default: -1, D-Bus default)
+
+        Returns:
+            GLib.Variant with the method's return values
+        """
+        from gi.repository import Gio
+
+        def start(callback):
+            proxy.call(method, parameters, Gio.DBusCallFlags.NONE, timeout,
+                       None, callback)
+
+        return await self.glib_bridge.call_async(start, proxy.call_finish)
+
     def new_property_subscription(self, interface, property_, callback):
         """Add new property subscription."""
         self.property_callbacks[(interface, property_)] = callback
@@ -3,6 +3,8 @@
 from datetime import datetime
 from enum import Enum
 
+from .scheduler import RequestClass
+
 
 # status of the action execution
 CancelStatusExecution = Enum('CancelStatusExecution',
@@ -28,7 +30,8 @@ class Action(object):
         See http://sp.apps.bosch-iot-cloud.com/documentation/rest-api/rootcontroller-api-guide.html#_get_tenant_controller_v1_targetid_cancelaction_actionid # noqa
         """
         return await self.ddi.get_resource(
-            '/{tenant}/controller/v1/{controllerId}/cancelAction/{actionId}', actionId=self.action_id)
+            '/{tenant}/controller/v1/{controllerId}/cancelAction/{actionId}', request_class=RequestClass.control,
+            actionId=self.action_id)
 
     async def feedback(self, status_execution, status_result,
                        status_details=()):
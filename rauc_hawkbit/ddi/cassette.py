@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from multidict import CIMultiDict
+from yarl import URL
+
+# request headers not written to cassettes
+SECRET_HEADERS = ('authorization',)
+
+# response bodies of this type (artifacts) are stored in side files
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+
+class CassetteError(Exception):
+    pass
+
+
+def request_url(url, params=None):
+    """Returns URL string including query parameters."""
+    params = {k: v for k, v in (params or {}).items() if v is not None}
+    return str(URL(url).update_query(params)) if params else str(URL(url))
+
+
+def request_key(method, url):
+    """Host independent key used to match requests on replay."""
+    return '{} {}'.format(method.upper(), URL(url).path_qs)
+
+
+class RecordedContent(object):
+    """Minimal ``aiohttp.StreamReader`` replacement for recorded bodies."""
+    def __init__(self, body):
+        self.body = body
+
+    async def readchunk(self):
+        body, self.body = self.body, b''
+        return body, False
+
+    async def read(self, n=-1):
+        if n < 0:
+            n = len(self.body)
+        chunk, self.body = self.body[:n], self.body[n:]
+        return chunk
+
+
+class RecordedFileContent(object):
+    """``RecordedContent`` for bodies stored in a side file."""
+    chunk_size = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def read_file(self, n):
+        with open(self.path, 'rb') as fd:
+            fd.seek(self.offset)
+            chunk = fd.read(n) if n >= 0 else fd.read()
+        self.offset += len(chunk)
+        return chunk
+
+    async def readchunk(self):
+        return self.read_file(self.chunk_size), False
+
+    async def read(self, n=-1):
+        return self.read_file(n)
+
+
+class RecordedResponse(object):
+    """
+    Response object providing the ``aiohttp.ClientResponse`` API used. The
+    body is either given as bytes or as path of a side file (``body_path``).
+    """
+    def __init__(self, status, reason, headers, body=b'', body_path=None):
+        self.status = status
+        self.reason = reason
+        self.headers = CIMultiDict(headers)
+        if body_path is not None:
+            self.content = RecordedFileContent(body_path)
+            body = None
+        else:
+            self.content = RecordedContent(body)
+        self._body = body
+
+    @property
+    def content_length(self):
+        length = self.headers.get('Content-Length')
+        return int(length) if length is not None else None
+
+    @property
+    def content_type(self):
+        return self.headers.get('Content-Type', '').split(';')[0].strip()
+
+    async def read(self):
+        if self._body is None:
+            self._body = await self.content.read()
+        return self._body
+
+    async def text(self, encoding='utf-8'):
+        return (await self.read()).decode(encoding)
+
+    async def json(self, **kwargs):
+        body = await self.read()
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def release(self):
+        pass
+
+
+class _RequestContext(object):
+    """Async context manager returned by session request methods."""
+    def __init__(self, coro):
+        self.coro = coro
+
+    async def __aenter__(self):
+        self.resp = await self.coro
+        return self.resp
+
+    async def __aexit__(self, *exc):
+        self.resp.release()
+
+
+def bodies_directory(path):
+    """Directory of the side files of the cassette at ``path``."""
+    return '{}.bodies'.format(path)
+
+
+class RecordingSession(object):
+    """
+    Wraps an ``aiohttp.ClientSession`` and records all requests and responses
+    (headers, bodies and timing) to a cassette file, which can be replayed
+    with ``ReplaySession``. Can be passed to ``DDIClient`` instead of the
+    session.
+
+    The cassette is a JSON lines file with one interaction per line. The
+    Authorization header is not recorded. Artifact bodies
+    (application/octet-stream) are streamed to side files named by their MD5
+    hash in ``{path}.bodies``, the cassette only stores hash and size.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, session, path):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.session = session
+        self.path = path
+        self.start = time.monotonic()
+        # truncate cassette
+        open(path, 'w').close()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        return _RequestContext(self._request(method, url, **kwargs))
+
+    async def _request(self, method, url, headers=None, params=None,
+                       data=None, **kwargs):
+        started = time.monotonic()
+        response = {}
+        body_path = None
+        body = b''
+        async with self.session.request(method, url, headers=headers,
+                                        params=params, data=data,
+                                        **kwargs) as resp:
+            if resp.content_type == BINARY_CONTENT_TYPE:
+                body_path, response['body_md5'], response['body_size'] = \
+                    await self.write_body(resp)
+            else:
+                body = await resp.read()
+                response['body'] = base64.b64encode(body).decode('ascii')
+            elapsed = time.monotonic() - started
+            resp_headers = list(resp.headers.items())
+            response.update(status=resp.status, reason=resp.reason,
+                            headers=resp_headers)
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.write({
+            # start of the request, orders concurrent requests on replay
+            'at': started - self.start,
+            'elapsed': elapsed,
+            'method': method.upper(),
+            'url': request_url(url, params),
+            'headers': {k: v for k, v in (headers or {}).items()
+                        if k.lower() not in SECRET_HEADERS},
+            'body': base64.b64encode(data or b'').decode('ascii'),
+            'response': response,
+        })
+
+        return RecordedResponse(response['status'], response['reason'],
+                                resp_headers, body, body_path)
+
+    async def write_body(self, resp):
+        """
+        Stream the response body to a side file.
+
+        Returns:
+            Tuple of path, MD5 hash and size of the body
+        """
+        directory = bodies_directory(self.path)
+        os.makedirs(directory, exist_ok=True)
+        hash_md5 = hashlib.md5()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as body:
+                while True:
+                    chunk = await resp.content.read(self.chunk_size)
+
+                    # we are EOF
+                    if not chunk:
+                        break
+
+                    body.write(chunk)
+                    hash_md5.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        path = os.path.join(directory, hash_md5.hexdigest())
+        os.replace(tmp_path, path)
+        return path, hash_md5.hexdigest(), size
+
+    def write(self, interaction):
+        with open(self.path, 'a') as fd:
+            fd.write(json.dumps(interaction))
+            fd.write('\n')
+
+
+class ReplaySession(object):
+    """
+    Replays a cassette recorded by ``RecordingSession`` without network
+    access. Can be passed to ``DDIClient`` instead of an
+    ``aiohttp.ClientSession``.
+
+    Requests are matched by method, path and query. Requests with the same
+    key must be made in the recorded order, while requests with different
+    keys (e.g. feedback sent concurrently with polls) may interleave
+    differently. Each response is delayed by its recorded duration divided by
+    ``speed``; ``speed=None`` replays without delays.
+    """
+    def __init__(self, path, speed=1.0):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.speed = speed
+        self.bodies_directory = bodies_directory(path)
+        with open(path) as fd:
+            interactions = [json.loads(line) for line in fd if line.strip()]
+        # interactions are written on completion, replay in request order
+        interactions.sort(key=lambda interaction: interaction.get('at', 0))
+        # {request key: deque of interactions}
+        self.interactions = collections.OrderedDict()
+        for interaction in interactions:
+            key = request_key(interaction['method'], interaction['url'])
+            self.interactions.setdefault(key, collections.deque()).append(
+                interaction)
+
+    @property
+    def done(self):
+        return not any(self.interactions.values())
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        return _RequestContext(self._request(method, url, **kwargs))
+
+    async def _request(self, method, url, params=None, **kwargs):
+        key = request_key(method, request_url(url, params))
+        if not self.interactions.get(key):
+            expected = [pending for pending, queue in self.interactions.items()
+                        if queue]
+            raise CassetteError('Unexpected request {}, expected one of: {}'
+                                .format(key, ', '.join(expected) or 'none'))
+        interaction = self.interactions[key].popleft()
+
+        if self.speed:
+            await asyncio.sleep(interaction['elapsed'] / self.speed)
+
+        response = interaction['response']
+        self.logger.debug('Replaying {} -> {}'.format(key, response['status']))
+        if 'body_md5' in response:
+            return RecordedResponse(
+                response['status'], response['reason'], response['headers'],
+                body_path=os.path.join(self.bodies_directory,
+                                       response['body_md5']))
+        return RecordedResponse(response['status'], response['reason'],
+                                response['headers'],
+                                base64.b64decode(response['body']))
+
+    async def close(self):
+        pass
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+from enum import Enum
+
+from aiohttp.client_exceptions import ClientError
+
+from .errors import APIError, CircuitOpenError
+
+# state of a circuit breaker
+CircuitState = Enum('CircuitState', 'closed open half_open')
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker for one endpoint class of the DDI API.
+
+    Used as async context manager around requests. After
+    ``failure_threshold`` consecutive overload failures (429, 5xx, timeouts,
+    connection errors) or a response with Retry-After, the circuit opens and
+    requests fail immediately with ``CircuitOpenError`` instead of adding load
+    to the server. After the reset timeout (doubled with each failed probe, at
+    least the Retry-After value) a single probe request is let through
+    (half-open); its success closes the circuit again.
+    """
+    def __init__(self, name, failure_threshold=3, reset_timeout=30,
+                 max_reset_timeout=3600, clock=time.monotonic):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.clock = clock
+        self.state = CircuitState.closed
+        self.failures = 0
+        self.open_count = 0
+        self.open_until = 0
+        self.probing = False
+
+    @property
+    def retry_after(self):
+        """Seconds until requests are allowed again."""
+        return max(0, self.open_until - self.clock())
+
+    def before_request(self):
+        if self.state is CircuitState.open and self.retry_after == 0:
+            self.logger.info('Circuit {} half-open, probing'.format(self.name))
+            self.state = CircuitState.half_open
+            self.probing = False
+
+        if self.state is CircuitState.open or \
+                (self.state is CircuitState.half_open and self.probing):
+            raise CircuitOpenError(
+                'Circuit {} open, not sending request'.format(self.name),
+                retry_after=self.retry_after or self.reset_timeout)
+
+        if self.state is CircuitState.half_open:
+            self.probing = True
+
+    def record_success(self):
+        if self.state is not CircuitState.closed:
+            self.logger.info('Circuit {} closed'.format(self.name))
+        self.state = CircuitState.closed
+        self.failures = 0
+        self.open_count = 0
+        self.probing = False
+
+    def record_failure(self, retry_after=None):
+        self.failures += 1
+        if self.state is CircuitState.half_open or retry_after or \
+                self.failures >= self.failure_threshold:
+            timeout = min(self.reset_timeout * 2 ** self.open_count,
+                          self.max_reset_timeout)
+            timeout = max(timeout, retry_after or 0)
+            self.logger.warning('Circuit {} open for {} seconds'.format(
+                self.name, timeout))
+            self.state = CircuitState.open
+            self.open_count += 1
+            self.open_until = self.clock() + timeout
+        self.probing = False
+
+    async def __aenter__(self):
+        self.before_request()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.record_success()
+        elif isinstance(exc, APIError) and exc.status is not None:
+            if exc.status == 429 or exc.status >= 500:
+                self.record_failure(exc.retry_after)
+            else:
+                # server is responsive, error is not load related
+                self.record_success()
+        elif isinstance(exc, (ClientError, asyncio.TimeoutError)):
+            self.record_failure()
+        else:
+            # e.g. cancelled, let the next request probe again
+            self.probing = False
+        return False
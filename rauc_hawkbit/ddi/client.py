@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import json
 import hashlib
 import logging
@@ -8,9 +9,11 @@ from aiohttp.client import ClientTimeout
 from datetime import datetime
 from enum import Enum
 
+from .circuit_breaker import CircuitBreaker
 from .deployment_base import DeploymentBase
-from .softwaremodules import SoftwareModules
-from .cancel_action import CancelAction
+from .errors import APIError, ServerBusyError, parse_retry_after
+from .progress import DownloadProgress
+from .scheduler import RequestClass, RequestScheduler
 
 # status of the action execution
 ConfigStatusExecution = Enum('ConfigStatusExecution',
@@ -22,10 +25,6 @@ ConfigStatusResult = Enum('ConfigStatusResultFinished',
                           'success failure none')
 
 
-class APIError(Exception):
-    pass
-
-
 class DDIClient(object):
     """
     Base Direct Device Integration API client providing GET, POST and PUT
@@ -39,10 +38,12 @@ class DDIClient(object):
         404: 'Resource not available or device unknown.',
         405: 'Method Not Allowed',
         406: 'Accept header is specified and is not application/json.',
-        429: 'Too many requests.'
+        429: 'Too many requests.',
+        503: 'Service unavailable.'
     }
 
-    def __init__(self, session, host, ssl, auth_token, tenant_id, controller_id, timeout=10):
+    def __init__(self, session, host, ssl, auth_token, tenant_id, controller_id, timeout=10,
+                 scheduler=None):
         self.session = session
         self.host = host
         self.ssl = ssl
@@ -51,6 +52,14 @@ class DDIClient(object):
         self.tenant = tenant_id
         self.controller_id = controller_id
         self.timeout = timeout
+        # orders requests by priority class, see statistics() for queueing
+        # delays
+        self.scheduler = scheduler or RequestScheduler()
+        # per endpoint class: poll, feedback (control) and download (bulk)
+        self.circuit_breakers = {
+            request_class: CircuitBreaker(request_class.name)
+            for request_class in RequestClass
+        }
         # URL parts which get replaced lateron
         self.placeholders = ['tenant', 'target', 'softwaremodule', 'action',
                              'filename']
@@ -58,12 +67,17 @@ class DDIClient(object):
             '/MD5SUM': '.MD5SUM'
         }
 
+    # cancelation and download resources are loaded on first use to keep
+    # startup fast
+
     @property
     def cancelAction(self):
+        from .cancel_action import CancelAction
         return CancelAction(self)
 
     @property
     def softwaremodules(self):
+        from .softwaremodules import SoftwareModules
         return SoftwareModules(self)
 
     @property
@@ -138,7 +152,8 @@ class DDIClient(object):
         return '{protocol}://{host}{api_path}'.format(
             protocol=protocol, host=self.host, api_path=api_path)
 
-    async def get_resource(self, api_path, query_params={}, **kwargs):
+    async def get_resource(self, api_path, query_params={},
+                           request_class=RequestClass.poll, **kwargs):
         """
         Helper method for HTTP GET API requests.
 
@@ -146,6 +161,8 @@ class DDIClient(object):
             api_path(str): REST API path
         Keyword Args:
             query_params: Query parameters to add to the API URL
+            request_class: priority class of the request
+                  (default: RequestClass.poll)
             kwargs: Other keyword args used for replacing items in the API path
 
         Returns:
@@ -162,9 +179,11 @@ class DDIClient(object):
                     **kwargs))
 
         self.logger.debug('GET {}'.format(url))
-        async with self.session.get(url, headers=get_headers,
-                                    params=query_params,
-                                    timeout=ClientTimeout(self.timeout)) as resp:
+        async with self.circuit_breakers[request_class], \
+                self.scheduler.slot(request_class), \
+                self.session.get(url, headers=get_headers,
+                                 params=query_params,
+                                 timeout=ClientTimeout(self.timeout)) as resp:
             await self.check_http_status(resp)
             json = await resp.json()
             self.logger.debug(json)
@@ -172,7 +191,10 @@ class DDIClient(object):
 
     async def get_binary_resource(self, api_path, dl_location,
                                   mime='application/octet-stream',
-                                  timeout=3600, **kwargs):
+                                  timeout=3600, offset=0,
+                                  progress_callback=None,
+                                  progress_interval=1.0, block_verifier=None,
+                                  **kwargs):
         """
         Helper method for binary HTTP GET API requests.
 
@@ -184,6 +206,12 @@ class DDIClient(object):
         Keyword Args:
             mime: mimetype of content to retrieve
                   (default: 'application/octet-stream')
+            offset: resume download at this offset of ``dl_location``
+                  (default: 0)
+            progress_callback: called periodically with a ProgressEvent
+            progress_interval: seconds between progress events
+                  (default: 1.0)
+            block_verifier: BlockVerifier fed with the downloaded content
             kwargs: Other keyword args used for replacing items in the API path
 
         Returns:
@@ -194,11 +222,18 @@ class DDIClient(object):
                     tenant=self.tenant,
                     controllerId=self.controller_id,
                     **kwargs))
-        return await self.get_binary(url, dl_location, mime, timeout=timeout)
+        return await self.get_binary(url, dl_location, mime, timeout=timeout,
+                                     offset=offset,
+                                     progress_callback=progress_callback,
+                                     progress_interval=progress_interval,
+                                     block_verifier=block_verifier)
 
     async def get_binary(self, url, dl_location,
                          mime='application/octet-stream',
-                         timeout=3600):
+                         timeout=3600, offset=0, progress_callback=None,
+                         progress_interval=1.0, read_timeout=60,
+                         connect_timeout=None, authorize=True,
+                         circuit_breaker=None, block_verifier=None):
         """
         Actual download method with checksum checking.
 
@@ -210,39 +245,243 @@ class DDIClient(object):
                   (default: 'application/octet-stream')
             timeout: download timeout
                   (default: 3600)
+            offset: resume download at this offset, the first ``offset``
+                  bytes of ``dl_location`` are kept
+                  (default: 0)
+            progress_callback: called with a ProgressEvent (bytes,
+                  percentage, throughput, ETA) at most every
+                  ``progress_interval`` seconds and after completion
+            progress_interval: seconds between progress events
+                  (default: 1.0)
+            read_timeout: maximum time without data from the server
+                  (default: 60)
+            connect_timeout: maximum time to establish a connection
+                  (default: None, limited by ``timeout``)
+            authorize: send target token, disable for URLs not served by
+                  HawkBit such as mirrors
+                  (default: True)
+            circuit_breaker: CircuitBreaker to use instead of the bulk
+                  circuit breaker of this client, e.g. for mirrors
+                  (default: None)
+            block_verifier: BlockVerifier checking the blocks of the whole
+                  content (including resumed data) while it is written
+                  (default: None)
 
         Returns:
             MD5 hash of downloaded content
         """
-        get_bin_headers = {
-            'Accept': mime,
-            **self.headers
-        }
+        get_bin_headers = {'Accept': mime}
+        if authorize:
+            get_bin_headers.update(self.headers)
         hash_md5 = hashlib.md5()
 
-        self.logger.debug('GET binary {}'.format(url))
-
-        # session timeout & single socket read timeout
-        timeout = ClientTimeout(timeout, sock_read=60)
+        if offset:
+            self.logger.debug('GET binary {} from offset {}'.format(url, offset))
+        else:
+            self.logger.debug('GET binary {}'.format(url))
+
+        if block_verifier:
+            block_verifier.reset()
+        if offset:
+            # hash data downloaded so far
+            await self.hash_prefix(dl_location, offset, hash_md5,
+                                   block_verifier)
+
+        # session timeout, connect timeout & single socket read timeout
+        timeout = ClientTimeout(timeout, sock_connect=connect_timeout,
+                                sock_read=read_timeout)
+        circuit_breaker = circuit_breaker or \
+            self.circuit_breakers[RequestClass.bulk]
+        progress = None
+
+        while True:
+            # paused downloads close the connection and continue with a Range
+            # request once the governor resumes bulk transfers
+            await self.scheduler.bulk_resume()
+            headers = dict(get_bin_headers)
+            if offset:
+                headers['Range'] = 'bytes={}-'.format(offset)
+            paused = False
+
+            async with circuit_breaker, \
+                    self.scheduler.slot(RequestClass.bulk), \
+                    self.session.get(url, headers=headers,
+                                     timeout=timeout) as resp:
+
+                await self.check_http_status(resp, expected=(200, 206))
+                # servers not supporting ranges send the whole content
+                if resp.status == 200 and offset:
+                    offset = 0
+                    hash_md5 = hashlib.md5()
+                    if block_verifier:
+                        block_verifier.reset()
+                    progress = None
+
+                end = None
+                if resp.content_length is not None:
+                    end = offset + resp.content_length
+                if progress_callback and progress is None:
+                    progress = DownloadProgress(progress_callback, end,
+                                                offset, progress_interval)
+
+                with open(dl_location, 'r+b' if offset else 'wb') as fd:
+                    fd.seek(offset)
+                    fd.truncate()
+
+                    while True:
+                        chunk = await self.read_bulk_chunk(resp)
+
+                        # we are EOF
+                        if not chunk:
+                            break
+
+                        fd.write(chunk)
+                        offset += len(chunk)
+                        hash_md5.update(chunk)
+                        if block_verifier:
+                            block_verifier.update(chunk)
+                        if progress:
+                            progress.update(len(chunk))
+                        await self.scheduler.bulk_checkpoint(len(chunk),
+                                                             pause=False)
+                        if self.scheduler.bulk_paused and \
+                                (end is None or offset < end):
+                            paused = True
+                            break
+
+            if not paused:
+                break
+            self.logger.info('Download of {} paused at offset {}'.format(
+                url, offset))
+
+        if block_verifier:
+            block_verifier.finish()
+        if progress:
+            progress.finish()
 
-        async with self.session.get(url, headers=get_bin_headers,
-                                    timeout=timeout) as resp:
-
-            await self.check_http_status(resp)
-            with open(dl_location, 'wb') as fd:
-                while True:
-                    chunk, _ = await resp.content.readchunk()
-
-                    # we are EOF
-                    if not chunk:
-                        break
+        return hash_md5.hexdigest()
 
-                    fd.write(chunk)
-                    hash_md5.update(chunk)
+    async def hash_prefix(self, dl_location, size, hash_md5,
+                          block_verifier=None, chunk_size=1024*1024):
+        """
+        Feed the first ``size`` bytes of ``dl_location`` to ``hash_md5`` and
+        ``block_verifier``. Reading and hashing run in the executor chunk by
+        chunk, paced by ``bulk_checkpoint()`` like bulk transfers.
+        """
+        loop = asyncio.get_event_loop()
+
+        def hash_chunk(fd):
+            chunk = fd.read(min(size - fd.tell(), chunk_size))
+            hash_md5.update(chunk)
+            if block_verifier:
+                block_verifier.update(chunk)
+            return len(chunk)
+
+        with open(dl_location, 'rb') as fd:
+            hashed = 0
+            while hashed < size:
+                length = await loop.run_in_executor(None, hash_chunk, fd)
+                if not length:
+                    raise APIError('Cannot resume beyond end of file')
+                hashed += length
+                await self.scheduler.bulk_checkpoint(length)
+
+    async def get_binary_ranges(self, url, dl_location, ranges,
+                                mime='application/octet-stream',
+                                timeout=3600, progress_callback=None,
+                                progress_interval=1.0):
+        """
+        Download byte ranges of an item into an existing file using HTTP Range
+        requests. Each range is written at its own offset in ``dl_location``.
 
-        return hash_md5.hexdigest()
+        Args:
+            url(str): URL of item to download
+            dl_location(str): existing file to write the ranges to
+            ranges(list): (start, end) byte ranges, end inclusive
+        Keyword Args:
+            mime: mimetype of content to retrieve
+                  (default: 'application/octet-stream')
+            timeout: download timeout per range
+                  (default: 3600)
+            progress_callback: called with a ProgressEvent at most every
+                  ``progress_interval`` seconds and after completion
+            progress_interval: seconds between progress events
+                  (default: 1.0)
 
-    async def post_resource(self, api_path, data, **kwargs):
+        Returns:
+            Number of bytes downloaded
+        """
+        timeout = ClientTimeout(timeout, sock_read=60)
+        received = 0
+        progress = None
+        if progress_callback:
+            total = sum(end - start + 1 for start, end in ranges)
+            progress = DownloadProgress(progress_callback, total,
+                                        interval=progress_interval)
+
+        with open(dl_location, 'r+b') as fd:
+            for start, end in ranges:
+                # paused transfers close the connection and request the rest
+                # of the range once the governor resumes bulk transfers
+                while start <= end:
+                    await self.scheduler.bulk_resume()
+                    get_bin_headers = {
+                        'Accept': mime,
+                        'Range': 'bytes={}-{}'.format(start, end),
+                        **self.headers
+                    }
+                    self.logger.debug('GET binary {} bytes={}-{}'.format(
+                        url, start, end))
+                    paused = False
+
+                    async with self.circuit_breakers[RequestClass.bulk], \
+                            self.scheduler.slot(RequestClass.bulk), \
+                            self.session.get(url, headers=get_bin_headers,
+                                             timeout=timeout) as resp:
+                        # servers ignoring the Range header reply with 200
+                        await self.check_http_status(resp, expected=(206,))
+                        fd.seek(start)
+                        while True:
+                            chunk = await self.read_bulk_chunk(resp)
+
+                            # we are EOF
+                            if not chunk:
+                                break
+
+                            fd.write(chunk)
+                            received += len(chunk)
+                            if progress:
+                                progress.update(len(chunk))
+                            await self.scheduler.bulk_checkpoint(len(chunk),
+                                                                 pause=False)
+                            if self.scheduler.bulk_paused and \
+                                    fd.tell() <= end:
+                                paused = True
+                                break
+
+                    if not paused and fd.tell() != end + 1:
+                        raise APIError('Range {}-{} incomplete'.format(
+                            start, end))
+                    start = fd.tell()
+
+        if progress:
+            progress.finish()
+
+        return received
+
+    async def read_bulk_chunk(self, resp):
+        """
+        Read the next chunk of a bulk transfer, at most the chunk size allowed
+        by the scheduler or all data available.
+        """
+        chunk_size = self.scheduler.chunk_size
+        if chunk_size:
+            return await resp.content.read(chunk_size)
+        chunk, _ = await resp.content.readchunk()
+        return chunk
+
+    async def post_resource(self, api_path, data,
+                            request_class=RequestClass.control, **kwargs):
         """
         Helper method for HTTP POST API requests.
 
@@ -250,6 +489,8 @@ class DDIClient(object):
             api_path(str): REST API path
             data: JSON data for POST request
         Keyword Args:
+            request_class: priority class of the request
+                  (default: RequestClass.control)
             kwargs: keyword args used for replacing items in the API path
         """
         post_headers = {
@@ -264,12 +505,15 @@ class DDIClient(object):
                     **kwargs))
         self.logger.debug('POST {}'.format(url))
 
-        async with self.session.post(url, headers=post_headers,
-                                     data=json.dumps(data),
-                                     timeout=ClientTimeout(self.timeout)) as resp:
+        async with self.circuit_breakers[request_class], \
+                self.scheduler.slot(request_class), \
+                self.session.post(url, headers=post_headers,
+                                  data=json.dumps(data),
+                                  timeout=ClientTimeout(self.timeout)) as resp:
             await self.check_http_status(resp)
 
-    async def put_resource(self, api_path, data, **kwargs):
+    async def put_resource(self, api_path, data,
+                           request_class=RequestClass.control, **kwargs):
         """
         Helper method for HTTP PUT API requests.
 
@@ -277,6 +521,8 @@ class DDIClient(object):
             api_path(str): REST API path
             data: JSON data for POST request
         Keyword Args:
+            request_class: priority class of the request
+                  (default: RequestClass.control)
             kwargs: keyword args used for replacing items in the API path
         """
         put_headers = {
@@ -289,16 +535,24 @@ class DDIClient(object):
                     controllerId=self.controller_id,
                     **kwargs))
         self.logger.debug('PUT {}'.format(url))
-        self.logger.debug(json.dumps(data))
-
-        async with self.session.put(url, headers=put_headers,
-                                    data=json.dumps(data),
-                                    timeout=ClientTimeout(self.timeout)) as resp:
+        # avoid serializing twice unless debugging
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(json.dumps(data))
+
+        async with self.circuit_breakers[request_class], \
+                self.scheduler.slot(request_class), \
+                self.session.put(url, headers=put_headers,
+                                 data=json.dumps(data),
+                                 timeout=ClientTimeout(self.timeout)) as resp:
             await self.check_http_status(resp)
 
-    async def check_http_status(self, resp):
+    def statistics(self):
+        """Returns queueing delay statistics per request class."""
+        return self.scheduler.statistics()
+
+    async def check_http_status(self, resp, expected=(200,)):
         """Log API error message."""
-        if resp.status != 200:
+        if resp.status not in expected:
             error_description = await resp.text()
             if error_description:
                 self.logger.debug('API error: {}'.format(error_description))
@@ -308,5 +562,9 @@ class DDIClient(object):
             else:
                 reason = resp.reason
 
-            raise APIError('{status}: {reason}'.format(
-                status=resp.status, reason=reason))
+            message = '{status}: {reason}'.format(status=resp.status,
+                                                  reason=reason)
+            retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            if resp.status in (429, 503):
+                raise ServerBusyError(message, resp.status, retry_after)
+            raise APIError(message, resp.status, retry_after)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class APIError(Exception):
+    """
+    Error response from or error communicating with the DDI API.
+
+    Attributes:
+        status: HTTP status code, None if not caused by an HTTP response
+        retry_after: seconds to wait before the next request as suggested by
+                     the server (Retry-After), None if not provided
+    """
+    def __init__(self, message, status=None, retry_after=None):
+        super(APIError, self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ServerBusyError(APIError):
+    """The server is overloaded (429 Too Many Requests or 503)."""
+    pass
+
+
+class CircuitOpenError(APIError):
+    """Request not sent, the endpoint's circuit breaker is open."""
+    pass
+
+
+def parse_retry_after(value):
+    """
+    Parse Retry-After header value (delay in seconds or HTTP date).
+
+    Returns:
+        Delay in seconds or None if not parsable
+    """
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0, int((date - datetime.now(timezone.utc)).total_seconds()))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import namedtuple
+
+# received/total in bytes (total is None if unknown), throughput in bytes per
+# second, eta in seconds (None if unknown)
+ProgressEvent = namedtuple('ProgressEvent',
+                           'received total percentage throughput eta')
+
+
+class DownloadProgress(object):
+    """
+    Tracks the progress of a download and reports it to ``callback`` at most
+    once per ``interval`` seconds.
+
+    ``update()`` is called for each chunk and only adds up the received bytes;
+    throughput (exponentially smoothed) and ETA are calculated once per
+    interval.
+    """
+    def __init__(self, callback, total=None, received=0, interval=1.0,
+                 smoothing=0.3, clock=time.monotonic):
+        self.callback = callback
+        self.total = total
+        self.received = received
+        self.interval = interval
+        self.smoothing = smoothing
+        self.clock = clock
+        self.throughput = None
+
+        self.last_time = clock()
+        self.last_received = received
+        self.next_report = self.last_time + interval
+
+    def update(self, size):
+        self.received += size
+        now = self.clock()
+        if now >= self.next_report:
+            self.report(now)
+
+    def finish(self):
+        """Report final progress."""
+        self.report(self.clock())
+
+    def report(self, now):
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            current = (self.received - self.last_received) / elapsed
+            if self.throughput is None:
+                self.throughput = current
+            else:
+                self.throughput = self.smoothing * current + \
+                    (1 - self.smoothing) * self.throughput
+        self.last_time = now
+        self.last_received = self.received
+        self.next_report = now + self.interval
+
+        self.callback(self.event())
+
+    def event(self):
+        percentage = None
+        eta = None
+        if self.total:
+            percentage = min(100, int(self.received * 100 / self.total))
+            if self.throughput:
+                eta = max(0, self.total - self.received) / self.throughput
+        return ProgressEvent(self.received, self.total, percentage,
+                             self.throughput or 0.0, eta)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+import time
+from enum import Enum
+
+# priority classes of HTTP requests, highest priority first:
+# control: feedback, configData and cancelAction requests hawkBit waits on
+# poll: base resource and deployment information
+# bulk: artifact downloads
+RequestClass = Enum('RequestClass', 'control poll bulk')
+
+
+class QueueStats(object):
+    """Queueing delay statistics of a request class."""
+    def __init__(self):
+        self.requests = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self.queued = 0
+        self.running = 0
+
+    def add(self, delay):
+        self.requests += 1
+        self.total_delay += delay
+        self.max_delay = max(self.max_delay, delay)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'queued': self.queued,
+            'running': self.running,
+            'mean_delay': self.total_delay / self.requests if self.requests else 0.0,
+            'max_delay': self.max_delay,
+        }
+
+
+class RequestSlot(object):
+    """Async context manager holding a scheduler slot for one request."""
+    def __init__(self, scheduler, request_class):
+        self.scheduler = scheduler
+        self.request_class = request_class
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.request_class)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(self.request_class)
+
+
+class RequestScheduler(object):
+    """
+    Orders the HTTP requests of a DDIClient by priority class.
+
+    At most ``max_requests`` requests run at the same time, each class is
+    additionally limited by ``limits``. Waiting requests are started in
+    priority order. While control requests are running, bulk transfers pause
+    at their next ``bulk_checkpoint()`` for up to ``max_bulk_pause`` seconds.
+
+    An optional ``governor`` (see ``rauc_hawkbit.governor``) additionally
+    limits chunk size and rate of bulk transfers according to the device
+    workload and pauses them under high load. Bulk concurrency is not
+    adapted, the bulk class is limited to one transfer by default and paused
+    downloads give up their slot until ``bulk_resume()`` returns.
+    """
+    default_limits = {
+        RequestClass.control: 2,
+        RequestClass.poll: 1,
+        RequestClass.bulk: 1,
+    }
+
+    def __init__(self, limits=None, max_requests=4, max_bulk_pause=2.0,
+                 governor=None):
+        self.limits = dict(self.default_limits)
+        self.limits.update(limits or {})
+        self.max_requests = max_requests
+        self.max_bulk_pause = max_bulk_pause
+        self.governor = governor
+        self.running = 0
+        self.stats = {request_class: QueueStats()
+                      for request_class in RequestClass}
+        # heap of (priority, sequence number, request class, queued since,
+        # future)
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.control_idle = asyncio.Event()
+        self.control_idle.set()
+
+    def slot(self, request_class):
+        """Returns async context manager to run a request of this class."""
+        assert isinstance(request_class, RequestClass), \
+            'request_class must be RequestClass enum'
+        return RequestSlot(self, request_class)
+
+    def limit(self, request_class):
+        return self.limits[request_class]
+
+    def can_start(self, request_class):
+        return self.running < self.max_requests and \
+            self.stats[request_class].running < self.limit(request_class)
+
+    def start(self, request_class, queued_since):
+        self.running += 1
+        self.stats[request_class].running += 1
+        self.stats[request_class].add(time.monotonic() - queued_since)
+        if request_class is RequestClass.control:
+            self.control_idle.clear()
+
+    async def acquire(self, request_class):
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (request_class.value, next(self.sequence),
+                                      request_class, time.monotonic(), future))
+        self.stats[request_class].queued += 1
+        self.wakeup()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was granted already, hand it on
+                self.release(request_class)
+            else:
+                self.remove_waiter(future)
+            raise
+        finally:
+            self.stats[request_class].queued -= 1
+
+    def remove_waiter(self, future):
+        self.waiters = [waiter for waiter in self.waiters
+                        if waiter[-1] is not future]
+        heapq.heapify(self.waiters)
+
+    def release(self, request_class):
+        self.running -= 1
+        self.stats[request_class].running -= 1
+        if self.stats[RequestClass.control].running == 0:
+            self.control_idle.set()
+        self.wakeup()
+
+    def wakeup(self):
+        """Start waiting requests in priority order."""
+        for waiter in sorted(self.waiters):
+            _, _, request_class, queued_since, future = waiter
+            if self.running >= self.max_requests:
+                break
+            if future.cancelled():
+                self.remove_waiter(future)
+            elif self.can_start(request_class):
+                self.remove_waiter(future)
+                self.start(request_class, queued_since)
+                future.set_result(None)
+
+    async def bulk_checkpoint(self, size=0, pause=True):
+        """
+        Called by bulk transfers after each chunk of ``size`` bytes, pauses
+        while control requests are running and as long as the governor
+        requires. With ``pause`` disabled, governor pauses are left to the
+        caller (see ``bulk_paused`` and ``bulk_resume()``).
+        """
+        if self.governor:
+            await self.governor.throttle(size, pause)
+        if self.control_idle.is_set():
+            return
+        try:
+            await asyncio.wait_for(self.control_idle.wait(),
+                                   self.max_bulk_pause)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def bulk_paused(self):
+        """True if the governor paused bulk transfers."""
+        return bool(self.governor) and self.governor.paused
+
+    async def bulk_resume(self):
+        """Waits until the governor resumes paused bulk transfers."""
+        if self.governor:
+            await self.governor.wait_resumed()
+
+    @property
+    def paused_time(self):
+        """Seconds bulk transfers were paused by the governor."""
+        return self.governor.paused_time if self.governor else 0.0
+
+    @property
+    def chunk_size(self):
+        """Maximum read size of bulk transfers or None for any size."""
+        return self.governor.chunk_size if self.governor else None
+
+    def statistics(self):
+        """
+        Returns queueing statistics per request class name and the governor
+        decisions.
+        """
+        statistics = {request_class.name: stats.as_dict()
+                      for request_class, stats in self.stats.items()}
+        if self.governor:
+            statistics['governor'] = self.governor.statistics()
+        return statistics
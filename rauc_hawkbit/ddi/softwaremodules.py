@@ -10,13 +10,17 @@ class FileName(object):
         self.software_module_id = software_module_id
         self.file_name = file_name
 
-    async def __call__(self, bundle_dl_location):
+    async def __call__(self, bundle_dl_location, offset=0,
+                       progress_callback=None, progress_interval=1.0,
+                       block_verifier=None):
         """
         See http://sp.apps.bosch-iot-cloud.com/documentation/rest-api/rootcontroller-api-guide.html#_get_tenant_controller_v1_targetid_softwaremodules_softwaremoduleid_artifacts_filename # noqa
         """
         return await self.ddi.get_binary_resource(
-            '/{tenant}/controller/v1/{controllerId}/softwaremodules/{moduleId}/artifacts/{filename}', bundle_dl_location, moduleId=self.software_module_id,
-            filename=self.file_name)
+            '/{tenant}/controller/v1/{controllerId}/softwaremodules/{moduleId}/artifacts/{filename}', bundle_dl_location, offset=offset,
+            progress_callback=progress_callback,
+            progress_interval=progress_interval, block_verifier=block_verifier,
+            moduleId=self.software_module_id, filename=self.file_name)
 
     async def MD5SUM(self, md5_dl_location):
         """
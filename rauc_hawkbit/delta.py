@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+
+class DeltaError(Exception):
+    pass
+
+
+class BlockIndex(object):
+    """
+    Block-hash index of an artifact, as published next to the artifact (e.g.
+    ``bundle.raucb.blockidx``).
+
+    The index is a JSON document of the form::
+
+        {
+            "algorithm": "sha256",
+            "block_size": 65536,
+            "size": 123456789,
+            "hashes": ["<hex digest of block 0>", ...]
+        }
+
+    The last block may be shorter than ``block_size``.
+    """
+    def __init__(self, block_size, size, hashes, algorithm='sha256'):
+        if algorithm not in hashlib.algorithms_available:
+            raise DeltaError('Unsupported block hash algorithm: {}'.format(
+                algorithm))
+        if block_size <= 0:
+            raise DeltaError('Invalid block size: {}'.format(block_size))
+        if len(hashes) != (size + block_size - 1) // block_size:
+            raise DeltaError('Block count does not match artifact size')
+
+        self.block_size = block_size
+        self.size = size
+        self.hashes = hashes
+        self.algorithm = algorithm
+
+    @classmethod
+    def from_json(cls, data):
+        """Create index from its JSON representation (str or bytes)."""
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        try:
+            index = json.loads(data)
+            return cls(index['block_size'], index['size'], index['hashes'],
+                       index.get('algorithm', 'sha256'))
+        except (ValueError, KeyError, TypeError) as e:
+            raise DeltaError('Invalid block index: {}'.format(e))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as fd:
+            return cls.from_json(fd.read())
+
+    @classmethod
+    def build(cls, path, block_size=64*1024, algorithm='sha256'):
+        """Create index for the file at ``path``."""
+        hashes = [digest for _, _, digest in
+                  iter_blocks(path, block_size, algorithm)]
+        return cls(block_size, os.path.getsize(path), hashes, algorithm)
+
+    def to_json(self):
+        return json.dumps({
+            'algorithm': self.algorithm,
+            'block_size': self.block_size,
+            'size': self.size,
+            'hashes': self.hashes,
+        })
+
+    def block_range(self, block):
+        """Returns (start, end) byte offsets of ``block``, end inclusive."""
+        start = block * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        return start, end
+
+
+def iter_blocks(path, block_size, algorithm='sha256'):
+    """
+    Yields (offset, length, hex digest) for each block of the file or block
+    device at ``path``.
+    """
+    offset = 0
+    with open(path, 'rb') as fd:
+        while True:
+            block = fd.read(block_size)
+            if not block:
+                break
+            yield offset, len(block), hashlib.new(algorithm, block).hexdigest()
+            offset += len(block)
+
+
+def merge_ranges(blocks, index):
+    """
+    Merge adjacent block numbers to a list of (start, end) byte ranges, end
+    inclusive.
+    """
+    ranges = []
+    for block in sorted(blocks):
+        start, end = index.block_range(block)
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+class BlockVerifier(object):
+    """
+    Checks the blocks of an artifact against its ``BlockIndex`` while the
+    artifact is written, so corrupt blocks are known when the transfer ends
+    and can be re-fetched as byte ranges.
+
+    ``update()`` must be called with the artifact data in order, starting at
+    offset 0 after ``reset()``.
+    """
+    def __init__(self, index):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.index = index
+        self.reset()
+
+    def reset(self):
+        self.block = 0
+        self.filled = 0
+        self.hash = hashlib.new(self.index.algorithm)
+        # block numbers, blocks beyond the index are not recorded
+        self.bad_blocks = set()
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            length = min(len(view), self.index.block_size - self.filled)
+            self.hash.update(view[:length])
+            self.filled += length
+            view = view[length:]
+            if self.filled == self.index.block_size:
+                self.finish_block()
+
+    def finish_block(self):
+        if self.block < len(self.index.hashes) and \
+                self.hash.hexdigest() != self.index.hashes[self.block]:
+            if not self.bad_blocks:
+                self.logger.warning('Block {} of artifact is corrupt'.format(
+                    self.block))
+            self.bad_blocks.add(self.block)
+        self.block += 1
+        self.filled = 0
+        self.hash = hashlib.new(self.index.algorithm)
+
+    def finish(self):
+        """Called at the end of the data, missing blocks count as bad."""
+        if self.filled:
+            self.finish_block()
+        self.bad_blocks.update(range(self.block, len(self.index.hashes)))
+
+    @property
+    def repairable(self):
+        """Whether re-fetching the bad blocks is worth it."""
+        return 0 < len(self.bad_blocks) < len(self.index.hashes)
+
+
+class DeltaPlan(object):
+    """
+    Describes how to assemble an artifact from local seed data and downloaded
+    byte ranges.
+    """
+    def __init__(self, index, copies, missing):
+        self.index = index
+        # [(block, seed path, seed offset)]
+        self.copies = copies
+        # [(start, end)] byte ranges to download, end inclusive
+        self.missing = merge_ranges(missing, index)
+
+    @property
+    def missing_bytes(self):
+        return sum(end - start + 1 for start, end in self.missing)
+
+    @property
+    def reused_bytes(self):
+        return self.index.size - self.missing_bytes
+
+
+def plan(index, seeds):
+    """
+    Compare the block index with local seed files (e.g. a cached previous
+    bundle or the inactive slot) and find out which blocks can be reused.
+
+    Args:
+        index(BlockIndex): block index of the artifact to assemble
+        seeds(list): paths of files or block devices to take blocks from
+
+    Returns:
+        DeltaPlan
+    """
+    logger = logging.getLogger('rauc_hawkbit')
+    wanted = set(index.hashes)
+    # block hash: (seed path, seed offset)
+    available = {}
+
+    for seed in seeds:
+        if not os.path.exists(seed):
+            logger.debug('Delta seed {} does not exist'.format(seed))
+            continue
+        try:
+            for offset, _, digest in iter_blocks(seed, index.block_size,
+                                                 index.algorithm):
+                if digest in wanted and digest not in available:
+                    available[digest] = (seed, offset)
+        except OSError as e:
+            logger.warning('Cannot read delta seed {}: {}'.format(seed, e))
+
+    copies = []
+    missing = []
+    for block, digest in enumerate(index.hashes):
+        if digest in available:
+            seed, offset = available[digest]
+            copies.append((block, seed, offset))
+        else:
+            missing.append(block)
+
+    return DeltaPlan(index, copies, missing)
+
+
+def assemble(delta_plan, dl_location):
+    """
+    Create ``dl_location`` with the artifact size and copy all reusable blocks
+    from the seeds into it. Missing ranges must be downloaded afterwards.
+    """
+    index = delta_plan.index
+    seed_fds = {}
+    try:
+        with open(dl_location, 'wb') as fd:
+            fd.truncate(index.size)
+            for block, seed, seed_offset in delta_plan.copies:
+                if seed not in seed_fds:
+                    seed_fds[seed] = open(seed, 'rb')
+                start, end = index.block_range(block)
+                seed_fd = seed_fds[seed]
+                seed_fd.seek(seed_offset)
+                fd.seek(start)
+                fd.write(seed_fd.read(end - start + 1))
+    finally:
+        for seed_fd in seed_fds.values():
+            seed_fd.close()
+
+
+async def throttled_file_md5(path, checkpoint=None, verifier=None,
+                             chunk_size=1024*1024):
+    """
+    Returns MD5 hash of the file at ``path``, optionally checking all its
+    blocks with a BlockVerifier.
+
+    The file is read and hashed chunk by chunk in the executor, after each
+    chunk ``checkpoint(size)`` (e.g. RequestScheduler.bulk_checkpoint) is
+    awaited, so hashing is paced like bulk transfers.
+    """
+    loop = asyncio.get_event_loop()
+    hash_md5 = hashlib.md5()
+    if verifier:
+        verifier.reset()
+
+    def hash_chunk(fd):
+        chunk = fd.read(chunk_size)
+        hash_md5.update(chunk)
+        if verifier:
+            verifier.update(chunk)
+        return len(chunk)
+
+    with open(path, 'rb') as fd:
+        while True:
+            size = await loop.run_in_executor(None, hash_chunk, fd)
+            if not size:
+                break
+            if checkpoint:
+                await checkpoint(size)
+    if verifier:
+        verifier.finish()
+    return hash_md5.hexdigest()
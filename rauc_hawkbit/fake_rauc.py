@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import subprocess
+import threading
+import time
+
+RAUC_NAME = 'de.pengutronix.rauc'
+RAUC_INTERFACE = 'de.pengutronix.rauc.Installer'
+
+INTROSPECTION = '''
+<node>
+  <interface name="de.pengutronix.rauc.Installer">
+    <method name="Install">
+      <arg type="s" name="source" direction="in"/>
+    </method>
+    <method name="InstallBundle">
+      <arg type="s" name="source" direction="in"/>
+      <arg type="a{sv}" name="args" direction="in"/>
+    </method>
+    <method name="GetSlotStatus">
+      <arg type="a(sa{sv})" name="slot_status_array" direction="out"/>
+    </method>
+    <method name="GetPrimary">
+      <arg type="s" name="primary" direction="out"/>
+    </method>
+    <signal name="Completed">
+      <arg type="i" name="result"/>
+    </signal>
+    <property name="Operation" type="s" access="read"/>
+    <property name="LastError" type="s" access="read"/>
+    <property name="Progress" type="(isi)" access="read"/>
+  </interface>
+</node>
+'''
+
+
+class PrivateBus(object):
+    """
+    Private D-Bus session bus (``dbus-daemon``) for tests and benchmarks.
+    Clients connect to it via ``bus_address=bus.address``.
+    """
+    def __init__(self):
+        self.process = None
+        self.address = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ['dbus-daemon', '--session', '--nofork', '--print-address'],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        self.address = self.process.stdout.readline().strip()
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+
+class FakeRaucInstaller(object):
+    """
+    Fake ``de.pengutronix.rauc.Installer`` service for end-to-end tests and
+    benchmarks of ``RaucDBUSDDIClient`` without a real RAUC.
+
+    Each ``Install`` call plays a scenario: ``progress_events`` Progress
+    property changes, emitted in bursts of ``burst_size`` changes every
+    ``burst_interval`` seconds, then an optional ``last_error`` and the
+    Completed signal with ``result`` (1 if ``last_error`` is set). Emission
+    times are recorded in ``emitted`` as (percentage, time.monotonic()) to
+    measure event-to-feedback latency.
+
+    ``slots`` ({slot name: {key: str value}}, e.g. ``state`` and
+    ``bundle.hash``) and ``primary`` are returned by GetSlotStatus and
+    GetPrimary.
+    """
+    def __init__(self, bus_address, progress_events=100, burst_size=1,
+                 burst_interval=0.0, last_error=None, result=0, slots=None,
+                 primary=None):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.bus_address = bus_address
+        self.progress_events = progress_events
+        self.burst_size = burst_size
+        self.burst_interval = burst_interval
+        self.last_error = last_error
+        self.result = result
+        self.slots = slots or {}
+        self.primary = primary
+
+        self.glib_bridge = None
+        self.connection = None
+        self.registration = None
+        self.scenario = None
+        self.installs = []
+        self.emitted = []
+        self.properties = {
+            'Operation': 'idle',
+            'LastError': '',
+            'Progress': (0, '', 1),
+        }
+        self.lock = threading.Lock()
+
+    def start(self):
+        from gi.repository import Gio
+        from .glib_bridge import GLibBridge
+
+        self.glib_bridge = GLibBridge()
+        self.glib_bridge.start()
+        flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | \
+            Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+        self.connection = self.glib_bridge.call(
+            Gio.DBusConnection.new_for_address_sync, self.bus_address, flags,
+            None, None)
+        # method calls are dispatched in the bridge thread
+        self.glib_bridge.call(self.register)
+
+    def register(self):
+        from gi.repository import Gio, GLib
+
+        node_info = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION)
+        self.registration = self.connection.register_object_with_closures(
+            '/', node_info.interfaces[0], self.handle_method_call,
+            self.handle_get_property, None)
+        self.connection.call_sync(
+            'org.freedesktop.DBus', '/org/freedesktop/DBus',
+            'org.freedesktop.DBus', 'RequestName',
+            GLib.Variant('(su)', (RAUC_NAME, 0)), None, 0, -1, None)
+
+    def stop(self):
+        if self.scenario:
+            self.scenario.join()
+        if self.glib_bridge:
+            if self.registration:
+                self.glib_bridge.call(self.connection.unregister_object,
+                                      self.registration)
+            self.glib_bridge.call(self.connection.close_sync, None)
+            self.glib_bridge.stop()
+            self.glib_bridge = None
+
+    def property_variant(self, name):
+        from gi.repository import GLib
+
+        signature = {'Operation': 's', 'LastError': 's', 'Progress': '(isi)'}
+        return GLib.Variant(signature[name], self.properties[name])
+
+    def handle_get_property(self, connection, sender, object_path,
+                            interface_name, property_name):
+        with self.lock:
+            return self.property_variant(property_name)
+
+    def handle_method_call(self, connection, sender, object_path,
+                           interface_name, method_name, parameters,
+                           invocation):
+        from gi.repository import GLib
+
+        if method_name == 'GetSlotStatus':
+            invocation.return_value(GLib.Variant('(a(sa{sv}))', ([
+                (name, {key: GLib.Variant('s', value)
+                        for key, value in status.items()})
+                for name, status in sorted(self.slots.items())],)))
+            return
+        if method_name == 'GetPrimary':
+            if self.primary is None:
+                invocation.return_dbus_error(
+                    '{}.Error.Failed'.format(RAUC_INTERFACE),
+                    'Unable to determine primary slot')
+            else:
+                invocation.return_value(GLib.Variant('(s)', (self.primary,)))
+            return
+
+        source = parameters.unpack()[0]
+        with self.lock:
+            busy = self.properties['Operation'] != 'idle'
+        if busy:
+            invocation.return_dbus_error(
+                '{}.Error.Busy'.format(RAUC_INTERFACE),
+                'Already processing a different method')
+            return
+
+        self.logger.info('Fake RAUC: installing {}'.format(source))
+        self.installs.append(source)
+        self.set_property('Operation', 'installing')
+        invocation.return_value(None)
+
+        self.scenario = threading.Thread(target=self.run_scenario,
+                                         name='fake-rauc', daemon=True)
+        self.scenario.start()
+
+    def set_property(self, name, value):
+        """Change property and emit PropertiesChanged (thread-safe)."""
+        from gi.repository import GLib
+
+        with self.lock:
+            self.properties[name] = value
+            changed = {name: self.property_variant(name)}
+        self.connection.emit_signal(
+            None, '/', 'org.freedesktop.DBus.Properties', 'PropertiesChanged',
+            GLib.Variant('(sa{sv}as)', (RAUC_INTERFACE, changed, [])))
+
+    def run_scenario(self):
+        from gi.repository import GLib
+
+        for event in range(self.progress_events):
+            percentage = (event + 1) * 100 // self.progress_events
+            self.emitted.append((percentage, time.monotonic()))
+            self.set_property('Progress', (percentage, 'Installing', 1))
+            if self.burst_interval and (event + 1) % self.burst_size == 0:
+                time.sleep(self.burst_interval)
+
+        result = self.result
+        if self.last_error:
+            self.set_property('LastError', self.last_error)
+            result = result or 1
+
+        self.set_property('Operation', 'idle')
+        self.connection.emit_signal(None, '/', RAUC_INTERFACE, 'Completed',
+                                    GLib.Variant('(i)', (result,)))
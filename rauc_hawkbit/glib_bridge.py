@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+
+class GLibBridge(object):
+    """
+    Runs a GLib main context in a dedicated thread and hands results to an
+    asyncio event loop.
+
+    D-Bus signal subscriptions and proxies created via ``call()`` dispatch
+    their callbacks in the bridge thread, so the asyncio event loop does not
+    need to integrate with GLib (e.g. via gbulb) and can be any loop
+    implementation such as uvloop.
+    """
+    def __init__(self, loop=None):
+        from gi.repository import GLib
+
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.loop = loop or asyncio.get_event_loop()
+        self.priority = GLib.PRIORITY_DEFAULT
+        self.context = GLib.MainContext.new()
+        self.main_loop = GLib.MainLoop.new(self.context, False)
+        self.thread = threading.Thread(target=self.run, name='glib-bridge',
+                                       daemon=True)
+        self.started = threading.Event()
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.context.invoke_full(self.priority, self.main_loop.quit)
+            self.thread.join()
+
+    def run(self):
+        self.context.push_thread_default()
+        self.started.set()
+        try:
+            self.main_loop.run()
+        finally:
+            self.context.pop_thread_default()
+
+    def in_bridge_thread(self):
+        return threading.current_thread() is self.thread
+
+    def call(self, func, *args):
+        """
+        Call ``func`` in the bridge thread and wait for its result.
+        Use for short synchronous GLib operations only, such as creating
+        proxies and signal subscriptions.
+        """
+        if self.in_bridge_thread():
+            return func(*args)
+
+        future = concurrent.futures.Future()
+
+        def invoke():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            # remove idle source
+            return False
+
+        self.context.invoke_full(self.priority, invoke)
+        return future.result()
+
+    def call_soon(self, callback, *args):
+        """Schedule ``callback`` in the asyncio event loop (thread-safe)."""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    async def call_async(self, start, finish):
+        """
+        Run an asynchronous GLib operation in the bridge thread.
+
+        Args:
+            start: called in the bridge thread with a GAsyncReadyCallback
+                   to start the operation
+            finish: called with the GAsyncResult to retrieve the result
+        Returns:
+            The result of ``finish``
+        """
+        future = self.loop.create_future()
+
+        def set_result(result):
+            if not future.cancelled():
+                future.set_result(result)
+
+        def set_exception(e):
+            if not future.cancelled():
+                future.set_exception(e)
+
+        def ready(source, res, *user_data):
+            try:
+                result = finish(res)
+            except Exception as e:
+                self.call_soon(set_exception, e)
+            else:
+                self.call_soon(set_result, result)
+
+        self.call(start, ready)
+        return await future
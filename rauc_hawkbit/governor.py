@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import logging
+import os
+import time
+from collections import namedtuple
+from enum import Enum
+
+# normal: full speed
+# throttled: limited write rate, small chunks
+# paused: bulk transfers wait until the device workload drops
+GovernorState = Enum('GovernorState', 'normal throttled paused')
+
+# cpu and io: PSI 'some' avg10 in percent (cpu falls back to the 1 minute load
+# average per core), memory: available memory in percent
+ResourceSample = namedtuple('ResourceSample', 'cpu io memory')
+
+# decision taken after a sample, exported via ResourceGovernor.statistics()
+Decision = namedtuple('Decision', 'time state reason rate sample')
+
+
+class ResourceGovernor(object):
+    """
+    Adapts bulk transfers (artifact downloads, hashing and writes) to the
+    device workload.
+
+    CPU and I/O pressure (PSI from ``/proc/pressure``, the load average if
+    PSI is not available) and available memory are sampled in the executor at
+    most every ``interval`` seconds while bulk transfers run. Crossing a
+    throttle threshold limits the write rate (halved with each sample, raised
+    again additively once the pressure drops) and reduces the chunk size to
+    ``throttled_chunk_size``. Crossing a pause threshold pauses bulk transfers
+    until the pressure drops, for at most ``max_pause`` seconds at a time.
+    Downloads close their HTTP response while paused and resume with a Range
+    request, hashing and copying wait in place.
+
+    Used by ``RequestScheduler`` via ``throttle()``, ``wait_resumed()`` and
+    ``chunk_size``. Decisions are logged to ``rauc_hawkbit.governor`` and
+    returned by ``statistics()`` for tuning.
+    """
+    default_thresholds = {
+        # (throttle, pause)
+        'cpu': (50.0, 80.0),
+        'io': (20.0, 50.0),
+        # available memory, lower is worse
+        'memory': (15.0, 5.0),
+    }
+
+    def __init__(self, thresholds=None, interval=1.0, max_rate=None,
+                 min_rate=256*1024, rate_step=1024*1024,
+                 throttled_chunk_size=64*1024, max_pause=300,
+                 proc_root='/proc', clock=time.monotonic):
+        self.logger = logging.getLogger('rauc_hawkbit.governor')
+        self.thresholds = dict(self.default_thresholds)
+        self.thresholds.update(thresholds or {})
+        self.interval = interval
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate_step = rate_step
+        self.throttled_chunk_size = throttled_chunk_size
+        self.max_pause = max_pause
+        self.proc_root = proc_root
+        self.clock = clock
+
+        self.state = GovernorState.normal
+        self.rate = max_rate
+        self.sample = None
+        self.last_sample = None
+        self.next_write = 0
+        self.pauses = 0
+        self.paused_time = 0.0
+        self.throttled_time = 0.0
+        self.decisions = collections.deque(maxlen=100)
+
+    def read_pressure(self, resource):
+        """Returns PSI 'some avg10' of resource or None if not available."""
+        path = os.path.join(self.proc_root, 'pressure', resource)
+        try:
+            with open(path) as fd:
+                for line in fd:
+                    fields = line.split()
+                    if fields and fields[0] == 'some':
+                        return float(dict(field.split('=')
+                                          for field in fields[1:])['avg10'])
+        except (OSError, KeyError, ValueError):
+            pass
+        return None
+
+    def read_loadavg(self):
+        try:
+            with open(os.path.join(self.proc_root, 'loadavg')) as fd:
+                load = float(fd.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return 0.0
+        return load * 100 / (os.cpu_count() or 1)
+
+    def read_memory(self):
+        """Returns available memory in percent."""
+        meminfo = {}
+        try:
+            with open(os.path.join(self.proc_root, 'meminfo')) as fd:
+                for line in fd:
+                    key, _, value = line.partition(':')
+                    meminfo[key] = int(value.split()[0])
+            return meminfo['MemAvailable'] * 100 / meminfo['MemTotal']
+        except (OSError, KeyError, ValueError, IndexError, ZeroDivisionError):
+            return 100.0
+
+    def read_sample(self):
+        cpu = self.read_pressure('cpu')
+        if cpu is None:
+            cpu = self.read_loadavg()
+        return ResourceSample(cpu, self.read_pressure('io') or 0.0,
+                              self.read_memory())
+
+    def classify(self, sample):
+        """Returns (state, reason) for a sample."""
+        for index, state in ((1, GovernorState.paused),
+                             (0, GovernorState.throttled)):
+            for resource in ('cpu', 'io'):
+                threshold = self.thresholds[resource][index]
+                if getattr(sample, resource) >= threshold:
+                    return state, '{} pressure {:.1f} >= {}'.format(
+                        resource, getattr(sample, resource), threshold)
+            threshold = self.thresholds['memory'][index]
+            if sample.memory <= threshold:
+                return state, 'available memory {:.1f}% <= {}%'.format(
+                    sample.memory, threshold)
+        return GovernorState.normal, 'below thresholds'
+
+    async def update(self):
+        """
+        Sample resources in the executor if the last sample is older than
+        interval.
+        """
+        now = self.clock()
+        elapsed = None
+        if self.last_sample is not None:
+            elapsed = now - self.last_sample
+            if elapsed < self.interval:
+                return
+        # concurrent callers keep the current decision meanwhile
+        self.last_sample = now
+        sample = await asyncio.get_event_loop().run_in_executor(
+            None, self.read_sample)
+        self.decide(sample, elapsed)
+
+    def decide(self, sample, elapsed=None):
+        """
+        Apply a sample taken ``elapsed`` seconds after the previous one.
+        """
+        if elapsed and self.state is GovernorState.throttled:
+            self.throttled_time += elapsed
+        self.sample = sample
+        state, reason = self.classify(sample)
+
+        # additive increase, multiplicative decrease of the write rate
+        if state is GovernorState.throttled:
+            rate = self.rate or self.max_rate or self.initial_rate()
+            self.rate = max(self.min_rate, rate / 2)
+        elif state is GovernorState.normal and self.rate is not None:
+            self.rate += self.rate_step
+            if self.rate >= (self.max_rate or self.initial_rate()):
+                self.rate = self.max_rate
+
+        if state is not self.state:
+            self.logger.info('Bulk transfers {}: {}'.format(state.name,
+                                                            reason))
+            if state is GovernorState.paused:
+                self.pauses += 1
+        self.state = state
+        self.decisions.append(Decision(time.time(), state.name, reason,
+                                       self.rate, sample._asdict()))
+
+    def initial_rate(self):
+        # no measured rate yet, start throttling from a generous value
+        return 16 * 1024 * 1024
+
+    @property
+    def chunk_size(self):
+        """Maximum read size of bulk transfers or None for any size."""
+        if self.state is GovernorState.normal:
+            return None
+        return self.throttled_chunk_size
+
+    @property
+    def paused(self):
+        return self.state is GovernorState.paused
+
+    async def wait_resumed(self):
+        """
+        Sample resources and wait while bulk transfers are paused, at most
+        ``max_pause`` seconds.
+        """
+        await self.update()
+        if not self.paused:
+            return
+        pause_start = self.clock()
+        while self.paused:
+            if self.clock() - pause_start >= self.max_pause:
+                self.logger.warning('Paused for {} seconds, continuing'.format(
+                    self.max_pause))
+                break
+            await asyncio.sleep(self.interval)
+            await self.update()
+        self.paused_time += self.clock() - pause_start
+
+    async def throttle(self, size, pause=True):
+        """
+        Called after ``size`` bytes of a bulk transfer were processed, waits
+        as long as the current decision requires. With ``pause`` disabled,
+        the caller checks ``paused`` and pauses itself (e.g. downloads close
+        their connection first).
+        """
+        if pause:
+            await self.wait_resumed()
+        else:
+            await self.update()
+
+        if self.rate and size:
+            now = self.clock()
+            self.next_write = max(self.next_write, now) + size / self.rate
+            if self.next_write > now:
+                await asyncio.sleep(self.next_write - now)
+
+    def statistics(self):
+        return {
+            'state': self.state.name,
+            'rate': self.rate,
+            'chunk_size': self.chunk_size,
+            'sample': self.sample._asdict() if self.sample else None,
+            'pauses': self.pauses,
+            'paused_time': self.paused_time,
+            'throttled_time': self.throttled_time,
+            'decisions': [decision._asdict() for decision in self.decisions],
+        }
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+from enum import Enum
+
+# phase of the deployment action
+DeploymentPhase = Enum('DeploymentPhase',
+                       'downloading installing awaiting_reboot')
+
+
+class DeploymentJournal(object):
+    """
+    Persists the state of the current deployment action, so that it can be
+    resumed after a restart of the client or a reboot of the device.
+
+    The state is a dict with at least ``action_id`` and ``phase`` and is
+    written atomically as JSON to ``path``. Without ``path`` the state is only
+    kept in memory.
+    """
+    def __init__(self, path=None):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.path = path
+        self.state = None
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as fd:
+                    self.state = json.load(fd)
+                self.state['phase'] = DeploymentPhase[self.state['phase']]
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.warning('Ignoring invalid journal {}: {}'.format(
+                    path, e))
+                self.state = None
+
+    @property
+    def action_id(self):
+        return self.state['action_id'] if self.state else None
+
+    @property
+    def phase(self):
+        return self.state['phase'] if self.state else None
+
+    def record(self, action_id, phase, **data):
+        """Enter ``phase`` for ``action_id``, keeps data of the same action."""
+        assert isinstance(phase, DeploymentPhase), \
+            'phase must be DeploymentPhase enum'
+
+        if self.action_id != action_id:
+            self.state = {}
+        self.state.update(data, action_id=action_id, phase=phase)
+        self.logger.debug('Journal: action {} {}'.format(action_id,
+                                                         phase.name))
+        self.write()
+
+    def clear(self):
+        """Forget the current action once its final result is reported."""
+        self.state = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self):
+        if not self.path:
+            return
+
+        state = dict(self.state, phase=self.state['phase'].name)
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fd:
+            json.dump(state, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import errno
+import fcntl
+import logging
+import os
+import shutil
+
+from .delta import throttled_file_md5
+
+# ioctl cloning a whole file (btrfs, XFS with reflink support)
+FICLONE = 0x40049409
+
+# errors meaning "not supported here, try the next copy method"
+UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                      errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                      errno.ETXTBSY)
+
+
+def reflink(src_fd, dst_fd, size):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def copy_range(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if not count:
+            break
+        copied += count
+    return copied
+
+
+def sendfile(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        count = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if not count:
+            break
+        copied += count
+    return copied
+
+
+def copy_file(src, dst):
+    """
+    Copy ``src`` to ``dst`` without passing the data through Python: as
+    reflink if source and destination share a filesystem supporting it,
+    otherwise in the kernel with copy_file_range() or sendfile(). Falls back
+    to a read/write loop.
+
+    Returns:
+        Name of the method used
+    """
+    methods = [('reflink', reflink)]
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', copy_range))
+    methods.append(('sendfile', sendfile))
+
+    with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+        size = os.fstat(src_fd.fileno()).st_size
+        for name, method in methods:
+            try:
+                method(src_fd.fileno(), dst_fd.fileno(), size)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+            else:
+                if os.fstat(dst_fd.fileno()).st_size == size:
+                    return name
+            # partial copies (failed or short) are discarded, the next method
+            # starts at offset 0 of both files
+            src_fd.seek(0)
+            dst_fd.seek(0)
+            dst_fd.truncate()
+        shutil.copyfileobj(src_fd, dst_fd, 1024*1024)
+        return 'read/write'
+
+
+class LocalSource(object):
+    """
+    Artifacts provided in local directories, e.g. a mirror directory on a
+    factory line or a mounted USB medium at an air-gapped site.
+
+    Artifacts are looked up as ``{directory}/{md5}`` and
+    ``{directory}/{filename}``, copied to the bundle location with
+    ``copy_file()`` and verified against the MD5 hash provided by hawkBit.
+    """
+    def __init__(self, directories):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.directories = list(directories)
+
+    def candidates(self, md5sum, filename=None, size=None):
+        """Returns paths of local files possibly holding the artifact."""
+        names = [md5sum]
+        if filename and os.path.basename(filename) == filename:
+            names.append(filename)
+        paths = []
+        for directory in self.directories:
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if size is not None and os.path.getsize(path) != size:
+                        continue
+                except OSError:
+                    continue
+                paths.append(path)
+        return paths
+
+    async def fetch(self, md5sum, dl_location, filename=None, size=None,
+                    checkpoint=None):
+        """
+        Copy the artifact to ``dl_location`` if it is available locally.
+        Verifying the copy awaits ``checkpoint(size)`` after each chunk (see
+        ``delta.throttled_file_md5()``).
+
+        Returns:
+            True if a local copy matching ``md5sum`` was found
+        """
+        loop = asyncio.get_event_loop()
+        for path in self.candidates(md5sum, filename, size):
+            try:
+                method = await loop.run_in_executor(None, copy_file, path,
+                                                    dl_location)
+                checksum = await throttled_file_md5(dl_location, checkpoint)
+            except OSError as e:
+                self.logger.warning('Copying {} failed: {}'.format(path, e))
+                continue
+            if checksum == md5sum:
+                self.logger.info('Copied bundle from {} ({})'.format(path,
+                                                                     method))
+                return True
+            self.logger.warning('Checksum of {} does not match'.format(path))
+
+        if os.path.exists(dl_location):
+            os.remove(dl_location)
+        return False
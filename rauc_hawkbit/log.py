@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import logging.handlers
+import queue
+import time
+
+LOG_FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without blocking. Records are dropped if
+    the queue is full, the number of dropped records is counted in
+    ``dropped`` and reported once the queue has room again.
+
+    Records are enqueued unformatted (message arguments and exception info
+    intact), the handler of the QueueListener formats them in its thread.
+    """
+    def __init__(self, log_queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+        self.reported = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped > self.reported:
+                self.queue.put_nowait(self.dropped_record(record))
+                self.reported = self.dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def dropped_record(self, record):
+        return logging.makeLogRecord({
+            'name': record.name,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': '{} log records dropped'.format(
+                self.dropped - self.reported),
+        })
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits records per subsystem (logger name and its children) to ``rate``
+    records per second with bursts of up to ``burst`` records. The number of
+    suppressed records is appended to the next record let through.
+
+    Args:
+        limits: {logger name: rate} or {logger name: (rate, burst)}
+    """
+    def __init__(self, limits, clock=time.monotonic):
+        super(RateLimitFilter, self).__init__()
+        self.clock = clock
+        # name: [rate, burst, tokens, last update, suppressed]
+        self.buckets = {}
+        for name, limit in limits.items():
+            rate, burst = limit if isinstance(limit, tuple) else (limit, 1)
+            self.buckets[name] = [rate, burst, burst, clock(), 0]
+
+    def bucket(self, name):
+        while name:
+            if name in self.buckets:
+                return self.buckets[name]
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        bucket = self.bucket(record.name)
+        if bucket is None:
+            return True
+
+        rate, burst, tokens, last, suppressed = bucket
+        now = self.clock()
+        tokens = min(burst, tokens + (now - last) * rate)
+        bucket[3] = now
+        if tokens < 1:
+            bucket[2] = tokens
+            bucket[4] = suppressed + 1
+            return False
+
+        bucket[2] = tokens - 1
+        if suppressed:
+            record.msg = '{} ({} similar messages suppressed)'.format(
+                record.getMessage(), suppressed)
+            record.args = None
+            bucket[4] = 0
+        return True
+
+
+def parse_rate_limits(value):
+    """
+    Parses 'name:rate[/burst] ...' as used in the config file.
+
+    Returns:
+        {logger name: (rate, burst)}
+    """
+    limits = {}
+    for item in value.split():
+        name, _, limit = item.rpartition(':')
+        rate, _, burst = limit.partition('/')
+        limits[name] = (float(rate), int(burst or 1))
+    return limits
+
+
+def setup_logging(level=logging.INFO, queue_size=None, rate_limits=None,
+                  handler=None):
+    """
+    Configure logging of the client daemon.
+
+    Keyword Args:
+        level: log level of the root logger
+        queue_size: if set, records are handed to a background writer thread
+                    through a queue of this size, so slow log targets (flash,
+                    remote syslog) do not block the event loop; records are
+                    dropped when the queue is full
+        rate_limits: {logger name: rate or (rate, burst)} in records per
+                     second, e.g. {'rauc_hawkbit.progress': 1}
+        handler: handler writing the records (default: stderr)
+
+    Returns:
+        Started logging.handlers.QueueListener (stop it on exit) or None
+    """
+    if handler is None:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    listener = None
+    front = handler
+    if queue_size:
+        front = DroppingQueueHandler(queue.Queue(queue_size))
+        listener = logging.handlers.QueueListener(front.queue, handler)
+        listener.start()
+
+    if rate_limits:
+        front.addFilter(RateLimitFilter(rate_limits))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(front)
+    return listener
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+from aiohttp.client import ClientTimeout
+from aiohttp.client_exceptions import ClientError
+from yarl import URL
+
+from .ddi.circuit_breaker import CircuitBreaker
+from .ddi.errors import APIError
+
+# download candidate, ``authorize`` sends the DDI target token (hawkBit URLs
+# only, never to mirrors)
+Source = namedtuple('Source', 'url authorize')
+
+
+def source_key(url):
+    """Statistics are kept per scheme and host."""
+    url = URL(url)
+    return '{}://{}'.format(url.scheme, url.raw_authority)
+
+
+class SourceStats(object):
+    """Smoothed latency (s) and throughput (bytes/s) of a source."""
+    def __init__(self, latency=None, throughput=None, failures=0,
+                 smoothing=0.5):
+        self.latency = latency
+        self.throughput = throughput
+        self.failures = failures
+        self.smoothing = smoothing
+
+    def smooth(self, old, new):
+        if old is None:
+            return new
+        return self.smoothing * new + (1 - self.smoothing) * old
+
+    def record(self, latency=None, throughput=None):
+        if latency is not None:
+            self.latency = self.smooth(self.latency, latency)
+        if throughput:
+            self.throughput = self.smooth(self.throughput, throughput)
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+
+    def expected_time(self, size):
+        """Estimated seconds to download ``size`` bytes."""
+        if self.throughput is None:
+            return float('inf')
+        return (self.latency or 0) + size / self.throughput
+
+    def to_json(self):
+        return {'latency': self.latency, 'throughput': self.throughput,
+                'failures': self.failures}
+
+
+class SlowSourceError(APIError):
+    """Source delivers less than the minimum throughput."""
+    pass
+
+
+class ThroughputMonitor(object):
+    """
+    Progress callback raising SlowSourceError if less than ``min_throughput``
+    bytes/s are received within ``window`` seconds, events are passed on to
+    ``callback``.
+    """
+    def __init__(self, min_throughput, window, callback=None,
+                 clock=time.monotonic):
+        self.min_throughput = min_throughput
+        self.window = window
+        self.callback = callback
+        self.clock = clock
+        self.window_start = None
+        self.window_received = None
+
+    def __call__(self, event):
+        if self.callback:
+            self.callback(event)
+        now = self.clock()
+        if self.window_start is None or event.received < self.window_received:
+            # first event, or download restarted from the beginning
+            self.window_start, self.window_received = now, event.received
+            return
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        if event.total and event.received >= event.total:
+            return
+        throughput = (event.received - self.window_received) / elapsed
+        if throughput < self.min_throughput:
+            raise SlowSourceError(
+                'Throughput {:.0f} bytes/s below minimum of {} bytes/s'.format(
+                    throughput, self.min_throughput))
+        self.window_start, self.window_received = now, event.received
+
+
+def truncate(path, offset):
+    """
+    Discard data beyond ``offset`` in ``path`` (created if missing).
+
+    Returns:
+        New size of the file, at most ``offset``
+    """
+    with open(path, 'ab') as fd:
+        offset = min(offset, fd.seek(0, os.SEEK_END))
+        fd.truncate(offset)
+    return offset
+
+
+class SourceSelector(object):
+    """
+    Picks the fastest of several download sources for an artifact (hawkBit
+    ``download`` and ``download-http`` links and configured mirrors).
+
+    Sources without recent statistics are probed concurrently with a small
+    Range request measuring latency and throughput. The download starts on
+    the source with the lowest expected download time and continues on the
+    next best source (resuming at the offset reached) if it fails, stalls for
+    ``stall_timeout`` seconds or delivers less than ``min_throughput`` bytes/s
+    over ``stall_timeout`` seconds (not counting time bulk transfers were
+    paused by the governor). The last source is never abandoned for being
+    slow. Statistics are kept across deployments and, if
+    ``stats_location`` is set, across restarts.
+    """
+    def __init__(self, ddi, stats_location=None, probe_size=64*1024,
+                 probe_timeout=5, stall_timeout=15, min_throughput=4*1024,
+                 stats_max_age=24*3600):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.ddi = ddi
+        self.stats_location = stats_location
+        self.probe_size = probe_size
+        self.probe_timeout = probe_timeout
+        self.stall_timeout = stall_timeout
+        self.min_throughput = min_throughput
+        self.stats_max_age = stats_max_age
+        # source key: SourceStats
+        self.stats = {}
+        # source key: time.time() of last measurement
+        self.measured = {}
+        # mirrors are not covered by the DDI circuit breakers
+        self.circuit_breakers = {}
+        self.load()
+
+    def load(self):
+        if not self.stats_location:
+            return
+        try:
+            with open(self.stats_location) as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            self.logger.warning('Ignoring invalid source statistics {}'.format(
+                self.stats_location))
+            return
+        for key, entry in data.items():
+            self.stats[key] = SourceStats(entry.get('latency'),
+                                          entry.get('throughput'),
+                                          entry.get('failures', 0))
+            self.measured[key] = entry.get('measured', 0)
+
+    def save(self):
+        if not self.stats_location:
+            return
+        data = {}
+        for key, stats in self.stats.items():
+            data[key] = stats.to_json()
+            data[key]['measured'] = self.measured.get(key, 0)
+        tmp_location = '{}.tmp'.format(self.stats_location)
+        with open(tmp_location, 'w') as fd:
+            json.dump(data, fd)
+        os.replace(tmp_location, self.stats_location)
+
+    def source_stats(self, source):
+        return self.stats.setdefault(source_key(source.url), SourceStats())
+
+    def needs_probe(self, source):
+        key = source_key(source.url)
+        return key not in self.stats or \
+            self.stats[key].throughput is None or \
+            time.time() - self.measured.get(key, 0) > self.stats_max_age
+
+    async def probe(self, source):
+        """Measure latency and throughput with a small Range request."""
+        headers = {'Range': 'bytes=0-{}'.format(self.probe_size - 1)}
+        if source.authorize:
+            headers.update(self.ddi.headers)
+        stats = self.source_stats(source)
+        start = time.monotonic()
+        try:
+            async with self.ddi.session.get(
+                    source.url, headers=headers,
+                    timeout=ClientTimeout(self.probe_timeout)) as resp:
+                latency = time.monotonic() - start
+                if resp.status not in (200, 206):
+                    raise APIError('Probe failed with status {}'.format(
+                        resp.status), resp.status)
+                received = 0
+                while received < self.probe_size:
+                    chunk = await resp.content.read(
+                        self.probe_size - received)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+            elapsed = time.monotonic() - start
+        except (APIError, ClientError, asyncio.TimeoutError) as e:
+            self.logger.info('Probing {} failed: {}'.format(source.url, e))
+            stats.record_failure()
+            return
+
+        stats.record(latency, received / max(elapsed - latency, 1e-6))
+        self.measured[source_key(source.url)] = time.time()
+        self.logger.debug('Probed {}: latency {:.3f}s, {:.2f} MiB/s'.format(
+            source.url, stats.latency, stats.throughput / 2**20))
+
+    async def rank(self, sources, size=None):
+        """Returns sources ordered by expected download time, best first."""
+        probes = [self.probe(source) for source in sources
+                  if self.needs_probe(source)]
+        if probes:
+            await asyncio.gather(*probes)
+            self.save()
+
+        size = size or self.probe_size
+        # keep given order (https before http) for equal estimates
+        return sorted(sources, key=lambda source: (
+            self.source_stats(source).failures > 0,
+            self.source_stats(source).expected_time(size)))
+
+    def circuit_breaker(self, source):
+        if source.authorize:
+            # hawkBit sources use the DDI bulk circuit breaker
+            return None
+        key = source_key(source.url)
+        if key not in self.circuit_breakers:
+            self.circuit_breakers[key] = CircuitBreaker(key)
+        return self.circuit_breakers[key]
+
+    def active_time(self):
+        """Monotonic clock standing still while bulk transfers are paused."""
+        return time.monotonic() - self.ddi.scheduler.paused_time
+
+    async def download(self, sources, dl_location, size=None, offset=0,
+                       **kwargs):
+        """
+        Download from the best source, switching to the next one on failure
+        or stall.
+
+        Args:
+            sources: list of Source
+            dl_location(str): storage path for downloaded artifact
+        Keyword Args:
+            size: artifact size in bytes, if known
+            offset: resume download at this offset
+            kwargs: passed to DDIClient.get_binary()
+
+        Returns:
+            MD5 hash of downloaded content
+        """
+        ranked = await self.rank(sources, size)
+        progress_callback = kwargs.pop('progress_callback', None)
+        error = None
+        for index, source in enumerate(ranked):
+            stats = self.source_stats(source)
+            self.logger.info('Downloading from {}'.format(source.url))
+            if index < len(ranked) - 1 and self.min_throughput:
+                callback = ThroughputMonitor(self.min_throughput,
+                                             self.stall_timeout,
+                                             progress_callback,
+                                             clock=self.active_time)
+            else:
+                callback = progress_callback
+            # anything beyond offset (e.g. a stale or delta assembled file)
+            # was not written by this download, so everything beyond it after
+            # a failure was received from the failed source
+            offset = truncate(dl_location, offset)
+            start = time.monotonic()
+            try:
+                checksum = await self.ddi.get_binary(
+                    source.url, dl_location, offset=offset,
+                    progress_callback=callback, authorize=source.authorize,
+                    circuit_breaker=self.circuit_breaker(source),
+                    read_timeout=self.stall_timeout, **kwargs)
+            except (APIError, ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning('Download from {} failed: {}'.format(
+                    source.url, e))
+                stats.record_failure()
+                error = e
+                # continue where the failed source stopped
+                offset = os.path.getsize(dl_location)
+                continue
+
+            received = os.path.getsize(dl_location) - offset
+            stats.record(throughput=received /
+                         max(time.monotonic() - start, 1e-6))
+            self.measured[source_key(source.url)] = time.time()
+            self.save()
+            return checksum
+
+        self.save()
+        raise APIError('Download failed from all sources: {}'.format(error))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from enum import Enum
+
+from aiohttp.client import ClientTimeout
+from aiohttp.client_exceptions import ClientError
+from aiohttp.http_exceptions import HttpProcessingError
+
+# sse: Server-Sent Events stream, each event signals new work
+# longpoll: repeated GET requests, held open by the server until there is new
+#           work (200) or nothing happened (204)
+NotificationMode = Enum('NotificationMode', 'sse longpoll')
+
+
+class NotificationChannel(object):
+    """
+    Long-lived connection to a notification endpoint that wakes up the poll
+    loop of ``RaucDBUSDDIClient`` as soon as there is new work for the target.
+
+    Notifications only trigger an immediate poll of the DDI base resource,
+    they carry no deployment information themselves. While the channel is
+    down, it reconnects with exponential backoff and the client keeps polling
+    with the sleep time suggested by HawkBit.
+
+    An SSE stream without any data (including keep-alive comments) for
+    ``keepalive_timeout`` seconds is considered dead and reconnected, it
+    should be about twice the server's keep-alive interval. Long-poll
+    requests are sent at most every ``longpoll_interval`` seconds, even if
+    the server answers immediately.
+    """
+    def __init__(self, session, url, mode=NotificationMode.sse, headers=None,
+                 reconnect_delay=5, max_reconnect_delay=300,
+                 longpoll_timeout=300, keepalive_timeout=60,
+                 longpoll_interval=5):
+        assert isinstance(mode, NotificationMode), \
+            'mode must be NotificationMode enum'
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.session = session
+        self.url = url
+        self.mode = mode
+        self.headers = headers or {}
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.longpoll_timeout = longpoll_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.longpoll_interval = longpoll_interval
+
+        self.connected = False
+        self.notifications = 0
+        self.notified = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.connected = False
+
+    def notify(self):
+        self.notifications += 1
+        self.logger.debug('Notification received')
+        self.notified.set()
+
+    async def wait(self, timeout):
+        """
+        Wait until a notification arrives or ``timeout`` seconds passed.
+
+        Returns:
+            True if woken up by a notification, False on timeout
+        """
+        try:
+            await asyncio.wait_for(self.notified.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.notified.clear()
+        return True
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                if self.mode is NotificationMode.sse:
+                    await self.listen_sse()
+                else:
+                    await self.listen_longpoll()
+            except (ClientError, asyncio.TimeoutError, HttpProcessingError,
+                    ValueError) as e:
+                # a line exceeding the read buffer limit raises
+                # HttpProcessingError (LineTooLong) or ValueError, depending
+                # on the aiohttp version
+                self.logger.warning('Notification channel failed: {}'.format(e))
+            else:
+                # orderly close by the server, do not hammer it
+                self.logger.info('Notification channel closed')
+
+            if self.connected:
+                delay = self.reconnect_delay
+            self.connected = False
+            self.logger.info('Reconnecting notification channel in {} seconds'
+                             .format(delay))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def check_status(self, resp, expected):
+        if resp.status not in expected:
+            raise ClientError('Unexpected status {} from {}'.format(
+                resp.status, self.url))
+
+    async def listen_sse(self):
+        headers = {'Accept': 'text/event-stream', **self.headers}
+        # the stream is held open indefinitely, but keep-alives must arrive
+        timeout = ClientTimeout(total=None, sock_connect=30,
+                                sock_read=self.keepalive_timeout)
+        async with self.session.get(self.url, headers=headers,
+                                    timeout=timeout) as resp:
+            self.check_status(resp, (200,))
+            self.connected = True
+            self.logger.info('Notification channel connected')
+
+            data = False
+            async for line in resp.content:
+                line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if not line:
+                    # blank line dispatches the event
+                    if data:
+                        self.notify()
+                    data = False
+                elif line.startswith('data'):
+                    data = True
+                # comments (keep-alive), event and id fields are ignored
+
+    async def listen_longpoll(self):
+        timeout = ClientTimeout(total=self.longpoll_timeout + 30)
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            async with self.session.get(self.url, headers=self.headers,
+                                        timeout=timeout) as resp:
+                self.check_status(resp, (200, 204))
+                if not self.connected:
+                    self.connected = True
+                    self.logger.info('Notification channel connected')
+                if resp.status == 200:
+                    self.notify()
+
+            # do not hammer servers answering immediately
+            elapsed = loop.time() - started
+            if elapsed < self.longpoll_interval:
+                await asyncio.sleep(self.longpoll_interval - elapsed)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import os
+import re
+import socket
+import struct
+
+from aiohttp import web
+from aiohttp.client_exceptions import ClientError
+
+from .ddi.circuit_breaker import CircuitBreaker
+from .ddi.errors import APIError
+
+# discovery datagrams: '<magic> <md5>' (query), '<magic> <md5> <port>' (reply)
+DISCOVERY_MAGIC = 'RAUC-HAWKBIT-PEER'
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Answers multicast queries for artifacts shared by ``PeerSharing``."""
+    def __init__(self, sharing):
+        self.sharing = sharing
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            magic, md5sum = data.decode('ascii').split()
+        except (UnicodeDecodeError, ValueError):
+            return
+        if magic == DISCOVERY_MAGIC and md5sum in self.sharing.artifacts:
+            reply = '{} {} {}'.format(DISCOVERY_MAGIC, md5sum,
+                                      self.sharing.listen_port)
+            self.transport.sendto(reply.encode('ascii'), addr)
+
+
+class QueryProtocol(asyncio.DatagramProtocol):
+    """Collects replies to a multicast query."""
+    def __init__(self, md5sum):
+        self.md5sum = md5sum
+        self.peers = []
+
+    def datagram_received(self, data, addr):
+        try:
+            magic, md5sum, port = data.decode('ascii').split()
+        except (UnicodeDecodeError, ValueError):
+            return
+        if magic == DISCOVERY_MAGIC and md5sum == self.md5sum:
+            peer = 'http://{}:{}'.format(addr[0], int(port))
+            if peer not in self.peers:
+                self.peers.append(peer)
+
+
+class PeerSharing(object):
+    """
+    Shares verified artifacts with other devices in the local network and
+    fetches artifacts from them.
+
+    Artifacts are advertised by their MD5 hash and served via HTTP at
+    ``/artifacts/{md5}``. Peers are either configured statically or discovered
+    via UDP multicast on ``multicast_interface`` (address of the local
+    interface, default: chosen by the kernel). Downloads from peers run through
+    ``DDIClient.get_binary()``, so they are scheduled and paced like hawkBit
+    downloads, and are always verified against the hash provided by hawkBit.
+    """
+    def __init__(self, listen_host='0.0.0.0', listen_port=8090,
+                 peers=(), multicast_group=None, multicast_port=8091,
+                 multicast_interface='0.0.0.0', discovery_timeout=1.0,
+                 timeout=3600):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.peers = ['http://{}'.format(peer) if '://' not in peer else peer
+                      for peer in peers]
+        self.multicast_group = multicast_group
+        self.multicast_port = multicast_port
+        self.multicast_interface = multicast_interface
+        self.discovery_timeout = discovery_timeout
+        self.timeout = timeout
+        # {md5}: {path}
+        self.artifacts = {}
+        # peers are not covered by the DDI circuit breakers
+        self.circuit_breakers = {}
+
+        self.runner = None
+        self.discovery_transport = None
+
+    async def start(self):
+        """Start serving advertised artifacts (and answering discovery)."""
+        app = web.Application()
+        app.router.add_route('GET', '/artifacts/{md5}', self.handle_artifact)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.listen_host, self.listen_port)
+        await site.start()
+        if self.listen_port == 0:
+            self.listen_port = self.runner.addresses[0][1]
+        self.logger.info('Sharing artifacts with peers on port {}'.format(
+            self.listen_port))
+
+        if self.multicast_group:
+            loop = asyncio.get_event_loop()
+            self.discovery_transport, _ = await loop.create_datagram_endpoint(
+                lambda: DiscoveryProtocol(self),
+                sock=self.multicast_socket())
+
+    async def stop(self):
+        if self.discovery_transport:
+            self.discovery_transport.close()
+            self.discovery_transport = None
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def multicast_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                             socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', self.multicast_port))
+        mreq = struct.pack('4s4s', socket.inet_aton(self.multicast_group),
+                           socket.inet_aton(self.multicast_interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setblocking(False)
+        return sock
+
+    def advertise(self, md5sum, path):
+        """Offer the verified artifact at ``path`` to peers."""
+        self.logger.debug('Advertising artifact {} to peers'.format(md5sum))
+        self.artifacts[md5sum] = path
+
+    def withdraw(self, md5sum):
+        """Stop offering an artifact to peers."""
+        self.artifacts.pop(md5sum, None)
+
+    async def handle_artifact(self, request):
+        md5sum = request.match_info['md5']
+        path = self.artifacts.get(md5sum)
+        if path is None or not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        self.logger.info('Serving artifact {} to peer {}'.format(
+            md5sum, request.remote))
+        return web.FileResponse(path)
+
+    async def discover(self, md5sum):
+        """Returns base URLs of peers which might provide the artifact."""
+        peers = list(self.peers)
+        if not self.multicast_group:
+            return peers
+
+        loop = asyncio.get_event_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: QueryProtocol(md5sum), family=socket.AF_INET)
+        try:
+            transport.get_extra_info('socket').setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                socket.inet_aton(self.multicast_interface))
+            query = '{} {}'.format(DISCOVERY_MAGIC, md5sum)
+            transport.sendto(query.encode('ascii'),
+                             (self.multicast_group, self.multicast_port))
+            await asyncio.sleep(self.discovery_timeout)
+        finally:
+            transport.close()
+
+        return peers + [peer for peer in protocol.peers if peer not in peers]
+
+    def circuit_breaker(self, peer):
+        if peer not in self.circuit_breakers:
+            self.circuit_breakers[peer] = CircuitBreaker(peer)
+        return self.circuit_breakers[peer]
+
+    async def fetch(self, md5sum, dl_location, ddi):
+        """
+        Try to download the artifact from peers.
+
+        Args:
+            md5sum(str): MD5 hash of the artifact provided by hawkBit
+            dl_location(str): storage path for downloaded artifact
+            ddi: DDIClient used for the download
+
+        Returns:
+            True if a peer provided the artifact and it matches ``md5sum``
+        """
+        if not re.match('^[0-9a-f]{32}$', md5sum):
+            return False
+
+        for peer in await self.discover(md5sum):
+            url = '{}/artifacts/{}'.format(peer, md5sum)
+            try:
+                checksum = await ddi.get_binary(
+                    url, dl_location, timeout=self.timeout,
+                    connect_timeout=5, authorize=False,
+                    circuit_breaker=self.circuit_breaker(peer))
+            except (APIError, ClientError, asyncio.TimeoutError,
+                    OSError) as e:
+                self.logger.debug('Fetching from peer {} failed: {}'.format(
+                    peer, e))
+                continue
+
+            if checksum == md5sum:
+                self.logger.info('Fetched artifact from peer {}'.format(peer))
+                return True
+            self.logger.warning('Artifact from peer {} has wrong checksum'
+                                .format(peer))
+
+        return False
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import stat
+import tempfile
+
+from aiohttp import web
+from aiohttp.client import ClientTimeout
+from aiohttp.client_exceptions import ClientError
+
+from .ddi.client import APIError
+
+ARTIFACT_PATH = re.compile(
+    '^/(?P<tenant>[^/]+)/controller/v1/(?P<controller>[^/]+)/softwaremodules/'
+    '(?P<module>[^/]+)/artifacts/(?P<filename>[^/]+)$')
+
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'proxy-authenticate',
+                      'proxy-authorization', 'te', 'trailers',
+                      'transfer-encoding', 'upgrade', 'host',
+                      'content-length', 'content-encoding')
+
+
+class ArtifactStore(object):
+    """
+    Hash-keyed artifact storage with least-recently-used eviction.
+
+    Artifacts are stored as ``{directory}/{md5}``, or
+    ``{directory}/{namespace}/{md5}`` to keep e.g. tenants apart. The
+    modification time is updated on each access and used for eviction once
+    ``max_size`` bytes are exceeded.
+    """
+    def __init__(self, directory, max_size=None):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def name(self, md5sum, namespace=None):
+        """Returns the path of an artifact relative to the store directory."""
+        if not re.match('^[0-9a-f]{32}$', md5sum):
+            raise ValueError('Invalid MD5 hash: {}'.format(md5sum))
+        if namespace is None:
+            return md5sum
+        if not re.match('^[A-Za-z0-9_-][A-Za-z0-9_.-]*$', namespace):
+            raise ValueError('Invalid namespace: {}'.format(namespace))
+        return os.path.join(namespace, md5sum)
+
+    def path(self, md5sum, namespace=None):
+        return os.path.join(self.directory, self.name(md5sum, namespace))
+
+    def get(self, md5sum, namespace=None):
+        """Returns path of stored artifact or None."""
+        path = self.path(md5sum, namespace)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def tempfile(self):
+        """Returns path of a new temporary file inside the store."""
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.incoming-')
+        os.close(fd)
+        return path
+
+    def put(self, md5sum, tmp_path, namespace=None):
+        """Move the downloaded file ``tmp_path`` into the store."""
+        path = self.path(md5sum, namespace)
+        if namespace is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        self.evict(keep=self.name(md5sum, namespace))
+        return path
+
+    def entries(self):
+        """Returns [(mtime, size, name)] of all stored artifacts."""
+        entries = []
+        names = [name for name in os.listdir(self.directory)
+                 if not name.startswith('.')]
+        while names:
+            name = names.pop()
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                # namespace
+                names.extend(os.path.join(name, entry)
+                             for entry in os.listdir(path)
+                             if not entry.startswith('.'))
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used artifacts exceeding max_size."""
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            self.logger.info('Evicting artifact {}'.format(name))
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class ArtifactFetch(object):
+    """
+    Upstream fetch of an artifact into a temporary file of the store, which
+    can be streamed to clients while it grows.
+    """
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        # Content-Length of the upstream response, None if unknown
+        self.length = None
+        self.written = 0
+        # resolved when the upstream response starts
+        self.started = asyncio.get_event_loop().create_future()
+        # resolved with the store path once the artifact is verified
+        self.done = asyncio.get_event_loop().create_future()
+        self.progress = asyncio.Event()
+
+    def start(self, length):
+        self.length = length
+        if not self.started.done():
+            self.started.set_result(length)
+
+    def wrote(self, size):
+        self.written += size
+        progress, self.progress = self.progress, asyncio.Event()
+        progress.set()
+
+    def finish(self, path=None, exception=None):
+        for future in (self.started, self.done):
+            if future.done():
+                continue
+            if exception is None:
+                future.set_result(path)
+            else:
+                future.set_exception(exception)
+                # there might be no client waiting for it
+                future.exception()
+        self.wrote(0)
+
+    async def wait(self, offset):
+        """Wait until data beyond ``offset`` was written or the fetch ended."""
+        while self.written <= offset and not self.done.done():
+            await self.progress.wait()
+
+
+class CachingProxy(object):
+    """
+    Site-level caching proxy for the DDI API.
+
+    Poll and feedback requests are forwarded to hawkBit. Artifact downloads
+    (``softwaremodules/.../artifacts/...``) announced in deploymentBase
+    responses are served from an ``ArtifactStore``, separately per tenant.
+    Before serving an artifact, the client's credentials are checked with a
+    HEAD request to hawkBit. Concurrent requests for the same artifact cause
+    a single upstream fetch, which is streamed to clients while it is written
+    to the store. Download links in forwarded responses are rewritten to
+    point to the proxy.
+    """
+    # links to the artifact itself, others (e.g. md5sum) are forwarded
+    download_links = ('download', 'download-http')
+
+    def __init__(self, session, upstream_host, upstream_ssl, store,
+                 public_url=None, timeout=10, read_timeout=60,
+                 chunk_size=64*1024):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.session = session
+        self.upstream_host = upstream_host
+        self.upstream_ssl = upstream_ssl
+        self.store = store
+        self.public_url = public_url
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self.chunk_size = chunk_size
+        # (tenant, module, filename): md5 as announced in deploymentBase
+        # responses
+        self.known_hashes = {}
+        # (tenant, md5): running ArtifactFetch
+        self.fetches = {}
+        self.upstream_fetches = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        return app
+
+    def upstream_url(self, path_qs):
+        protocol = 'https' if self.upstream_ssl else 'http'
+        return '{}://{}{}'.format(protocol, self.upstream_host, path_qs)
+
+    @staticmethod
+    def artifact_key(match):
+        return (match.group('tenant'), match.group('module'),
+                match.group('filename'))
+
+    async def handle(self, request):
+        match = ARTIFACT_PATH.match(request.path)
+        if match and request.method in ('GET', 'HEAD') and \
+                self.artifact_key(match) in self.known_hashes:
+            return await self.handle_artifact(request, match)
+        return await self.forward(request)
+
+    async def forward(self, request):
+        """
+        Forward request to hawkBit and relay the response. JSON responses are
+        inspected, other bodies (e.g. artifacts not announced since the proxy
+        started) are streamed.
+        """
+        headers = {k: v for k, v in request.headers.items()
+                   if k.lower() not in HOP_BY_HOP_HEADERS}
+        data = await request.read()
+        url = self.upstream_url(request.path_qs)
+        self.logger.debug('{} {}'.format(request.method, url))
+        timeout = ClientTimeout(None, sock_connect=self.timeout,
+                                sock_read=self.read_timeout)
+
+        async with self.session.request(
+                request.method, url, headers=headers, data=data or None,
+                timeout=timeout) as resp:
+            resp_headers = {k: v for k, v in resp.headers.items()
+                            if k.lower() not in HOP_BY_HOP_HEADERS}
+            if resp.content_type == 'application/json':
+                body = self.inspect_json(request, await resp.read())
+                return web.Response(status=resp.status, body=body,
+                                    headers=resp_headers)
+
+            response = web.StreamResponse(status=resp.status,
+                                          headers=resp_headers)
+            # the body is decoded, the upstream length only applies as is
+            if 'Content-Encoding' not in resp.headers:
+                response.content_length = resp.content_length
+            await response.prepare(request)
+            try:
+                while True:
+                    chunk, _ = await resp.content.readchunk()
+
+                    # we are EOF
+                    if not chunk:
+                        break
+
+                    await response.write(chunk)
+            except (ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning('Aborting forwarded response to {}: {}'
+                                    .format(request.remote, e))
+                if request.transport is not None:
+                    request.transport.abort()
+                return response
+
+        await response.write_eof()
+        return response
+
+    def inspect_json(self, request, body):
+        """
+        Remember announced artifact hashes and rewrite download links to the
+        proxy.
+        """
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return body
+
+        chunks = []
+        if isinstance(data, dict):
+            chunks = data.get('deployment', {}).get('chunks', [])
+        for chunk in chunks:
+            for artifact in chunk.get('artifacts', []):
+                md5sum = artifact.get('hashes', {}).get('md5')
+                links = artifact.get('_links', {})
+                for name in self.download_links:
+                    match = ARTIFACT_PATH.match(re.sub(
+                        '^https?://[^/]+', '',
+                        links.get(name, {}).get('href', '')))
+                    if match and md5sum:
+                        self.known_hashes[self.artifact_key(match)] = md5sum
+
+        public_url = self.public_url or '{}://{}'.format(request.scheme,
+                                                         request.host)
+        for protocol in ('https', 'http'):
+            body = body.replace(
+                '{}://{}/'.format(protocol, self.upstream_host).encode(),
+                '{}/'.format(public_url).encode())
+        return body
+
+    async def authorize(self, request):
+        """
+        Check the client's credentials for the artifact with a HEAD request
+        to hawkBit.
+
+        Returns:
+            None if authorized, the response for the client otherwise
+        """
+        headers = {'Authorization': request.headers.get('Authorization', '')}
+        try:
+            async with self.session.head(
+                    self.upstream_url(request.path), headers=headers,
+                    timeout=ClientTimeout(self.timeout)) as resp:
+                if resp.status == 200:
+                    return None
+                return web.Response(status=resp.status)
+        except (ClientError, asyncio.TimeoutError) as e:
+            self.logger.warning('Upstream authorization failed: {}'.format(e))
+            raise web.HTTPBadGateway(text=str(e))
+
+    async def handle_artifact(self, request, match):
+        denied = await self.authorize(request)
+        if denied is not None:
+            return denied
+
+        tenant = match.group('tenant')
+        md5sum = self.known_hashes[self.artifact_key(match)]
+        path = self.store.get(md5sum, tenant)
+        if path is None:
+            try:
+                fetch = self.fetches.get((tenant, md5sum))
+                if fetch is None:
+                    fetch = self.start_fetch(request, tenant, md5sum)
+                length = await asyncio.shield(fetch.started)
+                if request.method == 'GET' and \
+                        self.streamable(request, length):
+                    return await self.stream(request, fetch)
+                path = await asyncio.shield(fetch.done)
+            except (APIError, ClientError, asyncio.TimeoutError, OSError) as e:
+                self.logger.warning('Upstream fetch failed: {}'.format(e))
+                raise web.HTTPBadGateway(text=str(e))
+
+        # FileResponse handles Range and HEAD requests
+        return web.FileResponse(path)
+
+    @staticmethod
+    def streamable(request, length):
+        """Ranges are streamed while fetching only if the size is known."""
+        try:
+            http_range = request.http_range
+        except ValueError:
+            # invalid, FileResponse answers it once the fetch is done
+            return False
+        return length is not None or \
+            (http_range.start is None and http_range.stop is None)
+
+    def start_fetch(self, request, tenant, md5sum):
+        fetch = ArtifactFetch(self.store.tempfile())
+        key = (tenant, md5sum)
+        self.fetches[key] = fetch
+        task = asyncio.ensure_future(self.fetch(request, tenant, md5sum,
+                                                fetch))
+        task.add_done_callback(lambda _: self.fetches.pop(key, None))
+        return fetch
+
+    async def fetch(self, request, tenant, md5sum, fetch):
+        """Fetch artifact from hawkBit into the store."""
+        filename = ARTIFACT_PATH.match(request.path).group('filename')
+        headers = {'Authorization': request.headers.get('Authorization', '')}
+        timeout = ClientTimeout(None, sock_connect=self.timeout, sock_read=60)
+        hash_md5 = hashlib.md5()
+
+        self.logger.info('Fetching artifact {} from upstream'.format(filename))
+        self.upstream_fetches += 1
+        try:
+            async with self.session.get(self.upstream_url(request.path),
+                                        headers=headers,
+                                        timeout=timeout) as resp:
+                if resp.status != 200:
+                    raise APIError('HTTP error {} for {}'.format(resp.status,
+                                                                 filename))
+                fetch.start(resp.content_length)
+                with open(fetch.tmp_path, 'wb', buffering=0) as fd:
+                    while True:
+                        chunk, _ = await resp.content.readchunk()
+
+                        # we are EOF
+                        if not chunk:
+                            break
+
+                        fd.write(chunk)
+                        hash_md5.update(chunk)
+                        fetch.wrote(len(chunk))
+
+            if hash_md5.hexdigest() != md5sum:
+                raise APIError('Checksum mismatch for {}'.format(filename))
+            path = self.store.put(md5sum, fetch.tmp_path, tenant)
+        except Exception as e:
+            self.discard(fetch, e, self.store.path(md5sum, tenant))
+        except BaseException:
+            self.discard(fetch, APIError('Fetch of {} cancelled'.format(
+                filename)), self.store.path(md5sum, tenant))
+            raise
+        else:
+            fetch.finish(path)
+
+    def discard(self, fetch, exception, path):
+        """
+        Remove the temporary file and a possibly incomplete store entry
+        ``path`` (e.g. after ENOSPC) of a failed fetch.
+        """
+        for partial in (fetch.tmp_path, path):
+            try:
+                os.remove(partial)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning('Cannot remove {}: {}'.format(partial, e))
+        fetch.finish(exception=exception)
+
+    async def stream(self, request, fetch):
+        """
+        Stream a running fetch to the client. The last chunk is held back
+        until the artifact is verified and the connection is aborted if the
+        fetch fails, so clients never get a complete response for a corrupt
+        artifact.
+        """
+        start, stop = 0, fetch.length
+        http_range = request.http_range
+        resp = web.StreamResponse()
+        if http_range.start is not None or http_range.stop is not None:
+            start, stop, _ = http_range.indices(fetch.length)
+            if start >= stop:
+                raise web.HTTPRequestRangeNotSatisfiable(
+                    headers={'Content-Range': 'bytes */{}'.format(
+                        fetch.length)})
+            resp.set_status(206)
+            resp.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, stop - 1, fetch.length)
+        resp.content_type = 'application/octet-stream'
+        if stop is not None:
+            resp.content_length = stop - start
+
+        # the temporary file stays readable if moved or removed meanwhile
+        with open(fetch.tmp_path, 'rb') as fd:
+            await resp.prepare(request)
+            fd.seek(start)
+            offset = start
+            try:
+                while stop is None or offset < stop:
+                    await fetch.wait(offset)
+                    if fetch.written <= offset:
+                        # fetch ended
+                        await asyncio.shield(fetch.done)
+                        break
+                    size = fetch.written - offset
+                    if stop is not None:
+                        size = min(size, stop - offset)
+                    data = fd.read(min(size, self.chunk_size))
+                    if offset + len(data) == fetch.length:
+                        await asyncio.shield(fetch.done)
+                    await resp.write(data)
+                    offset += len(data)
+            except (APIError, ClientError, asyncio.TimeoutError, OSError) as e:
+                self.logger.warning('Aborting artifact stream to {}: {}'
+                                    .format(request.remote, e))
+                if request.transport is not None:
+                    request.transport.abort()
+                return resp
+
+        await resp.write_eof()
+        return resp
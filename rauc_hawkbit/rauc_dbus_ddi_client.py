@@ -2,21 +2,21 @@
 
 import asyncio
 from aiohttp.client_exceptions import ClientOSError, ClientResponseError
-from gi.repository import GLib
 from datetime import datetime, timedelta
 import os
 import os.path
 import re
 import logging
+import time
 
 from .dbus_client import AsyncDBUSClient
+from .journal import DeploymentJournal, DeploymentPhase
 from .ddi.client import DDIClient, APIError
 from .ddi.client import (
     ConfigStatusExecution, ConfigStatusResult)
+from .ddi.scheduler import RequestScheduler
 from .ddi.deployment_base import (
     DeploymentStatusExecution, DeploymentStatusResult)
-from .ddi.cancel_action import (
-    CancelStatusExecution, CancelStatusResult)
 
 
 class RaucDBUSDDIClient(AsyncDBUSClient):
@@ -24,14 +24,32 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
     Client broker communicating with RAUC via DBUS and HawkBit DDI HTTP
     interface.
     """
+    # seconds between download progress updates passed to step_callback and
+    # the log, and between download progress feedback sent to HawkBit
+    download_progress_interval = 1.0
+    download_feedback_interval = 30
+    # seconds between download offsets recorded in the journal
+    journal_offset_interval = 10
+
     def __init__(self, session, host, ssl, tenant_id, target_name, auth_token,
-                 attributes, bundle_dl_location, result_callback, step_callback=None, lock_keeper=None):
-        super(RaucDBUSDDIClient, self).__init__()
+                 attributes, bundle_dl_location, result_callback, step_callback=None, lock_keeper=None,
+                 delta_seeds=(), delta_cache_location=None, peer_sharing=None,
+                 lazy_dbus=False, journal_location=None,
+                 notification_channel=None, bus_address=None, mirrors=(),
+                 source_stats_location=None, governor=None,
+                 local_sources=(), verify_blocks=False):
+        super(RaucDBUSDDIClient, self).__init__(connect=False,
+                                                bus_address=bus_address)
 
         self.attributes = attributes
 
         self.logger = logging.getLogger('rauc_hawkbit')
-        self.ddi = DDIClient(session, host, ssl, auth_token, tenant_id, target_name)
+        # frequent progress lines, can be rate limited separately
+        self.progress_logger = logging.getLogger('rauc_hawkbit.progress')
+        # optional rauc_hawkbit.governor.ResourceGovernor adapting downloads
+        # to the device workload
+        self.ddi = DDIClient(session, host, ssl, auth_token, tenant_id, target_name,
+                             scheduler=RequestScheduler(governor=governor))
         self.action_id = None
 
         bundle_dir = os.path.dirname(bundle_dl_location)
@@ -43,6 +61,66 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
         self.result_callback = result_callback
         self.step_callback = step_callback
 
+        # local data to reuse blocks from for delta downloads, the previous
+        # bundle is kept at delta_cache_location (if set) after installation
+        self.delta_seeds = list(delta_seeds)
+        self.delta_cache_location = delta_cache_location
+        if delta_cache_location and delta_cache_location not in self.delta_seeds:
+            self.delta_seeds.insert(0, delta_cache_location)
+
+        # optional rauc_hawkbit.peer.PeerSharing instance
+        self.peer_sharing = peer_sharing
+        # MD5 hashes of the verified bundles at bundle_dl_location and
+        # delta_cache_location, advertised to peers
+        self.bundle_md5sum = None
+        self.cached_md5sum = None
+
+        # optional rauc_hawkbit.notify.NotificationChannel waking up the poll
+        # loop before the sleep time suggested by HawkBit is over
+        self.notification_channel = notification_channel
+
+        # deployment (download and install call) runs as a task across polls,
+        # so unrelated requests do not delay it and cancelation can preempt
+        # the download
+        self.deployment_task = None
+        self.deployment_action_id = None
+
+        self.download_feedback = None
+        self.last_download_feedback = 0
+        self.last_journal_offset = 0
+
+        # mirror URL templates, '{filename}' and '{md5}' are replaced with
+        # the artifact's values
+        self.mirrors = list(mirrors)
+        self.source_stats_location = source_stats_location
+        self.source_selector = None
+
+        # local directories (mirror directory, USB medium) searched for
+        # artifacts before downloading them
+        self.local_sources = list(local_sources)
+        self.local_source = None
+
+        # check blocks against the published block index while downloading
+        # and re-fetch only corrupt blocks on checksum mismatch
+        self.verify_blocks = verify_blocks
+
+        # deployment state survives client restarts and reboots if
+        # journal_location is set
+        self.journal = DeploymentJournal(journal_location)
+
+        # with lazy_dbus the D-Bus connection is only set up when first
+        # needed, so polling can start before the D-Bus layer is ready
+        self.rauc = None
+        if not lazy_dbus:
+            self.connect_dbus()
+
+    def connect_dbus(self):
+        """Connect to the bus, create RAUC proxy and subscriptions."""
+        if self.dbus_connected:
+            return
+
+        super(RaucDBUSDDIClient, self).connect_dbus()
+
         # DBUS proxy
         self.rauc = self.new_proxy('de.pengutronix.rauc.Installer', '/')
 
@@ -65,12 +143,34 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
             self.lock_keeper.unlock(self)
 
         result = parameters[0]
-        os.remove(self.bundle_dl_location)
         status_msg = 'Rauc bundle update completed with result: {}'.format(
             result)
         self.logger.info(status_msg)
+        self.journal.record(self.action_id, DeploymentPhase.awaiting_reboot,
+                            result=result, status_msg=status_msg)
+
+        self.withdraw_bundle()
+        if result == 0 and self.delta_cache_location:
+            # keep installed bundle as seed for the next delta download
+            if self.peer_sharing and self.cached_md5sum:
+                self.peer_sharing.withdraw(self.cached_md5sum)
+            os.replace(self.bundle_dl_location, self.delta_cache_location)
+            self.cached_md5sum = self.bundle_md5sum
+            if self.peer_sharing:
+                self.peer_sharing.advertise(self.cached_md5sum,
+                                            self.delta_cache_location)
+        else:
+            os.remove(self.bundle_dl_location)
+        self.bundle_md5sum = None
 
-        # send feedback to HawkBit
+        action_id = self.action_id
+        self.action_id = None
+        await self.send_result(action_id, result, status_msg)
+
+        self.result_callback(result)
+
+    async def send_result(self, action_id, result, status_msg):
+        """Send final feedback to HawkBit and forget the action."""
         if result == 0:
             status_execution = DeploymentStatusExecution.closed
             status_result = DeploymentStatusResult.success
@@ -78,12 +178,50 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
             status_execution = DeploymentStatusExecution.closed
             status_result = DeploymentStatusResult.failure
 
-        await self.ddi.deploymentBase[self.action_id].feedback(
+        await self.ddi.deploymentBase[action_id].feedback(
                 status_execution, status_result, [status_msg])
 
-        self.action_id = None
+        self.journal.clear()
 
-        self.result_callback(result)
+    async def resume_deployment(self):
+        """
+        Continue a deployment recorded in the journal, e.g. after a restart of
+        the client or a reboot into the new slot. Downloads are resumed by
+        process_deployment() once HawkBit offers the action again.
+        """
+        action_id = self.journal.action_id
+        phase = self.journal.phase
+
+        if phase is DeploymentPhase.awaiting_reboot:
+            self.logger.info('Reporting result of deployment {}'.format(
+                action_id))
+            try:
+                await self.send_result(action_id,
+                                       self.journal.state['result'],
+                                       self.journal.state['status_msg'])
+            except APIError as e:
+                # retry later if HawkBit is unavailable or overloaded
+                if e.status is None or e.status == 429 or e.status >= 500:
+                    raise
+                # e.g. result has already been reported before the restart
+                self.logger.warning('Reporting result failed: {}'.format(e))
+                self.journal.clear()
+
+        elif phase is DeploymentPhase.installing and self.action_id is None:
+            self.connect_dbus()
+            operation = self.rauc.get_cached_property('Operation')
+            if operation is not None and operation.unpack() == 'installing':
+                self.logger.info('Installation of deployment {} still in progress'
+                                 .format(action_id))
+                self.action_id = action_id
+            elif await self.bundle_md5() == self.journal.state['md5']:
+                self.logger.info('Installation of deployment {} was interrupted, restarting'
+                                 .format(action_id))
+                self.bundle_md5sum = self.journal.state['md5']
+                await self.install_bundle(action_id)
+            else:
+                # start over when HawkBit offers the action again
+                self.journal.clear()
 
     async def progress_callback(self, connection, sender_name,
                                 object_path, interface_name,
@@ -94,8 +232,8 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
             return
 
         percentage, description, nesting_depth = parameters
-        self.logger.info('Update progress: {}% {}'.format(percentage,
-                                                          description))
+        self.progress_logger.info('Update progress: {}% {}'.format(
+            percentage, description))
 
         if self.step_callback:
             self.step_callback(percentage, description)
@@ -130,6 +268,7 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
     async def start_polling(self, wait_on_error=60):
         """Wrapper around self.poll_base_resource() for exception handling."""
         while True:
+            retry_delay = wait_on_error
             try:
                 await self.poll_base_resource()
             except asyncio.CancelledError:
@@ -140,12 +279,16 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
             except (APIError, TimeoutError, ClientOSError, ClientResponseError) as e:
                 # log error and start all over again
                 self.logger.warning('Polling failed with a temporary error: {}'.format(e))
+                # do not add load while HawkBit asks us to back off
+                if getattr(e, 'retry_after', None):
+                    retry_delay = max(wait_on_error, e.retry_after)
             except Exception:
                 self.logger.exception('Polling failed with an unexpected exception:')
-            self.action_id = None
+            # a running installation is kept, its Completed signal is still
+            # expected
             self.logger.info('Retry will happen in {} seconds'.format(
-                wait_on_error))
-            await asyncio.sleep(wait_on_error)
+                retry_delay))
+            await asyncio.sleep(retry_delay)
 
     async def identify(self, base):
         """Identify target against HawkBit."""
@@ -156,6 +299,9 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
                 ConfigStatusResult.success, **self.attributes)
 
     async def cancel(self, base):
+        from .ddi.cancel_action import (
+            CancelStatusExecution, CancelStatusResult)
+
         self.logger.info('Received cancelation request')
         # retrieve action id from URL
         deployment = base['_links']['cancelAction']['href']
@@ -164,6 +310,20 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
         # retrieve stop_id
         stop_info = await self.ddi.cancelAction[action_id]()
         stop_id = stop_info['cancelAction']['stopId']
+
+        # downloads can be canceled, installations not
+        if stop_id == self.deployment_action_id and self.action_id is None:
+            self.logger.info('Canceling download of deployment {}'.format(
+                stop_id))
+            await self.cancel_deployment()
+            if os.path.exists(self.bundle_dl_location):
+                os.remove(self.bundle_dl_location)
+            self.journal.clear()
+            await self.ddi.cancelAction[stop_id].feedback(
+                    CancelStatusExecution.closed, CancelStatusResult.success,
+                    status_details=("Download canceled",))
+            return
+
         # Reject cancel request
         self.logger.info('Rejecting cancelation request')
         await self.ddi.cancelAction[stop_id].feedback(
@@ -174,7 +334,11 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
             self.logger.info("Another installation is already in progress, aborting")
             return
 
-        self.rauc.Install('(s)', self.bundle_dl_location)
+        from gi.repository import GLib
+
+        self.connect_dbus()
+        await self.call_method(self.rauc, 'Install',
+                               GLib.Variant('(s)', (self.bundle_dl_location,)))
 
     async def process_deployment(self, base):
         """
@@ -189,6 +353,7 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
         deployment = base['_links']['deploymentBase']['href']
         match = re.search('/deploymentBase/(.+)\?c=(.+)$', deployment)
         action_id, resource = match.groups()
+        self.deployment_action_id = action_id
         self.logger.info('Deployment found for this target')
         # fetch deployment information
         deploy_info = await self.ddi.deploymentBase[action_id](resource)
@@ -214,35 +379,273 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
                     status_execution, status_result, [msg])
             raise APIError(msg)
 
-        # prefer https ('download') over http ('download-http')
-        # HawkBit provides either only https, only http or both
-        if 'download' in artifact['_links']:
-            download_url = artifact['_links']['download']['href']
-        else:
-            download_url = artifact['_links']['download-http']['href']
+        download_url = self.artifact_url(artifact)
+
+        # a block index published next to the artifact enables delta mode
+        index_url = None
+        index_name = '{}.blockidx'.format(artifact.get('filename'))
+        for index_artifact in chunk['artifacts'][1:]:
+            if index_artifact.get('filename') == index_name:
+                index_url = self.artifact_url(index_artifact)
+                break
+
+        # hawkBit re-sends deployments e.g. after lost feedback; the slot
+        # status (connecting D-Bus with lazy_dbus) is only queried for
+        # artifacts with SHA256 hash
+        sha256 = artifact.get('hashes', {}).get('sha256')
+        slot = None
+        if sha256:
+            slot = await self.installed_slot(sha256)
+        if slot is not None:
+            msg = 'Bundle already installed in slot {}'.format(slot)
+            self.logger.info(msg)
+            await self.ddi.deploymentBase[action_id].feedback(
+                    DeploymentStatusExecution.closed,
+                    DeploymentStatusResult.success, [msg])
+            if self.journal.action_id == action_id:
+                self.journal.clear()
+            return
 
         # download artifact, check md5 and report feedback
         md5_hash = artifact['hashes']['md5']
+        sources = self.artifact_sources(artifact)
+        resume = self.journal.action_id == action_id and \
+            self.journal.phase is DeploymentPhase.downloading
+        self.journal.record(action_id, DeploymentPhase.downloading,
+                            url=download_url, md5=md5_hash)
         self.logger.info('Starting bundle download')
-        await self.download_artifact(action_id, download_url, md5_hash)
+        await self.download_artifact(action_id, download_url, md5_hash,
+                                     index_url=index_url, resume=resume,
+                                     sources=sources,
+                                     size=artifact.get('size'),
+                                     filename=artifact.get('filename'))
 
         # download successful, start install
+        await self.install_bundle(action_id)
+
+    async def slot_status(self):
+        """
+        Query slot status from RAUC.
+
+        Returns:
+            Tuple of {slot name: status dict} and the name of the primary
+            slot (booted next, None if not supported by RAUC) or None if the
+            query failed
+        """
+        from gi.repository import GLib
+
+        self.connect_dbus()
+        try:
+            slots, = (await self.call_method(self.rauc, 'GetSlotStatus',
+                                             None)).unpack()
+        except GLib.Error as e:
+            self.logger.warning('Querying slot status failed: {}'.format(e))
+            return None
+        try:
+            primary, = (await self.call_method(self.rauc, 'GetPrimary',
+                                               None)).unpack()
+        except GLib.Error:
+            primary = None
+        return dict(slots), primary
+
+    async def installed_slot(self, sha256):
+        """
+        Returns the name of the booted or primary slot holding the bundle with
+        the given SHA256 hash or None.
+
+        Bundles are compared by the ``bundle.hash`` RAUC records in the slot
+        status on installation, assuming it is the SHA256 hash of the bundle
+        file hawkBit reports for the artifact. If RAUC records a different
+        hash (e.g. of the bundle manifest), nothing matches and deployments
+        are downloaded and installed as usual.
+        """
+        status = await self.slot_status()
+        if status is None:
+            return None
+
+        slots, primary = status
+        for name, slot in sorted(slots.items()):
+            if slot.get('bundle.hash', '').lower() != sha256.lower():
+                continue
+            if slot.get('state') == 'booted' or name == primary:
+                return name
+        return None
+
+    async def install_bundle(self, action_id):
+        """Trigger RAUC install operation for the downloaded bundle."""
+        from gi.repository import GLib
+
         self.logger.info('Starting installation')
+        self.journal.record(action_id, DeploymentPhase.installing)
         try:
             self.action_id = action_id
             # do not interrupt install call
             await asyncio.shield(self.install())
         except GLib.Error as e:
+            # no Completed signal follows
+            self.action_id = None
+            self.withdraw_bundle()
             # send negative feedback to HawkBit
             status_execution = DeploymentStatusExecution.closed
             status_result = DeploymentStatusResult.failure
             await self.ddi.deploymentBase[action_id].feedback(
                     status_execution, status_result, [str(e)])
+            self.journal.clear()
             raise APIError(str(e))
 
+    @staticmethod
+    def artifact_url(artifact):
+        """
+        Returns download URL of an artifact.
+        Prefers https ('download') over http ('download-http'), HawkBit
+        provides either only https, only http or both.
+        """
+        if 'download' in artifact['_links']:
+            return artifact['_links']['download']['href']
+        return artifact['_links']['download-http']['href']
+
+    def artifact_sources(self, artifact):
+        """
+        Returns [(url, authorize)] of all download sources of an artifact:
+        HawkBit's https and http links and the configured mirrors.
+        """
+        sources = [(artifact['_links'][link]['href'], True)
+                   for link in ('download', 'download-http')
+                   if link in artifact['_links']]
+        for mirror in self.mirrors:
+            sources.append((mirror.format(filename=artifact.get('filename'),
+                                          md5=artifact['hashes']['md5']),
+                            False))
+        return sources
+
+    def select_source(self):
+        """Returns the SourceSelector, created on first use."""
+        if self.source_selector is None:
+            from .mirrors import SourceSelector
+            self.source_selector = SourceSelector(
+                self.ddi, stats_location=self.source_stats_location)
+        return self.source_selector
+
+    async def copy_local_artifact(self, md5sum, filename=None, size=None):
+        """
+        Copy the artifact from local_sources to bundle_dl_location.
+
+        Returns:
+            True if a copy matching md5sum was found
+        """
+        if self.local_source is None:
+            from .local_source import LocalSource
+            self.local_source = LocalSource(self.local_sources)
+        return await self.local_source.fetch(
+            md5sum, self.bundle_dl_location, filename=filename, size=size,
+            checkpoint=self.ddi.scheduler.bulk_checkpoint)
+
+    async def fetch_block_index(self, index_url):
+        """Download and parse the block index published with an artifact."""
+        from .delta import BlockIndex
+
+        index_location = '{}.blockidx'.format(self.bundle_dl_location)
+        try:
+            await self.ddi.get_binary(index_url, index_location)
+            return BlockIndex.from_file(index_location)
+        finally:
+            if os.path.exists(index_location):
+                os.remove(index_location)
+
+    async def block_verifier(self, index_url):
+        """Returns BlockVerifier for the artifact or None."""
+        from .delta import BlockVerifier, DeltaError
+
+        try:
+            return BlockVerifier(await self.fetch_block_index(index_url))
+        except (APIError, DeltaError, OSError, ClientOSError,
+                ClientResponseError, asyncio.TimeoutError) as e:
+            self.logger.warning('Block index not available: {}'.format(e))
+            return None
+
+    async def repair_download(self, action_id, url, verifier):
+        """
+        Re-fetch the corrupt blocks found by ``verifier`` and check the
+        bundle again.
+
+        Returns:
+            MD5 hash of the repaired bundle or None if re-fetching failed
+        """
+        from . import delta
+
+        index = verifier.index
+        ranges = delta.merge_ranges(verifier.bad_blocks, index)
+        self.logger.info('Re-fetching {} corrupt blocks ({} bytes)'.format(
+            len(verifier.bad_blocks),
+            sum(end - start + 1 for start, end in ranges)))
+        try:
+            os.truncate(self.bundle_dl_location, index.size)
+            await self.ddi.get_binary_ranges(
+                url, self.bundle_dl_location, ranges,
+                progress_callback=lambda event: self.download_progress(
+                    action_id, event),
+                progress_interval=self.download_progress_interval)
+        except (APIError, OSError, ClientOSError, ClientResponseError,
+                asyncio.TimeoutError) as e:
+            self.logger.warning('Re-fetching blocks failed: {}'.format(e))
+            return None
+
+        return await delta.throttled_file_md5(
+            self.bundle_dl_location, self.ddi.scheduler.bulk_checkpoint,
+            verifier)
+
+    async def download_delta(self, action_id, url, md5sum, index_url):
+        """
+        Try to assemble the bundle from local seed data and download only
+        missing ranges. Seeds are matched at block-aligned offsets only, there
+        is no rolling checksum, so data shifted by a partial block is
+        downloaded again. Planning, assembly and hashing run in the executor,
+        hashing is paced like bulk transfers.
+
+        Returns:
+            True if the assembled bundle matches md5sum, False otherwise
+        """
+        from . import delta
+
+        try:
+            index = await self.fetch_block_index(index_url)
+            delta_plan = await self.loop.run_in_executor(
+                None, delta.plan, index, self.delta_seeds)
+            self.logger.info('Delta download: reusing {} bytes, downloading {} bytes'
+                             .format(delta_plan.reused_bytes,
+                                     delta_plan.missing_bytes))
+            await self.loop.run_in_executor(None, delta.assemble, delta_plan,
+                                            self.bundle_dl_location)
+            await self.ddi.get_binary_ranges(
+                url, self.bundle_dl_location, delta_plan.missing,
+                progress_callback=lambda event: self.download_progress(
+                    action_id, event),
+                progress_interval=self.download_progress_interval)
+        except (APIError, delta.DeltaError, OSError, ClientOSError,
+                ClientResponseError, asyncio.TimeoutError) as e:
+            self.logger.warning('Delta download failed: {}'.format(e))
+            return False
+
+        try:
+            checksum = await self.bundle_md5()
+        except OSError as e:
+            self.logger.warning('Delta download failed: {}'.format(e))
+            return False
+        if checksum != md5sum:
+            self.logger.warning('Delta download: checksum does not match')
+            return False
+
+        return True
+
     async def download_artifact(self, action_id, url, md5sum,
-                                tries=3):
-        """Download bundle artifact."""
+                                tries=3, index_url=None, resume=False,
+                                sources=(), size=None, filename=None):
+        """
+        Download bundle artifact. With ``resume``, an interrupted download of
+        the same artifact at bundle_dl_location is continued. With several
+        ``sources`` ([(url, authorize)]), the fastest one is used. Artifacts
+        found in local_sources are copied instead of downloaded.
+        """
         try:
             match = re.search('/softwaremodules/(.+)/artifacts/(.+)$', url)
             software_module, filename = match.groups()
@@ -253,23 +656,93 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
         if self.step_callback:
             self.step_callback(0, "Downloading bundle...")
 
+        # the previous bundle is overwritten
+        self.withdraw_bundle()
+        offset = 0
+        if resume and os.path.exists(self.bundle_dl_location):
+            offset = os.path.getsize(self.bundle_dl_location)
+            # only a bundle of the expected size can be complete
+            if (size is None or offset == size) and \
+                    await self.bundle_md5() == md5sum:
+                self.logger.info('Bundle already downloaded')
+                self.download_finished(md5sum)
+                return
+            # data beyond the recorded offset might not have been synced
+            offset = min(offset, self.journal.state.get('offset', offset))
+            self.journal.record(action_id, DeploymentPhase.downloading,
+                                offset=offset)
+            self.logger.info('Resuming download at offset {}'.format(offset))
+
+        if self.local_sources and not offset:
+            if await self.copy_local_artifact(md5sum, filename, size):
+                self.download_finished(md5sum)
+                return
+
+        if self.peer_sharing and not offset:
+            if await self.peer_sharing.fetch(md5sum, self.bundle_dl_location,
+                                             self.ddi):
+                self.logger.info('Download from peer successful')
+                self.download_finished(md5sum)
+                return
+
+        if index_url and self.delta_seeds and not offset:
+            if await self.download_delta(action_id, url, md5sum, index_url):
+                self.logger.info('Download successful')
+                self.download_finished(md5sum)
+                return
+            self.logger.info('Falling back to full download')
+
+        def progress_callback(event):
+            self.download_progress(action_id, event)
+            self.record_download_offset(action_id, event.received)
+
+        verifier = None
+        if index_url and self.verify_blocks:
+            verifier = await self.block_verifier(index_url)
+        repair = False
+
         # try several times
         for dl_try in range(tries):
-            if not static_api_url:
+            if repair:
+                checksum = await self.repair_download(action_id, url,
+                                                      verifier)
+            elif len(sources) > 1:
+                from .mirrors import Source
+                checksum = await self.select_source().download(
+                    [Source(*source) for source in sources],
+                    self.bundle_dl_location, size=size, offset=offset,
+                    progress_callback=progress_callback,
+                    progress_interval=self.download_progress_interval,
+                    block_verifier=verifier)
+            elif not static_api_url:
                 checksum = await self.ddi.softwaremodules[software_module] \
-                    .artifacts[filename](self.bundle_dl_location)
+                    .artifacts[filename](
+                        self.bundle_dl_location, offset,
+                        progress_callback=progress_callback,
+                        progress_interval=self.download_progress_interval,
+                        block_verifier=verifier)
             else:
                 # API implementations might return static URLs, so bypass API
                 # methods and download bundle anyway
-                checksum = await self.ddi.get_binary(url,
-                                                     self.bundle_dl_location)
+                checksum = await self.ddi.get_binary(
+                    url, self.bundle_dl_location, offset=offset,
+                    progress_callback=progress_callback,
+                    progress_interval=self.download_progress_interval,
+                    block_verifier=verifier)
+            # only the first try resumes
+            offset = 0
 
             if checksum == md5sum:
                 self.logger.info('Download successful')
+                self.download_finished(md5sum)
                 return
             else:
                 self.logger.error('Checksum does not match. {} tries remaining'
                                   .format(tries-dl_try))
+            # fetch only the corrupt blocks again, a full download follows if
+            # re-fetching failed
+            repair = checksum is not None and verifier is not None and \
+                verifier.repairable
         # MD5 comparison unsuccessful, send negative feedback to HawkBit
         status_msg = 'Artifact checksum does not match after {} tries.' \
             .format(tries)
@@ -277,27 +750,192 @@ class RaucDBUSDDIClient(AsyncDBUSClient):
         status_result = DeploymentStatusResult.failure
         await self.ddi.deploymentBase[action_id].feedback(
                 status_execution, status_result, [status_msg])
+        self.journal.clear()
         raise APIError(status_msg)
 
+    def record_download_offset(self, action_id, offset):
+        """
+        Record the offset of the running download in the journal, at most
+        every journal_offset_interval seconds.
+        """
+        now = time.monotonic()
+        if now - self.last_journal_offset < self.journal_offset_interval:
+            return
+        self.last_journal_offset = now
+        self.journal.record(action_id, DeploymentPhase.downloading,
+                            offset=offset)
+
+    async def bundle_md5(self):
+        """
+        MD5 hash of the file at bundle_dl_location, None if missing. Hashing
+        is paced by the scheduler like bulk transfers.
+        """
+        from .delta import throttled_file_md5
+
+        try:
+            return await throttled_file_md5(self.bundle_dl_location,
+                                            self.ddi.scheduler.bulk_checkpoint)
+        except FileNotFoundError:
+            return None
+
+    def download_progress(self, action_id, event):
+        """
+        Called with a ProgressEvent during bundle downloads. Reports progress
+        to step_callback and the log, and at most every
+        download_feedback_interval seconds as feedback to HawkBit.
+        """
+        message = 'Downloading bundle: {:.1f} MiB'.format(
+            event.received / 2**20)
+        if event.total:
+            message += ' of {:.1f} MiB'.format(event.total / 2**20)
+        message += ', {:.2f} MiB/s'.format(event.throughput / 2**20)
+        if event.eta is not None:
+            message += ', {} remaining'.format(
+                timedelta(seconds=int(event.eta)))
+
+        self.progress_logger.info(message)
+        if self.step_callback:
+            self.step_callback(event.percentage or 0, message)
+
+        now = time.monotonic()
+        if now - self.last_download_feedback < self.download_feedback_interval:
+            return
+        # never queue feedback behind a slow server
+        if self.download_feedback and not self.download_feedback.done():
+            return
+        self.last_download_feedback = now
+        self.download_feedback = asyncio.ensure_future(
+            self.send_download_feedback(action_id, message, event.percentage))
+
+    async def send_download_feedback(self, action_id, message, percentage):
+        status_execution = DeploymentStatusExecution.proceeding
+        status_result = DeploymentStatusResult.none
+        progress = {}
+        if percentage is not None:
+            progress['percentage'] = percentage
+        try:
+            await self.ddi.deploymentBase[action_id].feedback(
+                status_execution, status_result, [message], **progress)
+        except (APIError, ClientOSError, ClientResponseError,
+                asyncio.TimeoutError) as e:
+            self.logger.warning('Sending download progress failed: {}'
+                                .format(e))
+
+    def download_finished(self, md5sum):
+        """Called with the verified bundle at bundle_dl_location."""
+        self.bundle_md5sum = md5sum
+        if self.peer_sharing:
+            self.peer_sharing.advertise(md5sum, self.bundle_dl_location)
+
+    def withdraw_bundle(self):
+        """
+        Stop offering the bundle at bundle_dl_location to peers, e.g. before
+        it is replaced or after its installation failed.
+        """
+        if self.peer_sharing and self.bundle_md5sum:
+            self.peer_sharing.withdraw(self.bundle_md5sum)
+
     async def sleep(self, base):
         """Sleep time suggested by HawkBit."""
         sleep_str = base['config']['polling']['sleep']
         self.logger.info('Will sleep for {}'.format(sleep_str))
         t = datetime.strptime(sleep_str, '%H:%M:%S')
         delta = timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
-        await asyncio.sleep(delta.total_seconds())
+        if self.notification_channel:
+            if await self.notification_channel.wait(delta.total_seconds()):
+                self.logger.info('Woken up by notification')
+        else:
+            await asyncio.sleep(delta.total_seconds())
 
-    async def poll_base_resource(self):
-        """Poll DDI API base resource."""
-        while True:
-            base = await self.ddi()
+    @property
+    def deployment_running(self):
+        return self.deployment_task is not None and \
+            not self.deployment_task.done()
 
-            if '_links' in base:
-                if 'configData' in base['_links']:
-                    await self.identify(base)
-                if 'deploymentBase' in base['_links']:
-                    await self.process_deployment(base)
-                if 'cancelAction' in base['_links']:
-                    await self.cancel(base)
+    def start_deployment(self, base):
+        """Run process_deployment() as task, unless one is running."""
+        if self.deployment_running:
+            self.logger.debug('Deployment task still running')
+            return
+        # installation in progress, the task would return immediately and
+        # the poll loop would not sleep
+        if self.action_id is not None:
+            self.logger.info('Deployment is already in progress')
+            return
+        self.deployment_task = asyncio.ensure_future(
+            self.process_deployment(base))
+
+    def check_deployment(self):
+        """Raise the error of a failed deployment task."""
+        task = self.deployment_task
+        if task is None or not task.done():
+            return
+        self.deployment_task = None
+        self.deployment_action_id = None
+        if not task.cancelled():
+            task.result()
+
+    async def cancel_deployment(self):
+        """Cancel running deployment task and wait for it to finish."""
+        task = self.deployment_task
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.wait([task])
+        self.deployment_task = None
+        self.deployment_action_id = None
 
-            await self.sleep(base)
+    async def run_handlers(self, *coros):
+        """
+        Run poll response handlers concurrently. If one fails, the others are
+        canceled.
+        """
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        if not tasks:
+            return
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+
+    async def poll_base_resource(self):
+        """
+        Poll DDI API base resource.
+
+        The deployment is started first and runs as a task across polls,
+        identify and cancel requests run concurrently with it. When polling is
+        cancelled, the deployment task is cancelled as well.
+        """
+        try:
+            while True:
+                self.check_deployment()
+                await self.resume_deployment()
+                base = await self.ddi()
+
+                handlers = []
+                links = base.get('_links', {})
+                if 'deploymentBase' in links:
+                    self.start_deployment(base)
+                if 'configData' in links:
+                    handlers.append(self.identify(base))
+                if 'cancelAction' in links:
+                    handlers.append(self.cancel(base))
+                await self.run_handlers(*handlers)
+
+                # poll again early if the deployment task finishes or fails
+                sleep = asyncio.ensure_future(self.sleep(base))
+                waits = [sleep]
+                if self.deployment_running:
+                    waits.append(self.deployment_task)
+                try:
+                    await asyncio.wait(waits,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sleep.cancel()
+                if sleep.done() and not sleep.cancelled():
+                    sleep.result()
+        except asyncio.CancelledError:
+            await self.cancel_deployment()
+            raise
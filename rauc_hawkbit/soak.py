@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import gc
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+import aiohttp
+from aiohttp import web
+
+from .fake_rauc import RAUC_INTERFACE, RAUC_NAME
+from .journal import DeploymentPhase
+from .rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+TARGET = '/DEFAULT/controller/v1/soak'
+PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+# resource usage of the client process, taken between polls
+SoakSample = namedtuple('SoakSample',
+                        'cycle time rss fds tasks traced dbus_events '
+                        'subscriptions')
+
+METRICS = ('rss', 'fds', 'tasks', 'traced', 'dbus_events', 'subscriptions')
+
+# asyncio.all_tasks() was added in Python 3.7
+all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+
+
+class SoakError(Exception):
+    """A resource grew during the soak run."""
+    pass
+
+
+class VirtualClockSelector(object):
+    """
+    Wraps a selector: if no I/O is ready within ``grace`` seconds and the
+    loop has no executor jobs running, the loop's virtual clock jumps to the
+    next timer instead of waiting for it.
+    """
+    def __init__(self, selector, loop, grace):
+        self.selector = selector
+        self.loop = loop
+        self.grace = grace
+
+    def select(self, timeout=None):
+        if timeout is None or timeout <= self.grace or self.loop.executor_jobs:
+            return self.selector.select(timeout)
+        events = self.selector.select(self.grace)
+        if not events:
+            self.loop.advance(timeout - self.grace)
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock skips idle time, so sleeps and timeouts of hours
+    finish immediately while real I/O (local sockets, executor jobs) still
+    works.
+    """
+    def __init__(self, grace=0):
+        import selectors
+
+        self.offset = 0.0
+        self.executor_jobs = 0
+        super(VirtualClockLoop, self).__init__(
+            VirtualClockSelector(selectors.DefaultSelector(), self, grace))
+
+    def time(self):
+        return super(VirtualClockLoop, self).time() + self.offset
+
+    def advance(self, seconds):
+        self.offset += seconds
+
+    def run_in_executor(self, executor, func, *args):
+        # time must not jump while e.g. DNS lookups or file I/O are running
+        future = super(VirtualClockLoop, self).run_in_executor(executor, func,
+                                                               *args)
+        self.executor_jobs += 1
+
+        def done(_):
+            self.executor_jobs -= 1
+        future.add_done_callback(done)
+        return future
+
+
+def create_ddi_app(artifact, sleep='12:00:00', deployment_every=4):
+    """
+    Local DDI stand-in offering a new deployment of ``artifact`` every
+    ``deployment_every`` polls (0: never).
+    """
+    md5sum = hashlib.md5(artifact).hexdigest()
+    # mutable, application state can not be changed once started
+    state = {'polls': 0, 'deployments': 0, 'action': None, 'results': []}
+
+    async def base(request):
+        state['polls'] += 1
+        if state['action'] is None and deployment_every and \
+                state['polls'] % deployment_every == 0:
+            state['action'] = state['deployments'] = state['deployments'] + 1
+        links = {}
+        if state['action'] is not None:
+            links['deploymentBase'] = {
+                'href': 'http://{}{}/deploymentBase/{}?c=1'.format(
+                    request.host, TARGET, state['action'])}
+        return web.json_response({
+            'config': {'polling': {'sleep': sleep}},
+            '_links': links,
+        })
+
+    async def deployment(request):
+        return web.json_response({'deployment': {'chunks': [{'artifacts': [{
+            'filename': 'bundle.raucb',
+            'size': len(artifact),
+            'hashes': {'md5': md5sum},
+            '_links': {'download-http': {
+                'href': 'http://{}/artifact'.format(request.host)}},
+        }]}]}})
+
+    async def artifact_handler(request):
+        return web.Response(body=artifact)
+
+    async def feedback(request):
+        data = await request.json()
+        if data['status']['execution'] == 'closed':
+            state['action'] = None
+            state['results'].append(data['status']['result']['finished'])
+        return web.Response()
+
+    app = web.Application()
+    app['state'] = state
+    app.router.add_route('GET', TARGET, base)
+    app.router.add_route('GET', TARGET + '/deploymentBase/{action}',
+                         deployment)
+    app.router.add_route('POST', TARGET + '/deploymentBase/{action}/feedback',
+                         feedback)
+    app.router.add_route('GET', '/artifact', artifact_handler)
+    return app
+
+
+class StubBridge(object):
+    """Stands in for the GLibBridge, calls functions directly."""
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def call(self, func, *args):
+        return func(*args)
+
+
+class StubBus(object):
+    """Stands in for the D-Bus connection, keeps track of subscriptions."""
+    def __init__(self):
+        self.subscriptions = set()
+        self.last_subscription = 0
+
+    def signal_subscribe(self, *args):
+        self.last_subscription += 1
+        self.subscriptions.add(self.last_subscription)
+        return self.last_subscription
+
+    def signal_unsubscribe(self, subscription):
+        self.subscriptions.remove(subscription)
+
+
+class SimulatedInstallClient(RaucDBUSDDIClient):
+    """
+    RaucDBUSDDIClient without a D-Bus connection: the client subscribes to
+    RAUC's signals and properties as usual, but on a StubBus, so the
+    ``subscriptions`` metric is measured. Installations are simulated by
+    putting RAUC's Progress and Completed events on the D-Bus event queue, so
+    they take the same path as real events.
+    """
+    progress_events = 10
+
+    def open_bus(self):
+        return StubBridge(), StubBus()
+
+    def new_proxy(self, interface, object_path):
+        # no methods are called, installations are simulated
+        return None
+
+    async def install_bundle(self, action_id):
+        self.journal.record(action_id, DeploymentPhase.installing)
+        self.action_id = action_id
+        self.connect_dbus()
+        for event in range(self.progress_events):
+            percentage = (event + 1) * 100 // self.progress_events
+            self.on_dbus_event(None, RAUC_NAME, '/', PROPERTIES_INTERFACE,
+                               'PropertiesChanged',
+                               (RAUC_INTERFACE,
+                                {'Progress': (percentage, 'Installing', 1)},
+                                []))
+        self.on_dbus_event(None, RAUC_NAME, '/', RAUC_INTERFACE, 'Completed',
+                           (0,))
+
+
+def growth(values):
+    """
+    Growth over the samples according to the least squares line, robust
+    against single outliers.
+    """
+    count = len(values)
+    if count < 2:
+        return 0
+    mean_x = (count - 1) / 2
+    mean_y = sum(values) / count
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values)) / \
+        sum((x - mean_x) ** 2 for x in range(count))
+    return slope * (count - 1)
+
+
+class SoakReport(object):
+    """Samples of a soak run and the growth of each metric."""
+    def __init__(self, samples, warmup, tolerances, deployments, results,
+                 elapsed):
+        self.samples = samples
+        self.warmup = warmup
+        self.tolerances = tolerances
+        self.deployments = deployments
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def virtual_time(self):
+        return self.samples[-1].time if self.samples else 0
+
+    def growth(self):
+        measured = self.samples[self.warmup:]
+        return {metric: growth([getattr(sample, metric)
+                                for sample in measured])
+                for metric in METRICS}
+
+    def leaks(self):
+        """Returns {metric: growth} of metrics exceeding their tolerance."""
+        return {metric: value for metric, value in self.growth().items()
+                if value > self.tolerances[metric]}
+
+    def check(self):
+        leaks = self.leaks()
+        if leaks:
+            raise SoakError('Resources grew during soak run: {}'.format(
+                ', '.join('{} +{:.0f}'.format(metric, value)
+                          for metric, value in sorted(leaks.items()))))
+        failed = [result for result in self.results if result != 'success']
+        if failed:
+            raise SoakError('{} of {} deployments failed'.format(
+                len(failed), len(self.results)))
+
+
+class SoakHarness(object):
+    """
+    Runs the real ``start_polling()`` loop against a local DDI stand-in on a
+    ``VirtualClockLoop``, so weeks of polls and deployments finish in minutes.
+
+    After each poll interval, RSS, open file descriptors, asyncio tasks,
+    memory traced by tracemalloc, queued D-Bus events and D-Bus subscriptions
+    are sampled. ``SoakReport.check()`` fails if any of them grows by more
+    than its tolerance after ``warmup`` samples.
+
+    Installations are simulated through the D-Bus event queue, with
+    ``bus_address`` the client talks to a ``FakeRaucInstaller`` on that bus
+    instead.
+    """
+    default_tolerances = {
+        'rss': 4 * 1024 * 1024,
+        'fds': 2,
+        'tasks': 2,
+        'traced': 512 * 1024,
+        'dbus_events': 1,
+        'subscriptions': 0,
+    }
+
+    def __init__(self, cycles=60, poll_interval=12*3600, deployment_every=4,
+                 artifact_size=256*1024, warmup=5, tolerances=None,
+                 bus_address=None, grace=0):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.cycles = cycles
+        self.poll_interval = poll_interval
+        self.deployment_every = deployment_every
+        self.artifact_size = artifact_size
+        self.warmup = warmup
+        self.tolerances = dict(self.default_tolerances)
+        self.tolerances.update(tolerances or {})
+        self.bus_address = bus_address
+        self.grace = grace
+
+    @staticmethod
+    def rss():
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    @staticmethod
+    def open_fds():
+        return len(os.listdir('/proc/self/fd'))
+
+    def sample(self, cycle, start, client):
+        gc.collect()
+        return SoakSample(cycle, client.loop.time() - start, self.rss(),
+                          self.open_fds(), len(all_tasks()),
+                          tracemalloc.get_traced_memory()[0],
+                          client.dbus_events.qsize(),
+                          len(client.signal_subscriptions))
+
+    def create_client(self, session, host, bundle_dl_location):
+        client_class = RaucDBUSDDIClient if self.bus_address \
+            else SimulatedInstallClient
+        return client_class(session, host, False, 'DEFAULT', 'soak', 'token',
+                            {'MAC': 'ff:ff:ff:ff:ff:ff'}, bundle_dl_location,
+                            lambda result: None, lazy_dbus=True,
+                            bus_address=self.bus_address)
+
+    async def soak(self):
+        hours, seconds = divmod(int(self.poll_interval), 3600)
+        sleep = '{:02d}:{:02d}:{:02d}'.format(hours, seconds // 60,
+                                              seconds % 60)
+        app = create_ddi_app(os.urandom(self.artifact_size), sleep,
+                             self.deployment_every)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host = '127.0.0.1:{}'.format(runner.addresses[0][1])
+
+        samples = []
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                async with aiohttp.ClientSession() as session:
+                    client = self.create_client(
+                        session, host, os.path.join(tmpdir, 'bundle.raucb'))
+                    polling = asyncio.ensure_future(client.start_polling())
+                    start = client.loop.time()
+                    try:
+                        # sample between polls
+                        await asyncio.sleep(self.poll_interval / 2)
+                        for cycle in range(self.cycles):
+                            samples.append(self.sample(cycle, start, client))
+                            await asyncio.sleep(self.poll_interval)
+                    finally:
+                        polling.cancel()
+                        await asyncio.wait([polling])
+                        client.cleanup_dbus()
+        finally:
+            await runner.cleanup()
+        return samples, app['state']['deployments'], app['state']['results']
+
+    def run(self):
+        """
+        Run the soak test on a new VirtualClockLoop.
+
+        Returns:
+            SoakReport
+        """
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        loop = VirtualClockLoop(self.grace)
+        asyncio.set_event_loop(loop)
+        start = time.monotonic()
+        try:
+            samples, deployments, results = loop.run_until_complete(
+                self.soak())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            if not tracing:
+                tracemalloc.stop()
+        return SoakReport(samples, self.warmup, self.tolerances, deployments,
+                          results, time.monotonic() - start)
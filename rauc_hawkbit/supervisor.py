@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import fcntl
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import aiohttp
+from aiohttp.client_exceptions import ClientError
+
+from .ddi.client import DDIClient, APIError
+from .ddi.client import ConfigStatusExecution, ConfigStatusResult
+from .ddi.deployment_base import (
+    DeploymentStatusExecution, DeploymentStatusResult)
+from .proxy import ArtifactStore
+
+# controller identity driven by a worker, attributes are sent as configData
+Target = namedtuple('Target', 'name auth_token attributes')
+
+# deployment result reported by a worker
+Result = namedtuple('Result', 'worker target action_id success message')
+
+# counters collected from each worker
+METRICS = ('polls', 'errors', 'deployments', 'cancellations', 'downloads',
+           'downloaded_bytes', 'store_hits')
+
+
+def shard(targets, count):
+    """
+    Distribute targets round-robin in name order across ``count`` shards, so
+    shard sizes differ by at most one. The same targets always end up in the
+    same shards for the same ``count``.
+    """
+    shards = [[] for _ in range(count)]
+    for index, target in enumerate(sorted(targets,
+                                          key=lambda target: target.name)):
+        shards[index % count].append(target)
+    return shards
+
+
+class WorkerLogHandler(logging.handlers.QueueHandler):
+    """Sends log records of a worker process as ``('log', record)``."""
+    def enqueue(self, record):
+        self.queue.put(('log', record))
+
+
+class Worker(object):
+    """
+    Drives the poll loops of several targets in one event loop.
+
+    Artifacts are downloaded into an ``ArtifactStore`` shared by all workers:
+    concurrent deployments of the same artifact cause a single download per
+    worker, a lock file in the store makes other workers wait for a running
+    download and use its result.
+
+    Deployment results and metrics are put on the ``events`` queue as
+    ``('result', Result)`` and ``('metrics', worker, {name: value})``.
+    ``handler(target_name, action_id, path)`` installs a downloaded artifact
+    and returns whether it succeeded, without it deployments fail. Errors
+    of a target are logged and retried after ``wait_on_error`` seconds, they
+    do not affect the other targets.
+    """
+    def __init__(self, worker, session, host, ssl, tenant_id, targets, store,
+                 events, handler=None, wait_on_error=60, metrics_interval=10):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.worker = worker
+        self.session = session
+        self.host = host
+        self.ssl = ssl
+        self.tenant_id = tenant_id
+        self.targets = targets
+        self.store = store
+        self.events = events
+        self.handler = handler
+        self.wait_on_error = wait_on_error
+        self.metrics_interval = metrics_interval
+        self.metrics = dict.fromkeys(METRICS, 0)
+        # md5: running download
+        self.fetches = {}
+
+    async def run(self):
+        tasks = [asyncio.ensure_future(self.poll(target))
+                 for target in self.targets]
+        tasks.append(asyncio.ensure_future(self.report_metrics()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.events.put(('metrics', self.worker, dict(self.metrics)))
+
+    async def report_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            self.events.put(('metrics', self.worker, dict(self.metrics)))
+
+    async def poll(self, target):
+        ddi = DDIClient(self.session, self.host, self.ssl, target.auth_token,
+                        self.tenant_id, target.name)
+        while True:
+            try:
+                base = await ddi()
+                self.metrics['polls'] += 1
+                links = base.get('_links', {})
+                if 'configData' in links and target.attributes:
+                    await ddi.configData(ConfigStatusExecution.closed,
+                                         ConfigStatusResult.success,
+                                         **target.attributes)
+                if 'cancelAction' in links:
+                    await self.cancel(ddi, target,
+                                      links['cancelAction']['href'])
+                if 'deploymentBase' in links:
+                    await self.deploy(ddi, target,
+                                      links['deploymentBase']['href'])
+                t = datetime.strptime(base['config']['polling']['sleep'],
+                                      '%H:%M:%S')
+                delay = timedelta(hours=t.hour, minutes=t.minute,
+                                  seconds=t.second).total_seconds()
+            except (APIError, ClientError, asyncio.TimeoutError) as e:
+                self.metrics['errors'] += 1
+                self.logger.warning('{}: polling failed: {}'.format(
+                    target.name, e))
+                delay = max(self.wait_on_error,
+                            getattr(e, 'retry_after', None) or 0)
+            except Exception:
+                # e.g. malformed responses
+                self.metrics['errors'] += 1
+                self.logger.exception('{}: polling failed'.format(
+                    target.name))
+                delay = self.wait_on_error
+            await asyncio.sleep(delay)
+
+    async def cancel(self, ddi, target, href):
+        """
+        Accept cancelation requests: deployments of a target run one at a
+        time within a poll, so the action to stop has not started yet or has
+        already finished.
+        """
+        from .ddi.cancel_action import (
+            CancelStatusExecution, CancelStatusResult)
+
+        match = re.search(r'/cancelAction/(.+)$', href)
+        if match is None:
+            raise APIError('Invalid cancelAction link {}'.format(href))
+        action_id, = match.groups()
+        stop_info = await ddi.cancelAction[action_id]()
+        stop_id = stop_info['cancelAction']['stopId']
+        self.logger.info('{}: canceling action {}'.format(target.name,
+                                                          stop_id))
+        await ddi.cancelAction[stop_id].feedback(
+            CancelStatusExecution.closed, CancelStatusResult.success,
+            status_details=('Deployment canceled',))
+        self.metrics['cancellations'] += 1
+
+    async def deploy(self, ddi, target, href):
+        match = re.search(r'/deploymentBase/(.+)\?c=(.+)$', href)
+        if match is None:
+            raise APIError('Invalid deploymentBase link {}'.format(href))
+        action_id, resource = match.groups()
+        deploy_info = await ddi.deploymentBase[action_id](resource)
+        self.metrics['deployments'] += 1
+
+        try:
+            artifact = deploy_info['deployment']['chunks'][0]['artifacts'][0]
+            links = artifact['_links']
+            url = (links.get('download') or links['download-http'])['href']
+            md5sum = artifact['hashes']['md5']
+            if self.handler is None:
+                # nothing would install the artifact
+                success, message = False, 'No deployment handler configured'
+            else:
+                path = await self.fetch(ddi, url, md5sum)
+                success = self.handler(target.name, action_id, path)
+                message = 'Deployment {}'.format(
+                    'successful' if success else 'failed')
+        except (KeyError, IndexError):
+            success, message = False, 'Deployment without artifacts'
+        except (APIError, OSError) as e:
+            success, message = False, 'Download failed: {}'.format(e)
+
+        await ddi.deploymentBase[action_id].feedback(
+            DeploymentStatusExecution.closed,
+            DeploymentStatusResult.success if success
+            else DeploymentStatusResult.failure,
+            [message])
+        self.events.put(('result', Result(self.worker, target.name, action_id,
+                                          success, message)))
+
+    async def fetch(self, ddi, url, md5sum):
+        """Returns store path of the artifact, downloads it if needed."""
+        path = self.store.get(md5sum)
+        if path:
+            self.metrics['store_hits'] += 1
+            return path
+
+        if md5sum not in self.fetches:
+            fetch = asyncio.ensure_future(self.download(ddi, url, md5sum))
+            self.fetches[md5sum] = fetch
+            fetch.add_done_callback(
+                lambda f: self.fetches.pop(md5sum, None))
+        return await asyncio.shield(self.fetches[md5sum])
+
+    async def download(self, ddi, url, md5sum):
+        lock_path = os.path.join(self.store.directory,
+                                 '.lock-{}'.format(md5sum))
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+        # another worker might be downloading the same artifact
+        locking = asyncio.get_event_loop().run_in_executor(
+            None, fcntl.flock, fd, fcntl.LOCK_EX)
+        try:
+            # not canceled with this task, fd is in use until flock returns
+            await asyncio.shield(locking)
+
+            path = self.store.get(md5sum)
+            if path:
+                self.metrics['store_hits'] += 1
+            else:
+                path = await self.download_locked(ddi, url, md5sum)
+            # workers locking the file afterwards find the artifact in the
+            # store
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+            return path
+        finally:
+            # closing releases the lock
+            if locking.done():
+                os.close(fd)
+            else:
+                locking.add_done_callback(lambda _: os.close(fd))
+
+    async def download_locked(self, ddi, url, md5sum):
+        tmp_path = self.store.tempfile()
+        try:
+            checksum = await ddi.get_binary(url, tmp_path)
+            if checksum != md5sum:
+                raise APIError('Artifact checksum does not match')
+            self.metrics['downloads'] += 1
+            self.metrics['downloaded_bytes'] += os.path.getsize(tmp_path)
+            return self.store.put(md5sum, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def run_worker(worker, host, ssl, tenant_id, targets, store_directory,
+               store_max_size, events, stop, handler=None, wait_on_error=60,
+               metrics_interval=10, log_level=logging.INFO):
+    """
+    Entry point of worker processes, runs until ``stop`` is set. Log records
+    are sent to the supervisor through ``events``.
+    """
+    root = logging.getLogger()
+    root.setLevel(log_level)
+    root.addHandler(WorkerLogHandler(events))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def main():
+        store = ArtifactStore(store_directory, store_max_size)
+        async with aiohttp.ClientSession() as session:
+            runner = Worker(worker, session, host, ssl, tenant_id, targets,
+                            store, events, handler=handler,
+                            wait_on_error=wait_on_error,
+                            metrics_interval=metrics_interval)
+            task = asyncio.ensure_future(runner.run())
+            while not task.done() and not stop.is_set():
+                await asyncio.sleep(0.1)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+class Supervisor(object):
+    """
+    Shards many controller identities across worker processes, each running
+    its own event loop, so hashing, TLS and JSON processing scale with the
+    number of cores.
+
+    Workers share downloaded artifacts through an ``ArtifactStore`` at
+    ``store_directory``. Deployment results and worker metrics are collected
+    centrally via ``collect()``, which also passes log records of the workers
+    to the supervisor's log handlers. ``handler(target_name, action_id, path)``
+    is called in the worker for each downloaded artifact and returns whether
+    the deployment succeeded, it must be picklable (module level function).
+    Without a handler, deployments are reported as failed.
+    """
+    def __init__(self, host, ssl, tenant_id, targets, store_directory,
+                 workers=None, store_max_size=None, handler=None,
+                 wait_on_error=60, metrics_interval=10):
+        self.logger = logging.getLogger('rauc_hawkbit')
+        self.host = host
+        self.ssl = ssl
+        self.tenant_id = tenant_id
+        self.targets = list(targets)
+        self.store_directory = store_directory
+        self.store_max_size = store_max_size
+        self.workers = workers or os.cpu_count() or 1
+        self.handler = handler
+        self.wait_on_error = wait_on_error
+        self.metrics_interval = metrics_interval
+
+        # worker processes start with a fresh interpreter, forking a process
+        # with a running event loop is unsafe
+        self.context = multiprocessing.get_context('spawn')
+        self.events = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.processes = []
+        self.results = []
+        self.metrics = {}
+
+    def start(self):
+        os.makedirs(self.store_directory, exist_ok=True)
+        for worker, targets in enumerate(shard(self.targets, self.workers)):
+            if not targets:
+                continue
+            process = self.context.Process(
+                target=run_worker, name='rauc-hawkbit-worker-{}'.format(worker),
+                args=(worker, self.host, self.ssl, self.tenant_id, targets,
+                      self.store_directory, self.store_max_size, self.events,
+                      self.stop_event),
+                kwargs={'handler': self.handler,
+                        'wait_on_error': self.wait_on_error,
+                        'metrics_interval': self.metrics_interval,
+                        'log_level': logging.getLogger(
+                            'rauc_hawkbit').getEffectiveLevel()},
+                daemon=True)
+            process.start()
+            self.processes.append(process)
+        self.logger.info('Started {} workers for {} targets'.format(
+            len(self.processes), len(self.targets)))
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+        # final metrics sent on shutdown
+        self.collect()
+
+    def collect(self, timeout=0):
+        """
+        Collect results and metrics sent by the workers, waits up to
+        ``timeout`` seconds for the first event.
+
+        Returns:
+            List of new results
+        """
+        results = []
+        while True:
+            try:
+                kind, *data = self.events.get(timeout=timeout) \
+                    if timeout else self.events.get_nowait()
+            except queue.Empty:
+                break
+            timeout = 0
+            if kind == 'result':
+                result, = data
+                results.append(result)
+            elif kind == 'metrics':
+                worker, metrics = data
+                self.metrics[worker] = metrics
+            elif kind == 'log':
+                record, = data
+                logging.getLogger(record.name).handle(record)
+        self.results.extend(results)
+        return results
+
+    def statistics(self):
+        """Returns metrics summed over all workers."""
+        total = dict.fromkeys(METRICS, 0)
+        for metrics in self.metrics.values():
+            for name, value in metrics.items():
+                total[name] += value
+        total['workers'] = len(self.metrics)
+        total['results'] = len(self.results)
+        return total
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+# upper bounds (seconds) of the lag histogram buckets
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+               float('inf'))
+
+# event loop blocked for at least ``duration`` seconds at ``time``
+# (time.time()), ``location`` is the innermost frame of ``stack``
+BlockingCall = namedtuple('BlockingCall', 'time duration location stack')
+
+
+class LagWatchdog(object):
+    """
+    Measures event loop lag and finds calls blocking the loop.
+
+    A task sleeps for ``interval`` seconds and records how much later than
+    expected it wakes up in a histogram. A watcher thread checks the task's
+    heartbeat: if the loop does not get back to it within ``threshold``
+    seconds, the stack of the loop thread is captured, so the blocking call
+    (synchronous file I/O, D-Bus calls, hashing) can be identified on
+    production devices. Blocking calls are logged to
+    ``rauc_hawkbit.watchdog`` and returned by ``statistics()`` together with
+    the histogram; a summary is logged every ``report_interval`` seconds.
+    """
+    def __init__(self, interval=0.1, threshold=0.5, report_interval=600,
+                 max_blocking_calls=20):
+        self.logger = logging.getLogger('rauc_hawkbit.watchdog')
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+
+        self.buckets = dict.fromkeys(LAG_BUCKETS, 0)
+        self.count = 0
+        self.total = 0.0
+        self.max_lag = 0.0
+        self.blocking_calls = collections.deque(maxlen=max_blocking_calls)
+
+        self.heartbeat = None
+        self.loop_thread = None
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+        # stack captured by the watcher thread for the current heartbeat
+        self.captured = None
+
+    def start(self):
+        """Start watching the running event loop."""
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.ensure_future(self.measure())
+        self.thread = threading.Thread(target=self.watch,
+                                       name='rauc-hawkbit-watchdog',
+                                       daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+            await asyncio.wait([self.task])
+            self.task = None
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def record(self, lag):
+        self.count += 1
+        self.total += lag
+        self.max_lag = max(self.max_lag, lag)
+        for bucket in LAG_BUCKETS:
+            if lag <= bucket:
+                self.buckets[bucket] += 1
+                break
+
+    async def measure(self):
+        last_report = time.monotonic()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.record(lag)
+            self.heartbeat = now
+
+            captured, self.captured = self.captured, None
+            if captured:
+                self.blocked(captured, lag)
+
+            if now - last_report >= self.report_interval:
+                last_report = now
+                self.report()
+
+    def blocked(self, captured, lag):
+        """Called in the loop once it is responsive again."""
+        location, stack = captured
+        call = BlockingCall(time.time(), lag, location, stack)
+        self.blocking_calls.append(call)
+        self.logger.warning(
+            'Event loop blocked for {:.3f}s in {}\n{}'.format(
+                call.duration, location, ''.join(stack)))
+
+    def watch(self):
+        """Watcher thread, captures the stack of a blocked loop thread."""
+        check_interval = min(self.interval, self.threshold) / 2
+        captured_heartbeat = None
+        while not self.stopped.wait(check_interval):
+            heartbeat = self.heartbeat
+            if heartbeat == captured_heartbeat:
+                continue
+            # heartbeat is due after interval
+            if time.monotonic() - heartbeat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            location = '{}:{} {}'.format(frame.f_code.co_filename,
+                                         frame.f_lineno, frame.f_code.co_name)
+            # the loop might have continued while capturing
+            if self.heartbeat != heartbeat:
+                continue
+            self.captured = (location, stack)
+            captured_heartbeat = heartbeat
+
+    def histogram(self):
+        """Returns cumulative counts {upper bound: count} of lag samples."""
+        histogram = collections.OrderedDict()
+        cumulative = 0
+        for bucket in LAG_BUCKETS:
+            cumulative += self.buckets[bucket]
+            histogram[bucket] = cumulative
+        return histogram
+
+    def report(self):
+        if not self.count:
+            return
+        self.logger.info(
+            'Event loop lag: mean {:.1f}ms, max {:.1f}ms, {} blocking calls'
+            .format(self.total / self.count * 1000, self.max_lag * 1000,
+                    len(self.blocking_calls)))
+
+    def statistics(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max_lag,
+            'histogram': self.histogram(),
+            'blocking_calls': [call._asdict()
+                               for call in self.blocking_calls],
+        }
@@ -13,13 +13,17 @@ setup(
       url='https://github.com/rauc/rauc-hawkbit',
       setup_requires=['setuptools_scm'],
       install_requires=[
-          'aiohttp>=3.3.2',
-          'gbulb>=0.5'
+          'aiohttp>=3.3.2'
       ],
+      extras_require={
+          'uvloop': ['uvloop']
+      },
       packages=find_packages(),
       include_package_data=True,
       zip_safe=False,
       scripts=[
-          'bin/rauc-hawkbit-client'
+          'bin/rauc-hawkbit-client',
+          'bin/rauc-hawkbit-proxy',
+          'bin/rauc-hawkbit-supervisor'
       ]
 )
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import json
+import os
+import pytest
+from aiohttp import web
+
+from rauc_hawkbit.ddi.cassette import CassetteError, RecordingSession, ReplaySession
+from rauc_hawkbit.ddi.client import DDIClient, APIError
+from rauc_hawkbit.ddi.client import ConfigStatusExecution, ConfigStatusResult
+from rauc_hawkbit.soak import SimulatedInstallClient, create_ddi_app
+
+BINARY = bytes(range(256)) * 64
+
+
+def create_app(loop):
+    async def base(request):
+        return web.json_response({'config': {'polling': {'sleep': '00:05:00'}}})
+
+    async def deployment(request):
+        return web.json_response({'id': '3', 'c': request.query['c']})
+
+    async def config_data(request):
+        request.app['config_data'].append(await request.json())
+        return web.Response()
+
+    async def artifact(request):
+        return web.Response(body=BINARY)
+
+    app = web.Application()
+    app['config_data'] = []
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target', base)
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target/deploymentBase/3', deployment)
+    app.router.add_route('PUT', '/DEFAULT/controller/v1/test-target/configData', config_data)
+    app.router.add_route('GET', '/artifact', artifact)
+    return app
+
+
+async def run_scenario(ddi, tmpdir):
+    base = await ddi()
+    deployment = await ddi.deploymentBase['3']('42')
+    await ddi.configData(ConfigStatusExecution.closed,
+                         ConfigStatusResult.success, MAC='ff:ff:ff:ff:ff:ff')
+    checksum = await ddi.get_binary(ddi.build_api_url('/artifact'),
+                                    str(tmpdir.join('bundle.raucb')))
+    with pytest.raises(APIError):
+        await ddi.get_resource('/DEFAULT/controller/v2')
+    return base, deployment, checksum
+
+
+async def test_record_replay(test_client, tmpdir):
+    client = await test_client(create_app)
+    cassette = str(tmpdir.join('cassette.jsonl'))
+
+    session = RecordingSession(client.session, cassette)
+    ddi = DDIClient(session, '{}:{}'.format(client.host, client.port), False, 'secret', 'DEFAULT', 'test-target')
+    recorded = await run_scenario(ddi, tmpdir)
+    assert recorded[2] == hashlib.md5(BINARY).hexdigest()
+    assert len(client.server.app['config_data']) == 1
+
+    with open(cassette) as fd:
+        content = fd.read()
+        assert 'secret' not in content
+    # artifacts are stored in side files
+    artifact, = [json.loads(line)['response'] for line in content.splitlines()
+                 if json.loads(line)['url'].endswith('/artifact')]
+    assert 'body' not in artifact
+    assert artifact['body_md5'] == hashlib.md5(BINARY).hexdigest()
+    assert os.path.getsize(os.path.join(cassette + '.bodies',
+                                        artifact['body_md5'])) == len(BINARY)
+
+    # replay offline, host does not matter
+    session = ReplaySession(cassette, speed=None)
+    ddi = DDIClient(session, 'offline.example.com', True, 'secret', 'DEFAULT', 'test-target')
+    assert await run_scenario(ddi, tmpdir) == recorded
+    assert session.done
+    assert len(client.server.app['config_data']) == 1
+
+
+async def test_replay_mismatch(tmpdir):
+    cassette = tmpdir.join('cassette.jsonl')
+    cassette.write(json.dumps({
+        'at': 0, 'elapsed': 0.01, 'method': 'GET',
+        'url': 'http://localhost/DEFAULT/controller/v1/test-target',
+        'headers': {}, 'body': '',
+        'response': {'status': 200, 'reason': 'OK', 'headers': [], 'body': ''}
+    }) + '\n')
+
+    ddi = DDIClient(ReplaySession(str(cassette)), 'localhost', False, None, 'DEFAULT', 'test-target')
+    with pytest.raises(CassetteError):
+        await ddi.get_resource('/{tenant}/controller/v1/other-target')
+
+
+def create_poll_app(loop):
+    # offers a deployment with the first poll
+    app = create_ddi_app(os.urandom(64 * 1024), deployment_every=1)
+    return app
+
+
+async def poll_cycle(session, host, tmpdir, done):
+    """Run poll_base_resource() until ``done(results)``, returns results."""
+    results = []
+    client = SimulatedInstallClient(
+        session, host, False, 'DEFAULT', 'soak', 'secret',
+        {'MAC': 'ff:ff:ff:ff:ff:ff'}, str(tmpdir.join('bundle.raucb')),
+        results.append, lazy_dbus=True)
+    polling = asyncio.ensure_future(client.poll_base_resource())
+    try:
+        for _ in range(500):
+            if done(results):
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        polling.cancel()
+        await asyncio.wait([polling])
+        client.cleanup_dbus()
+    return results
+
+
+async def test_replay_poll_cycle(test_client, tmpdir):
+    client = await test_client(create_poll_app)
+    cassette = str(tmpdir.join('cassette.jsonl'))
+    state = client.server.app['state']
+
+    def polls_recorded():
+        with open(cassette) as fd:
+            return sum(json.loads(line)['url'].endswith('/soak') for line in fd)
+
+    # poll, deployment with download, installation and feedback, poll again
+    session = RecordingSession(client.session, cassette)
+    recorded = await poll_cycle(
+        session, '{}:{}'.format(client.host, client.port), tmpdir,
+        lambda results: results and polls_recorded() == 2)
+    assert state['results'] == ['success']
+    assert recorded == [0]
+
+    session = ReplaySession(cassette, speed=None)
+    replayed = await poll_cycle(session, 'offline.example.com', tmpdir,
+                                lambda results: session.done)
+    assert session.done
+    assert replayed == recorded
+    assert state['polls'] == 2
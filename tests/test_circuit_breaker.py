@@ -0,0 +1,59 @@
+import pytest
+
+from rauc_hawkbit.ddi.circuit_breaker import CircuitBreaker, CircuitState
+from rauc_hawkbit.ddi.errors import CircuitOpenError, parse_retry_after
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_open_half_open_closed():
+    clock = Clock()
+    breaker = CircuitBreaker('poll', failure_threshold=2, reset_timeout=10,
+                             clock=clock)
+
+    for _ in range(2):
+        breaker.before_request()
+        breaker.record_failure()
+    assert breaker.state is CircuitState.open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # single probe after reset timeout
+    clock.now += 10
+    breaker.before_request()
+    assert breaker.state is CircuitState.half_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # failed probe doubles the timeout
+    breaker.record_failure()
+    clock.now += 10
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    clock.now += 10
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state is CircuitState.closed
+
+
+def test_retry_after_opens_immediately():
+    clock = Clock()
+    breaker = CircuitBreaker('feedback', reset_timeout=10, clock=clock)
+
+    breaker.before_request()
+    breaker.record_failure(retry_after=300)
+    assert breaker.state is CircuitState.open
+    assert breaker.retry_after == 300
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('garbage') is None
+    assert parse_retry_after(None) is None
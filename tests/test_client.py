@@ -1,10 +1,14 @@
+import hashlib
+import threading
+import time
 import pytest
 import aiohttp
 import asyncio
 from aiohttp import web
 
 from rauc_hawkbit.ddi.client import DDIClient
-from rauc_hawkbit.ddi.client import APIError
+from rauc_hawkbit.ddi.client import APIError, ServerBusyError
+from rauc_hawkbit.ddi.errors import CircuitOpenError
 
 async def hello(request):
     data = {
@@ -53,3 +57,184 @@ async def test_get_resource_invalid_path(test_client):
 
     with pytest.raises(APIError):
         resp = await ddi.get_resource('{tenant}/controller/v2')
+
+BINARY = bytes(range(256)) * 1024
+
+async def binary(request):
+    return web.Response(body=BINARY)
+
+async def binary_range(request):
+    # FileResponse-like servers honour the Range header
+    start = int(request.headers['Range'].split('=')[1].rstrip('-'))
+    return web.Response(status=206, body=BINARY[start:])
+
+async def binary_recorded(request):
+    request.app['ranges'].append(request.headers.get('Range'))
+    if 'Range' in request.headers:
+        return await binary_range(request)
+    return await binary(request)
+
+def create_binary_app(loop):
+    app = web.Application()
+    app['ranges'] = []
+    app.router.add_route('GET', '/binary', binary)
+    app.router.add_route('GET', '/binary-range', binary_range)
+    app.router.add_route('GET', '/binary-recorded', binary_recorded)
+    return app
+
+@pytest.mark.parametrize('path', ['/binary', '/binary-range'])
+async def test_get_binary_resume(test_client, tmpdir, path):
+    client = await test_client(create_binary_app)
+
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, '/DEFAULT', 'test-target')
+    dl_location = str(tmpdir.join('bundle.raucb'))
+    with open(dl_location, 'wb') as fd:
+        # partial download with garbage appended
+        fd.write(BINARY[:1000] + b'garbage')
+
+    checksum = await ddi.get_binary(ddi.build_api_url(path), dl_location, offset=1000)
+
+    assert checksum == hashlib.md5(BINARY).hexdigest()
+    with open(dl_location, 'rb') as fd:
+        assert fd.read() == BINARY
+
+@pytest.mark.parametrize('path', ['/binary', '/binary-range'])
+async def test_get_binary_progress(test_client, tmpdir, path):
+    client = await test_client(create_binary_app)
+
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, '/DEFAULT', 'test-target')
+    dl_location = str(tmpdir.join('bundle.raucb'))
+    with open(dl_location, 'wb') as fd:
+        fd.write(BINARY[:1000])
+
+    events = []
+    await ddi.get_binary(ddi.build_api_url(path), dl_location, offset=1000,
+                         progress_callback=events.append)
+
+    assert events[-1].received == len(BINARY)
+    assert events[-1].total == len(BINARY)
+    assert events[-1].percentage == 100
+
+class SlowVerifier(object):
+    """Block verifier stand-in, hashing the resumed data is slow."""
+    def __init__(self):
+        self.threads = []
+
+    def reset(self):
+        pass
+
+    def update(self, data):
+        if not self.threads:
+            time.sleep(0.3)
+        self.threads.append(threading.get_ident())
+
+    def finish(self):
+        pass
+
+async def test_get_binary_resume_responsive(test_client, tmpdir):
+    client = await test_client(create_binary_app)
+
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, '/DEFAULT', 'test-target')
+    dl_location = str(tmpdir.join('bundle.raucb'))
+    with open(dl_location, 'wb') as fd:
+        fd.write(BINARY[:1000])
+
+    gaps = []
+
+    async def ticker():
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(0.01)
+            gaps.append(time.monotonic() - start)
+
+    ticking = asyncio.ensure_future(ticker())
+    verifier = SlowVerifier()
+    try:
+        checksum = await ddi.get_binary(ddi.build_api_url('/binary-range'),
+                                        dl_location, offset=1000,
+                                        block_verifier=verifier)
+    finally:
+        ticking.cancel()
+
+    assert checksum == hashlib.md5(BINARY).hexdigest()
+    # the resumed data is hashed in the executor, the loop keeps running
+    assert verifier.threads[0] != threading.get_ident()
+    assert max(gaps) < 0.2
+
+class PausingGovernor(object):
+    """Governor stand-in pausing bulk transfers after the first chunk."""
+    chunk_size = 64 * 1024
+    paused_time = 0.0
+
+    def __init__(self):
+        self.paused = False
+        self.pauses = 0
+
+    async def throttle(self, size, pause=True):
+        if not self.pauses:
+            self.paused = True
+            self.pauses += 1
+
+    async def wait_resumed(self):
+        self.paused = False
+
+async def test_get_binary_paused(test_client, tmpdir):
+    client = await test_client(create_binary_app)
+
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, '/DEFAULT', 'test-target')
+    ddi.scheduler.governor = PausingGovernor()
+    dl_location = str(tmpdir.join('bundle.raucb'))
+
+    events = []
+    checksum = await ddi.get_binary(ddi.build_api_url('/binary-recorded'),
+                                    dl_location,
+                                    progress_callback=events.append)
+
+    # the connection is closed while paused and the download resumed
+    assert client.server.app['ranges'] == [None, 'bytes=65536-']
+    assert checksum == hashlib.md5(BINARY).hexdigest()
+    with open(dl_location, 'rb') as fd:
+        assert fd.read() == BINARY
+    assert events[-1].received == events[-1].total == len(BINARY)
+
+async def busy(request):
+    request.app['requests'] += 1
+    return web.Response(status=503, headers={'Retry-After': '120'})
+
+async def not_found(request):
+    request.app['requests'] += 1
+    return web.Response(status=404)
+
+def create_busy_app(loop):
+    app = web.Application()
+    app['requests'] = 0
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target', busy)
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target/deploymentBase/3', not_found)
+    return app
+
+async def test_circuit_breaker_retry_after(test_client):
+    client = await test_client(create_busy_app)
+
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, 'DEFAULT', 'test-target')
+
+    with pytest.raises(ServerBusyError) as excinfo:
+        await ddi()
+    assert excinfo.value.status == 503
+    assert excinfo.value.retry_after == 120
+
+    # poll circuit is open, no request is sent
+    with pytest.raises(CircuitOpenError) as excinfo:
+        await ddi()
+    assert 0 < excinfo.value.retry_after <= 120
+    assert client.server.app['requests'] == 1
+
+async def test_circuit_breaker_not_found(test_client):
+    client = await test_client(create_busy_app)
+
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, 'DEFAULT', 'test-target')
+
+    for _ in range(5):
+        with pytest.raises(APIError) as excinfo:
+            await ddi.get_resource('/{tenant}/controller/v1/{controllerId}/deploymentBase/3')
+        assert excinfo.value.status == 404
+    assert client.server.app['requests'] == 5
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import pytest
+from aiohttp import web
+
+from rauc_hawkbit.ddi.client import DDIClient
+from rauc_hawkbit.ddi.client import APIError
+from rauc_hawkbit import delta
+
+BLOCK_SIZE = 4096
+
+
+def write_bundle(path, data):
+    with open(str(path), 'wb') as fd:
+        fd.write(data)
+    return str(path)
+
+
+@pytest.fixture
+def bundles(tmpdir):
+    old = os.urandom(BLOCK_SIZE * 20 + 123)
+    new = bytearray(old)
+    # change two blocks
+    new[BLOCK_SIZE * 3 + 10] ^= 0xff
+    new[BLOCK_SIZE * 10:BLOCK_SIZE * 11] = os.urandom(BLOCK_SIZE)
+    new = bytes(new) + os.urandom(500)
+    return (write_bundle(tmpdir.join('old.raucb'), old),
+            write_bundle(tmpdir.join('new.raucb'), new))
+
+
+def create_app_for(path):
+    async def artifact(request):
+        return web.FileResponse(path)
+
+    def create_app(loop):
+        app = web.Application()
+        app.router.add_route('GET', '/bundle.raucb', artifact)
+        return app
+    return create_app
+
+
+def test_plan(bundles):
+    old, new = bundles
+    index = delta.BlockIndex.build(new, BLOCK_SIZE)
+    delta_plan = delta.plan(index, [old, '/nonexistent'])
+
+    assert len(delta_plan.copies) == 18
+    assert delta_plan.missing == [
+        (BLOCK_SIZE * 3, BLOCK_SIZE * 4 - 1),
+        (BLOCK_SIZE * 10, BLOCK_SIZE * 11 - 1),
+        (BLOCK_SIZE * 20, index.size - 1)]
+
+
+def test_invalid_index():
+    with pytest.raises(delta.DeltaError):
+        delta.BlockIndex.from_json('{"block_size": 4096}')
+    with pytest.raises(delta.DeltaError):
+        delta.BlockIndex(4096, 10000, ['00'])
+
+
+async def test_delta_download(test_client, bundles, tmpdir):
+    old, new = bundles
+    client = await test_client(create_app_for(new))
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, '/DEFAULT', 'test-target')
+    dl_location = str(tmpdir.join('bundle.raucb'))
+
+    index = delta.BlockIndex.from_json(
+        delta.BlockIndex.build(new, BLOCK_SIZE).to_json())
+    delta_plan = delta.plan(index, [old])
+    delta.assemble(delta_plan, dl_location)
+    received = await ddi.get_binary_ranges(ddi.build_api_url('/bundle.raucb'),
+                                           dl_location, delta_plan.missing)
+
+    assert received == delta_plan.missing_bytes
+    with open(new, 'rb') as fd:
+        assert await delta.throttled_file_md5(dl_location) == \
+            hashlib.md5(fd.read()).hexdigest()
+
+
+async def test_range_not_satisfiable(test_client, bundles, tmpdir):
+    old, new = bundles
+    client = await test_client(create_app_for(new))
+    ddi = DDIClient(client.session, '{}:{}'.format(client.host, client.port), False, None, '/DEFAULT', 'test-target')
+    dl_location = write_bundle(tmpdir.join('bundle.raucb'), b'')
+
+    with pytest.raises(APIError):
+        await ddi.get_binary_ranges(ddi.build_api_url('/bundle.raucb'),
+                                    dl_location, [(10 ** 9, 10 ** 9 + 1)])
+
+
+async def test_block_verifier(bundles):
+    old, new = bundles
+    verifier = delta.BlockVerifier(delta.BlockIndex.build(new, BLOCK_SIZE))
+
+    # fed in chunks not aligned to blocks
+    verifier.reset()
+    with open(old, 'rb') as fd:
+        while True:
+            chunk = fd.read(1000)
+            if not chunk:
+                break
+            verifier.update(chunk)
+    verifier.finish()
+    assert verifier.bad_blocks == {3, 10, 20}
+    assert verifier.repairable
+
+    with open(new, 'rb') as fd:
+        md5sum = hashlib.md5(fd.read()).hexdigest()
+    assert await delta.throttled_file_md5(new, verifier=verifier) == md5sum
+    assert verifier.bad_blocks == set()
+    assert not verifier.repairable
+
+
+async def test_throttled_file_md5(bundles):
+    old, new = bundles
+    verifier = delta.BlockVerifier(delta.BlockIndex.build(new, BLOCK_SIZE))
+    sizes = []
+
+    async def checkpoint(size):
+        sizes.append(size)
+
+    md5sum = await delta.throttled_file_md5(old, checkpoint, verifier,
+                                            chunk_size=BLOCK_SIZE * 4)
+
+    with open(old, 'rb') as fd:
+        assert md5sum == hashlib.md5(fd.read()).hexdigest()
+    # paced after each chunk
+    assert len(sizes) > 1
+    assert sum(sizes) == os.path.getsize(old)
+    assert verifier.bad_blocks == {3, 10, 20}
+
+
+async def test_refetch_corrupt_blocks(test_client, bundles, tmpdir):
+    from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+    old, new = bundles
+    with open(new, 'rb') as fd:
+        data = fd.read()
+    corrupt = bytearray(data)
+    corrupt[BLOCK_SIZE * 5 + 7] ^= 0x01
+    requests = []
+
+    async def artifact(request):
+        requests.append(request.headers.get('Range'))
+        if 'Range' not in request.headers:
+            # flipped bit on the way
+            return web.Response(body=bytes(corrupt))
+        return web.FileResponse(new)
+
+    async def block_index(request):
+        return web.Response(
+            body=delta.BlockIndex.build(new, BLOCK_SIZE).to_json())
+
+    def create_app(loop):
+        app = web.Application()
+        app.router.add_route('GET', '/bundle.raucb', artifact)
+        app.router.add_route('GET', '/bundle.raucb.blockidx', block_index)
+        return app
+
+    client = await test_client(create_app)
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True, verify_blocks=True)
+    url = 'http://{}:{}/bundle.raucb'.format(client.host, client.port)
+
+    await rauc_client.download_artifact(
+        '1', url, hashlib.md5(data).hexdigest(),
+        index_url='{}.blockidx'.format(url))
+
+    # one full download, then only the corrupt block
+    assert requests == [None, 'bytes={}-{}'.format(BLOCK_SIZE * 5,
+                                                   BLOCK_SIZE * 6 - 1)]
+    assert tmpdir.join('bundle.raucb').read_binary() == data
+    rauc_client.cleanup_dbus()
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import shutil
+import pytest
+from aiohttp import web
+
+pytest.importorskip('gi')
+if not shutil.which('dbus-daemon'):
+    pytest.skip('dbus-daemon not available', allow_module_level=True)
+
+from rauc_hawkbit.fake_rauc import FakeRaucInstaller, PrivateBus
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+TARGET = '/DEFAULT/controller/v1/test-target'
+ARTIFACT = b'bundle' * 1024
+
+
+@pytest.fixture
+def bus():
+    bus = PrivateBus()
+    bus.start()
+    yield bus
+    bus.stop()
+
+
+def create_app(loop):
+    async def base(request):
+        links = {}
+        if not request.app['done']:
+            links['deploymentBase'] = {
+                'href': 'http://{}{}/deploymentBase/1?c=1'.format(
+                    request.host, TARGET)}
+        return web.json_response({
+            'config': {'polling': {'sleep': '00:00:01'}},
+            '_links': links,
+        })
+
+    async def deployment(request):
+        return web.json_response({'deployment': {'chunks': [{'artifacts': [{
+            'filename': 'bundle.raucb',
+            'hashes': {'md5': hashlib.md5(ARTIFACT).hexdigest(),
+                       'sha256': hashlib.sha256(ARTIFACT).hexdigest()},
+            '_links': {'download-http': {
+                'href': 'http://{}/artifact'.format(request.host)}},
+        }]}]}})
+
+    async def artifact(request):
+        return web.Response(body=ARTIFACT)
+
+    async def feedback(request):
+        data = await request.json()
+        request.app['feedback'].append(data)
+        if data['status']['execution'] == 'closed':
+            request.app['done'] = True
+        return web.Response()
+
+    app = web.Application()
+    app['done'] = False
+    app['feedback'] = []
+    app.router.add_route('GET', TARGET, base)
+    app.router.add_route('GET', TARGET + '/deploymentBase/1', deployment)
+    app.router.add_route('POST', TARGET + '/deploymentBase/1/feedback',
+                         feedback)
+    app.router.add_route('GET', '/artifact', artifact)
+    return app
+
+
+async def test_install(test_client, tmpdir, bus):
+    client = await test_client(create_app)
+    rauc = FakeRaucInstaller(bus.address, progress_events=10,
+                             last_error='Installation error')
+    rauc.start()
+
+    results = []
+    completed = asyncio.Event()
+
+    def result_callback(result):
+        results.append(result)
+        completed.set()
+
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), result_callback, lazy_dbus=True,
+        bus_address=bus.address)
+    polling = asyncio.ensure_future(rauc_client.start_polling())
+    try:
+        await asyncio.wait_for(completed.wait(), 10)
+    finally:
+        polling.cancel()
+        await asyncio.wait([polling])
+        rauc_client.cleanup_dbus()
+        rauc.stop()
+
+    assert rauc.installs == [str(tmpdir.join('bundle.raucb'))]
+    assert results == [1]
+    feedback = client.server.app['feedback']
+    progress = [f['status']['result']['progress']['percentage']
+                for f in feedback if f['status']['details'] == ['Installing']]
+    assert progress == list(range(10, 101, 10))
+    assert any(f['status']['details'] == ['Installation error']
+               for f in feedback)
+    assert feedback[-1]['status']['result']['finished'] == 'failure'
+
+
+async def test_skip_installed(test_client, tmpdir, bus):
+    client = await test_client(create_app)
+    rauc = FakeRaucInstaller(bus.address, slots={
+        'rootfs.0': {'state': 'inactive'},
+        'rootfs.1': {'state': 'booted',
+                     'bundle.hash': hashlib.sha256(ARTIFACT).hexdigest()},
+    }, primary='rootfs.1')
+    rauc.start()
+
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True, bus_address=bus.address)
+    try:
+        await rauc_client.process_deployment(await rauc_client.ddi())
+    finally:
+        rauc_client.cleanup_dbus()
+        rauc.stop()
+
+    assert rauc.installs == []
+    feedback, = client.server.app['feedback']
+    assert feedback['status']['result']['finished'] == 'success'
+    assert feedback['status']['details'] == [
+        'Bundle already installed in slot rootfs.1']
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+from rauc_hawkbit.ddi.scheduler import RequestScheduler
+from rauc_hawkbit.governor import GovernorState, ResourceGovernor
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Proc(object):
+    """Fake /proc with pressure and meminfo files."""
+    def __init__(self, tmpdir):
+        self.root = tmpdir.mkdir('proc')
+        self.root.mkdir('pressure')
+        self.set(cpu=0, io=0, memory=50)
+
+    def set(self, cpu, io, memory):
+        for resource, value in (('cpu', cpu), ('io', io)):
+            self.root.join('pressure', resource).write(
+                'some avg10={:.2f} avg60=0.00 avg300=0.00 total=0\n'
+                'full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n'.format(value))
+        self.root.join('meminfo').write(
+            'MemTotal:        1000 kB\nMemFree:          10 kB\n'
+            'MemAvailable:     {} kB\n'.format(memory * 10))
+
+
+async def test_states(tmpdir):
+    proc = Proc(tmpdir)
+    clock = Clock()
+    governor = ResourceGovernor(proc_root=str(proc.root), clock=clock)
+
+    await governor.update()
+    assert governor.state is GovernorState.normal
+    assert governor.rate is None
+
+    # throttling halves the rate with each sample
+    proc.set(cpu=60, io=0, memory=50)
+    clock.now += 1
+    await governor.update()
+    assert governor.state is GovernorState.throttled
+    first_rate = governor.rate
+    clock.now += 1
+    await governor.update()
+    assert governor.rate == first_rate / 2
+    assert governor.chunk_size == governor.throttled_chunk_size
+
+    proc.set(cpu=0, io=0, memory=3)
+    clock.now += 1
+    await governor.update()
+    assert governor.state is GovernorState.paused
+    assert governor.decisions[-1].reason == 'available memory 3.0% <= 5.0%'
+
+    # rate increases additively again
+    proc.set(cpu=0, io=0, memory=50)
+    clock.now += 1
+    await governor.update()
+    assert governor.state is GovernorState.normal
+    assert governor.rate == first_rate / 2 + governor.rate_step
+    assert governor.statistics()['pauses'] == 1
+
+
+async def test_pause(tmpdir):
+    proc = Proc(tmpdir)
+    proc.set(cpu=0, io=90, memory=50)
+    governor = ResourceGovernor(proc_root=str(proc.root), interval=0.05)
+    scheduler = RequestScheduler(governor=governor)
+
+    checkpoint = asyncio.ensure_future(scheduler.bulk_checkpoint(1024))
+    await asyncio.sleep(0.2)
+    assert not checkpoint.done()
+
+    proc.set(cpu=0, io=0, memory=50)
+    await asyncio.wait_for(checkpoint, 1)
+    assert scheduler.statistics()['governor']['state'] == 'normal'
+
+
+async def test_max_pause(tmpdir):
+    proc = Proc(tmpdir)
+    proc.set(cpu=0, io=90, memory=50)
+    governor = ResourceGovernor(proc_root=str(proc.root), interval=0.05,
+                                max_pause=0.2)
+
+    await asyncio.wait_for(governor.throttle(1024), 1)
+    assert governor.state is GovernorState.paused
+    assert governor.paused_time >= 0.2
+
+
+async def test_sample_in_executor(tmpdir):
+    proc = Proc(tmpdir)
+    governor = ResourceGovernor(proc_root=str(proc.root))
+    threads = []
+    read_sample = governor.read_sample
+
+    def recording_read_sample():
+        threads.append(threading.get_ident())
+        return read_sample()
+
+    governor.read_sample = recording_read_sample
+    await governor.update()
+    # sampled once per interval
+    await governor.update()
+    assert len(threads) == 1
+    assert threads[0] != threading.get_ident()
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import os
+from aiohttp import web
+
+from rauc_hawkbit.journal import DeploymentJournal, DeploymentPhase
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+
+def test_journal_persistence(tmpdir):
+    path = str(tmpdir.join('journal.json'))
+    journal = DeploymentJournal(path)
+    assert journal.phase is None
+
+    journal.record('3', DeploymentPhase.downloading, md5='abc')
+    journal.record('3', DeploymentPhase.installing)
+
+    journal = DeploymentJournal(path)
+    assert journal.action_id == '3'
+    assert journal.phase is DeploymentPhase.installing
+    assert journal.state['md5'] == 'abc'
+
+    # new action replaces old state
+    journal.record('4', DeploymentPhase.downloading)
+    assert 'md5' not in DeploymentJournal(path).state
+
+    journal.clear()
+    assert DeploymentJournal(path).phase is None
+
+
+def test_journal_invalid(tmpdir):
+    path = tmpdir.join('journal.json')
+    path.write('{"action_id": "3", "phase": "unknown"}')
+
+    assert DeploymentJournal(str(path)).phase is None
+
+
+ARTIFACT = os.urandom(256 * 1024)
+
+
+def create_app(loop):
+    async def base(request):
+        return web.json_response({
+            'config': {'polling': {'sleep': '12:00:00'}},
+            '_links': {},
+        })
+
+    async def feedback(request):
+        request.app['feedback'].append(await request.json())
+        return web.Response()
+
+    async def artifact(request):
+        request.app['ranges'].append(request.headers.get('Range'))
+        http_range = request.http_range
+        if http_range.start is None:
+            return web.Response(body=ARTIFACT)
+        return web.Response(status=206, body=ARTIFACT[http_range])
+
+    app = web.Application()
+    app['feedback'] = []
+    app['ranges'] = []
+    app.router.add_route('GET', '/bundle.raucb', artifact)
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target', base)
+    app.router.add_route(
+        'POST', '/DEFAULT/controller/v1/test-target/deploymentBase/3/feedback',
+        feedback)
+    return app
+
+
+async def test_report_result_after_reboot(test_client, tmpdir):
+    client = await test_client(create_app)
+    path = str(tmpdir.join('journal.json'))
+    DeploymentJournal(path).record('3', DeploymentPhase.awaiting_reboot,
+                                   result=0, status_msg='done')
+
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True, journal_location=path)
+
+    try:
+        await asyncio.wait_for(rauc_client.poll_base_resource(), 0.5)
+    except asyncio.TimeoutError:
+        pass
+
+    feedback, = client.server.app['feedback']
+    assert feedback['status']['execution'] == 'closed'
+    assert feedback['status']['result']['finished'] == 'success'
+    assert DeploymentJournal(path).phase is None
+    rauc_client.cleanup_dbus()
+
+
+async def test_resume_at_recorded_offset(test_client, tmpdir):
+    client = await test_client(create_app)
+    path = str(tmpdir.join('journal.json'))
+    bundle = tmpdir.join('bundle.raucb')
+    # data beyond the recorded offset was not synced before a power cut
+    bundle.write_binary(ARTIFACT[:1000] + b'\0' * 3000)
+    md5sum = hashlib.md5(ARTIFACT).hexdigest()
+    DeploymentJournal(path).record('3', DeploymentPhase.downloading,
+                                   md5=md5sum, offset=1000)
+
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(bundle), lambda result: None,
+        lazy_dbus=True, journal_location=path)
+    rauc_client.journal_offset_interval = 0
+
+    url = 'http://{}:{}/bundle.raucb'.format(client.host, client.port)
+    await rauc_client.download_artifact('3', url, md5sum, resume=True,
+                                        size=len(ARTIFACT))
+
+    assert client.server.app['ranges'] == ['bytes=1000-']
+    assert bundle.read_binary() == ARTIFACT
+    # progress is recorded while downloading
+    assert DeploymentJournal(path).state['offset'] == len(ARTIFACT)
+
+    # complete bundle is not downloaded again
+    await rauc_client.download_artifact('3', url, md5sum, resume=True,
+                                        size=len(ARTIFACT))
+    assert client.server.app['ranges'] == ['bytes=1000-']
+    rauc_client.cleanup_dbus()
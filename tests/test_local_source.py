@@ -0,0 +1,98 @@
+import errno
+import hashlib
+import os
+
+from aiohttp import web
+
+from rauc_hawkbit import local_source
+from rauc_hawkbit.local_source import LocalSource, copy_file
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+ARTIFACT = os.urandom(3 * 1024 * 1024 + 17)
+MD5 = hashlib.md5(ARTIFACT).hexdigest()
+
+
+def test_copy_file(tmpdir):
+    src = tmpdir.join('src')
+    src.write_binary(ARTIFACT)
+    dst = tmpdir.join('dst')
+    dst.write_binary(b'previous content' * 1024 * 1024)
+
+    method = copy_file(str(src), str(dst))
+
+    assert method in ('reflink', 'copy_file_range', 'sendfile')
+    assert dst.read_binary() == ARTIFACT
+
+
+def test_copy_file_short_copy(tmpdir, monkeypatch):
+    def unsupported(src_fd, dst_fd, size):
+        raise OSError(errno.EOPNOTSUPP, 'not supported')
+
+    def short_copy(src_fd, dst_fd, size):
+        # stops half way without an error, moving both file positions
+        return os.write(dst_fd, os.read(src_fd, size // 2))
+
+    monkeypatch.setattr(local_source, 'reflink', unsupported)
+    monkeypatch.setattr(local_source, 'copy_range', short_copy)
+    src = tmpdir.join('src')
+    src.write_binary(ARTIFACT)
+    dst = tmpdir.join('dst')
+
+    method = copy_file(str(src), str(dst))
+
+    assert method in ('sendfile', 'read/write')
+    assert dst.read_binary() == ARTIFACT
+
+
+async def test_fetch(tmpdir):
+    usb = tmpdir.mkdir('usb')
+    mirror = tmpdir.mkdir('mirror')
+    dl_location = str(tmpdir.join('bundle.raucb'))
+    source = LocalSource([str(usb), str(mirror)])
+
+    assert not await source.fetch(MD5, dl_location, 'bundle.raucb')
+
+    # a different bundle with the same name is not used
+    usb.join('bundle.raucb').write_binary(b'old bundle')
+    assert not await source.fetch(MD5, dl_location, 'bundle.raucb')
+    assert not os.path.exists(dl_location)
+
+    mirror.join(MD5).write_binary(ARTIFACT)
+    assert await source.fetch(MD5, dl_location, 'bundle.raucb',
+                              len(ARTIFACT))
+    assert tmpdir.join('bundle.raucb').read_binary() == ARTIFACT
+
+
+def create_app(loop):
+    async def artifact(request):
+        request.app['downloads'].append(request.path)
+        return web.Response(body=ARTIFACT)
+
+    app = web.Application()
+    app['downloads'] = []
+    app.router.add_route('GET', '/artifact', artifact)
+    return app
+
+
+async def test_download_fallback(test_client, tmpdir):
+    client = await test_client(create_app)
+    usb = tmpdir.mkdir('usb')
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True, local_sources=[str(usb)])
+    url = 'http://{}:{}/artifact'.format(client.host, client.port)
+
+    # not available locally, downloaded via HTTP
+    await rauc_client.download_artifact('1', url, MD5,
+                                        filename='bundle.raucb')
+    assert client.server.app['downloads'] == ['/artifact']
+
+    usb.join('bundle.raucb').write_binary(ARTIFACT)
+    os.remove(str(tmpdir.join('bundle.raucb')))
+    await rauc_client.download_artifact('2', url, MD5,
+                                        filename='bundle.raucb')
+    assert client.server.app['downloads'] == ['/artifact']
+    assert tmpdir.join('bundle.raucb').read_binary() == ARTIFACT
+    rauc_client.cleanup_dbus()
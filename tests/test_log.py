@@ -0,0 +1,97 @@
+import logging
+import logging.handlers
+import queue
+import threading
+
+from rauc_hawkbit.log import (
+    DroppingQueueHandler, RateLimitFilter, parse_rate_limits)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(name, msg):
+    return logging.makeLogRecord({'name': name, 'msg': msg,
+                                  'levelno': logging.INFO})
+
+
+def test_queue_handler_drops():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for i in range(5):
+        handler.handle(record('rauc_hawkbit', 'message {}'.format(i)))
+    assert handler.dropped == 3
+
+    # drops are reported once there is room again
+    handler.queue.get_nowait()
+    handler.queue.get_nowait()
+    handler.handle(record('rauc_hawkbit', 'message 5'))
+    dropped = handler.queue.get_nowait()
+    assert dropped.getMessage() == '3 log records dropped'
+    assert dropped.levelno == logging.WARNING
+    assert handler.queue.get_nowait().getMessage() == 'message 5'
+
+
+class Payload(object):
+    """Message argument recording the threads formatting it."""
+    def __init__(self):
+        self.threads = []
+
+    def __str__(self):
+        self.threads.append(threading.get_ident())
+        return 'payload'
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def test_queue_handler_formats_in_listener():
+    handler = DroppingQueueHandler(queue.Queue(10))
+    target = ListHandler()
+    listener = logging.handlers.QueueListener(handler.queue, target)
+    listener.start()
+    payload = Payload()
+    try:
+        handler.handle(logging.makeLogRecord({
+            'name': 'rauc_hawkbit', 'levelno': logging.DEBUG,
+            'msg': 'GET %s', 'args': (payload,)}))
+    finally:
+        listener.stop()
+
+    assert target.messages == ['GET payload']
+    assert payload.threads and threading.get_ident() not in payload.threads
+
+
+def test_rate_limit():
+    clock = Clock()
+    limit = RateLimitFilter({'rauc_hawkbit.progress': (1, 2)}, clock=clock)
+
+    passed = [limit.filter(record('rauc_hawkbit.progress', 'progress'))
+              for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # other subsystems are not limited
+    assert limit.filter(record('rauc_hawkbit', 'other'))
+
+    clock.now += 1
+    next_record = record('rauc_hawkbit.progress', 'progress')
+    assert limit.filter(next_record)
+    assert next_record.getMessage() == \
+        'progress (3 similar messages suppressed)'
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits('rauc_hawkbit.progress:0.5 rauc_hawkbit:10/20') == {
+        'rauc_hawkbit.progress': (0.5, 1),
+        'rauc_hawkbit': (10.0, 20),
+    }
+    assert parse_rate_limits('') == {}
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import os
+import aiohttp
+from aiohttp import web
+
+from rauc_hawkbit.ddi.client import DDIClient
+from rauc_hawkbit.mirrors import Source, SourceSelector
+
+ARTIFACT = os.urandom(1024 * 1024)
+MD5 = hashlib.md5(ARTIFACT).hexdigest()
+
+
+def requested_range(request):
+    if 'Range' not in request.headers:
+        return 0, len(ARTIFACT) - 1
+    start, _, end = request.headers['Range'].split('=')[1].partition('-')
+    return int(start), int(end) if end else len(ARTIFACT) - 1
+
+
+def url(server, host, path):
+    return 'http://{}:{}{}'.format(host, server.port, path)
+
+
+def create_app():
+    async def fast(request):
+        request.app['authorization'][request.path] = \
+            request.headers.get('Authorization')
+        start, end = requested_range(request)
+        return web.Response(status=206, body=ARTIFACT[start:end + 1])
+
+    async def slow(request):
+        await asyncio.sleep(0.3)
+        return await fast(request)
+
+    async def stalling(request):
+        # fast for probes, stalls half way through full downloads
+        start, end = requested_range(request)
+        resp = web.StreamResponse(status=206)
+        resp.content_length = end + 1 - start
+        await resp.prepare(request)
+        half = min(end + 1, len(ARTIFACT) // 2)
+        await resp.write(ARTIFACT[start:half])
+        if half < end + 1:
+            await asyncio.sleep(10)
+        return resp
+
+    async def trickling(request):
+        # fast for probes, trickles after half of full downloads
+        start, end = requested_range(request)
+        resp = web.StreamResponse(status=206)
+        resp.content_length = end + 1 - start
+        await resp.prepare(request)
+        half = min(end + 1, len(ARTIFACT) // 2)
+        await resp.write(ARTIFACT[start:half])
+        for position in range(half, end + 1, 64):
+            await asyncio.sleep(0.05)
+            await resp.write(ARTIFACT[position:min(position + 64, end + 1)])
+        return resp
+
+    async def failing(request):
+        # fast for probes, full downloads fail
+        start, end = requested_range(request)
+        if end == len(ARTIFACT) - 1:
+            return web.Response(status=500)
+        return await fast(request)
+
+    app = web.Application()
+    app['authorization'] = {}
+    app.router.add_route('GET', '/fast', fast)
+    app.router.add_route('GET', '/slow', slow)
+    app.router.add_route('GET', '/stalling', stalling)
+    app.router.add_route('GET', '/trickling', trickling)
+    app.router.add_route('GET', '/failing', failing)
+    return app
+
+
+async def test_rank(test_server, tmpdir):
+    server = await test_server(create_app())
+    async with aiohttp.ClientSession() as session:
+        ddi = DDIClient(session, None, False, 'token', 'DEFAULT',
+                        'test-target')
+        selector = SourceSelector(ddi, str(tmpdir.join('stats.json')))
+        # statistics are kept per host
+        slow = Source(url(server, '127.0.0.1', '/slow'), True)
+        fast = Source(url(server, 'localhost', '/fast'), False)
+
+        assert await selector.rank([slow, fast]) == [fast, slow]
+        # mirrors do not get the target token
+        assert server.app['authorization'] == {
+            '/slow': 'TargetToken token', '/fast': None}
+
+    # statistics are remembered, no probes needed
+    selector = SourceSelector(ddi, str(tmpdir.join('stats.json')))
+    assert not selector.needs_probe(fast)
+    assert await selector.rank([slow, fast]) == [fast, slow]
+
+
+async def test_switch_on_stall(test_server, tmpdir):
+    server = await test_server(create_app())
+    async with aiohttp.ClientSession() as session:
+        ddi = DDIClient(session, None, False, 'token', 'DEFAULT',
+                        'test-target')
+        selector = SourceSelector(ddi, stall_timeout=1)
+        stalling = Source(url(server, '127.0.0.1', '/stalling'), False)
+        slow = Source(url(server, 'localhost', '/slow'), False)
+        dl_location = str(tmpdir.join('bundle.raucb'))
+
+        # stalling source looks best when probed
+        assert (await selector.rank([slow, stalling]))[0] == stalling
+
+        checksum = await selector.download([slow, stalling], dl_location)
+
+        assert checksum == MD5
+        assert selector.source_stats(stalling).failures == 1
+        # next download starts on the working source
+        assert (await selector.rank([slow, stalling]))[0] == slow
+
+
+async def test_switch_on_low_throughput(test_server, tmpdir):
+    server = await test_server(create_app())
+    async with aiohttp.ClientSession() as session:
+        ddi = DDIClient(session, None, False, 'token', 'DEFAULT',
+                        'test-target')
+        selector = SourceSelector(ddi, stall_timeout=0.5,
+                                  min_throughput=64*1024)
+        trickling = Source(url(server, '127.0.0.1', '/trickling'), False)
+        slow = Source(url(server, 'localhost', '/slow'), False)
+        dl_location = str(tmpdir.join('bundle.raucb'))
+
+        assert (await selector.rank([slow, trickling]))[0] == trickling
+
+        events = []
+        checksum = await selector.download([slow, trickling], dl_location,
+                                           progress_callback=events.append,
+                                           progress_interval=0.1)
+
+        assert checksum == MD5
+        assert selector.source_stats(trickling).failures == 1
+        # progress is still reported to the caller
+        assert events[-1].received == len(ARTIFACT)
+
+
+async def test_discards_stale_data(test_server, tmpdir):
+    server = await test_server(create_app())
+    async with aiohttp.ClientSession() as session:
+        ddi = DDIClient(session, None, False, 'token', 'DEFAULT',
+                        'test-target')
+        selector = SourceSelector(ddi)
+        failing = Source(url(server, '127.0.0.1', '/failing'), False)
+        fast = Source(url(server, 'localhost', '/fast'), False)
+        assert (await selector.rank([fast, failing]))[0] == failing
+
+        # e.g. left over from a delta download, must not be resumed
+        dl_location = tmpdir.join('bundle.raucb')
+        dl_location.write_binary(os.urandom(len(ARTIFACT) // 2))
+
+        checksum = await selector.download([fast, failing], str(dl_location),
+                                           size=len(ARTIFACT))
+
+        assert checksum == MD5
+        assert dl_location.read_binary() == ARTIFACT
@@ -0,0 +1,145 @@
+import asyncio
+import aiohttp
+from aiohttp import web
+
+from rauc_hawkbit.notify import NotificationChannel, NotificationMode
+
+
+def create_notify_app(loop):
+    app = web.Application()
+    app['events'] = asyncio.Queue()
+    app['requests'] = []
+
+    async def sse(request):
+        app['requests'].append(request.path)
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await resp.prepare(request)
+        await resp.write(b': keep-alive\n\n')
+        while True:
+            await app['events'].get()
+            await resp.write(b'event: deployment\ndata: {}\n\n')
+
+    async def longpoll(request):
+        app['requests'].append(request.path)
+        try:
+            await asyncio.wait_for(app['events'].get(), 0.2)
+        except asyncio.TimeoutError:
+            return web.Response(status=204)
+        return web.Response(status=200)
+
+    async def garbage(request):
+        app['requests'].append(request.path)
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await resp.prepare(request)
+        # invalid UTF-8 is no reason to drop the event
+        await resp.write(b'data: \xff\xfe\n\n')
+        if len(app['requests']) == 1:
+            # exceeds the read buffer, the stream is reconnected
+            await resp.write(b': ' + b'x' * 2**20 + b'\n')
+        await asyncio.sleep(10)
+        return resp
+
+    async def empty(request):
+        app['requests'].append(request.path)
+        return web.Response(status=204)
+
+    app.router.add_route('GET', '/sse', sse)
+    app.router.add_route('GET', '/longpoll', longpoll)
+    app.router.add_route('GET', '/empty', empty)
+    app.router.add_route('GET', '/garbage', garbage)
+    return app
+
+
+async def test_sse(test_client):
+    client = await test_client(create_notify_app)
+    channel = NotificationChannel(client.session,
+                                  str(client.make_url('/sse')))
+    channel.start()
+    try:
+        # keep-alive comments do not wake up
+        assert not await channel.wait(0.2)
+        assert channel.connected
+
+        client.server.app['events'].put_nowait(None)
+        assert await channel.wait(1)
+        assert channel.notifications == 1
+    finally:
+        await channel.stop()
+
+
+async def test_longpoll(test_client):
+    client = await test_client(create_notify_app)
+    channel = NotificationChannel(client.session,
+                                  str(client.make_url('/longpoll')),
+                                  mode=NotificationMode.longpoll,
+                                  longpoll_interval=0.1)
+    channel.start()
+    try:
+        assert not await channel.wait(0.5)
+        assert channel.connected
+
+        client.server.app['events'].put_nowait(None)
+        assert await channel.wait(1)
+    finally:
+        await channel.stop()
+
+
+async def test_sse_stalled(test_client):
+    client = await test_client(create_notify_app)
+    channel = NotificationChannel(client.session,
+                                  str(client.make_url('/sse')),
+                                  reconnect_delay=0.1, keepalive_timeout=0.2)
+    channel.start()
+    try:
+        # only one keep-alive is sent, the silent stream is reconnected
+        assert not await channel.wait(0.6)
+        assert len(client.server.app['requests']) >= 2
+    finally:
+        await channel.stop()
+
+
+async def test_longpoll_interval(test_client):
+    client = await test_client(create_notify_app)
+    channel = NotificationChannel(client.session,
+                                  str(client.make_url('/empty')),
+                                  mode=NotificationMode.longpoll,
+                                  longpoll_interval=0.1)
+    channel.start()
+    try:
+        # server answers immediately, requests are still spaced
+        assert not await channel.wait(0.5)
+        assert 3 <= len(client.server.app['requests']) <= 6
+    finally:
+        await channel.stop()
+
+
+async def test_channel_down():
+    async with aiohttp.ClientSession() as session:
+        # nothing listens on port 1
+        channel = NotificationChannel(session, 'http://127.0.0.1:1/sse',
+                                      reconnect_delay=0.1)
+        channel.start()
+        try:
+            # waiting falls back to the scheduled timeout
+            assert not await channel.wait(0.3)
+            assert not channel.connected
+        finally:
+            await channel.stop()
+
+
+async def test_sse_invalid_data(test_client):
+    client = await test_client(create_notify_app)
+    channel = NotificationChannel(client.session,
+                                  str(client.make_url('/garbage')),
+                                  reconnect_delay=0.1)
+    channel.start()
+    try:
+        for _ in range(20):
+            if channel.notifications >= 2:
+                break
+            await asyncio.sleep(0.1)
+        assert channel.notifications == 2
+        assert client.server.app['requests'] == ['/garbage', '/garbage']
+        assert not channel.task.done()
+    finally:
+        await channel.stop()
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import socket
+import aiohttp
+import pytest
+from aiohttp import web
+
+from rauc_hawkbit.ddi.client import DDIClient
+from rauc_hawkbit.ddi.scheduler import RequestClass
+from rauc_hawkbit.peer import PeerSharing
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+
+@pytest.fixture
+def artifact(tmpdir):
+    data = os.urandom(256 * 1024)
+    path = str(tmpdir.join('shared.raucb'))
+    with open(path, 'wb') as fd:
+        fd.write(data)
+    return path, hashlib.md5(data).hexdigest()
+
+
+def create_ddi(session):
+    return DDIClient(session, None, False, 'token', 'DEFAULT', 'test-target')
+
+
+async def start_peers(count):
+    peers = []
+    for _ in range(count):
+        peer = PeerSharing(listen_host='127.0.0.1', listen_port=0,
+                           peers=['127.0.0.1:{}'.format(p.listen_port)
+                                  for p in peers])
+        await peer.start()
+        peers.append(peer)
+    return peers
+
+
+async def test_fetch_from_peer(artifact, tmpdir):
+    path, md5sum = artifact
+    async with aiohttp.ClientSession() as session:
+        ddi = create_ddi(session)
+        seeder, leecher, other = await start_peers(3)
+        try:
+            seeder.advertise(md5sum, path)
+
+            # first device fetches from seeder, then shares the artifact
+            dl_location = str(tmpdir.join('leecher.raucb'))
+            assert await leecher.fetch(md5sum, dl_location, ddi)
+            leecher.advertise(md5sum, dl_location)
+
+            seeder.withdraw(md5sum)
+            dl_location = str(tmpdir.join('other.raucb'))
+            assert await other.fetch(md5sum, dl_location, ddi)
+            with open(dl_location, 'rb') as fd:
+                assert hashlib.md5(fd.read()).hexdigest() == md5sum
+        finally:
+            for peer in (seeder, leecher, other):
+                await peer.stop()
+        # scheduled like hawkBit downloads, including the request answered
+        # with 404 by the seeder after withdrawing the artifact
+        assert ddi.scheduler.stats[RequestClass.bulk].requests == 3
+
+
+async def test_fetch_verifies_hash(artifact, tmpdir):
+    path, md5sum = artifact
+    wrong_md5sum = 'f' * 32
+    async with aiohttp.ClientSession() as session:
+        ddi = create_ddi(session)
+        seeder, leecher = await start_peers(2)
+        try:
+            # peer advertises an artifact it does not actually have
+            seeder.advertise(wrong_md5sum, path)
+            dl_location = str(tmpdir.join('leecher.raucb'))
+            assert not await leecher.fetch(wrong_md5sum, dl_location, ddi)
+            assert not await leecher.fetch(md5sum, dl_location, ddi)
+        finally:
+            await seeder.stop()
+            await leecher.stop()
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def test_multicast_discovery(artifact, tmpdir):
+    path, md5sum = artifact
+    multicast = dict(multicast_group='239.255.42.99',
+                     multicast_port=free_udp_port(),
+                     multicast_interface='127.0.0.1')
+    async with aiohttp.ClientSession() as session:
+        seeder = PeerSharing(listen_host='127.0.0.1', listen_port=0,
+                             **multicast)
+        leecher = PeerSharing(listen_host='127.0.0.1',
+                              listen_port=0, discovery_timeout=0.2,
+                              **multicast)
+        await seeder.start()
+        await leecher.start()
+        try:
+            assert await leecher.discover(md5sum) == []
+
+            seeder.advertise(md5sum, path)
+            assert await leecher.discover(md5sum) == [
+                'http://127.0.0.1:{}'.format(seeder.listen_port)]
+
+            dl_location = str(tmpdir.join('leecher.raucb'))
+            assert await leecher.fetch(md5sum, dl_location,
+                                       create_ddi(session))
+        finally:
+            await seeder.stop()
+            await leecher.stop()
+
+
+ARTIFACTS = {'/first': os.urandom(64 * 1024), '/second': os.urandom(64 * 1024)}
+
+
+def create_app(loop):
+    async def artifact(request):
+        return web.Response(body=ARTIFACTS[request.path])
+
+    app = web.Application()
+    for path in ARTIFACTS:
+        app.router.add_route('GET', path, artifact)
+    return app
+
+
+async def test_withdraw_replaced_bundle(test_client, tmpdir):
+    client = await test_client(create_app)
+    peer = PeerSharing(peers=[])
+    dl_location = str(tmpdir.join('bundle.raucb'))
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        dl_location, lambda result: None, lazy_dbus=True, peer_sharing=peer)
+
+    md5sums = {}
+    for path, data in sorted(ARTIFACTS.items()):
+        md5sums[path] = hashlib.md5(data).hexdigest()
+        url = 'http://{}:{}{}'.format(client.host, client.port, path)
+        await rauc_client.download_artifact('1', url, md5sums[path])
+
+    # the first bundle was overwritten and is no longer offered
+    assert peer.artifacts == {md5sums['/second']: dl_location}
+    rauc_client.cleanup_dbus()
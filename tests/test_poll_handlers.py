@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import os
+from aiohttp import web
+
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+from rauc_hawkbit.soak import SimulatedInstallClient
+
+TARGET = '/DEFAULT/controller/v1/test-target'
+
+
+def create_app(loop):
+    async def base(request):
+        if request.app['fail']:
+            raise web.HTTPInternalServerError()
+        if request.app['cancel']:
+            links = {'cancelAction': {
+                'href': 'http://{}{}/cancelAction/5'.format(request.host,
+                                                            TARGET)}}
+        else:
+            links = {
+                'configData': {'href': 'configData'},
+                'deploymentBase': {
+                    'href': 'http://{}{}/deploymentBase/4?c=1'.format(
+                        request.host, TARGET)},
+            }
+        return web.json_response({
+            'config': {'polling': {'sleep': '00:00:01'}},
+            '_links': links,
+        })
+
+    async def config_data(request):
+        await asyncio.sleep(1)
+        request.app['identified'] = True
+        return web.Response()
+
+    async def deployment(request):
+        return web.json_response({'deployment': {'chunks': [{'artifacts': [{
+            'filename': 'bundle.raucb',
+            'hashes': {'md5': '0' * 32},
+            '_links': {'download-http': {
+                'href': 'http://{}/artifact'.format(request.host)}},
+        }]}]}})
+
+    async def artifact(request):
+        request.app['downloading'] = True
+        request.app['cancel'] = request.app['cancel_download']
+        resp = web.StreamResponse()
+        resp.content_length = 64 * 1024 * 100
+        await resp.prepare(request)
+        for _ in range(100):
+            await resp.write(b'\0' * 64 * 1024)
+            await asyncio.sleep(0.1)
+        return resp
+
+    async def cancel_action(request):
+        return web.json_response({'id': '5', 'cancelAction': {'stopId': '4'}})
+
+    async def feedback(request):
+        request.app['feedback'].append(
+            (request.match_info['resource'], await request.json()))
+        return web.Response()
+
+    app = web.Application()
+    app['fail'] = False
+    app['cancel'] = False
+    app['cancel_download'] = False
+    app['identified'] = False
+    app['downloading'] = False
+    app['feedback'] = []
+    app.router.add_route('GET', TARGET, base)
+    app.router.add_route('PUT', TARGET + '/configData', config_data)
+    app.router.add_route('GET', TARGET + '/deploymentBase/4', deployment)
+    app.router.add_route('GET', '/artifact', artifact)
+    app.router.add_route('GET', TARGET + '/cancelAction/5', cancel_action)
+    app.router.add_route('POST', TARGET + '/{resource}/{action}/feedback',
+                         feedback)
+    return app
+
+
+def create_client(client, tmpdir):
+    return RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True)
+
+
+async def test_download_not_delayed_by_identify(test_client, tmpdir):
+    client = await test_client(create_app)
+    rauc_client = create_client(client, tmpdir)
+
+    try:
+        await asyncio.wait_for(rauc_client.poll_base_resource(), 0.5)
+    except asyncio.TimeoutError:
+        pass
+
+    assert client.server.app['downloading']
+    assert not client.server.app['identified']
+    # deployment is cancelled together with polling
+    assert rauc_client.deployment_task is None or \
+        rauc_client.deployment_task.done()
+    rauc_client.cleanup_dbus()
+
+
+async def test_cancel_preempts_download(test_client, tmpdir):
+    client = await test_client(create_app)
+    client.server.app['cancel_download'] = True
+    rauc_client = create_client(client, tmpdir)
+
+    try:
+        await asyncio.wait_for(rauc_client.poll_base_resource(), 2.5)
+    except asyncio.TimeoutError:
+        pass
+
+    cancel_feedback = [data for resource, data in client.server.app['feedback']
+                       if resource == 'cancelAction']
+    feedback, = cancel_feedback
+    assert feedback['status']['execution'] == 'closed'
+    assert rauc_client.deployment_task is None
+    assert not os.path.exists(str(tmpdir.join('bundle.raucb')))
+    rauc_client.cleanup_dbus()
+
+
+async def test_no_deployment_task_while_installing(test_client, tmpdir):
+    client = await test_client(create_app)
+    rauc_client = create_client(client, tmpdir)
+    rauc_client.action_id = '4'
+
+    base = await rauc_client.ddi()
+    rauc_client.start_deployment(base)
+
+    # poll loop sleeps instead of waiting for a task returning immediately
+    assert rauc_client.deployment_task is None
+    rauc_client.cleanup_dbus()
+
+
+async def test_installation_survives_poll_errors(test_client, tmpdir):
+    client = await test_client(create_app)
+    client.server.app['fail'] = True
+    rauc_client = create_client(client, tmpdir)
+    rauc_client.action_id = '4'
+
+    try:
+        await asyncio.wait_for(rauc_client.start_polling(wait_on_error=0.1),
+                               0.5)
+    except asyncio.TimeoutError:
+        pass
+
+    # RAUC's Completed signal is still attributed to the action
+    assert rauc_client.action_id == '4'
+    rauc_client.cleanup_dbus()
+
+
+async def test_skip_installed_bundle(test_client, tmpdir):
+    client = await test_client(create_app)
+    rauc_client = create_client(client, tmpdir)
+
+    async def slot_status():
+        return {
+            'rootfs.0': {'state': 'booted', 'bundle.hash': 'a' * 64},
+            'rootfs.1': {'state': 'inactive', 'bundle.hash': 'B' * 64},
+        }, 'rootfs.1'
+    rauc_client.slot_status = slot_status
+
+    # installed in the booted slot
+    assert await rauc_client.installed_slot('A' * 64) == 'rootfs.0'
+    # installed in the slot booted next
+    assert await rauc_client.installed_slot('b' * 64) == 'rootfs.1'
+    # not installed
+    assert await rauc_client.installed_slot('c' * 64) is None
+    rauc_client.cleanup_dbus()
+
+
+ARTIFACT = os.urandom(64 * 1024)
+
+
+class FakeSlotsClient(SimulatedInstallClient):
+    """
+    Simulated installations update a fake RAUC slot status, recording the
+    SHA256 hash of the installed bundle file as ``bundle.hash`` of the slot
+    booted next.
+    """
+    def __init__(self, *args, **kwargs):
+        super(FakeSlotsClient, self).__init__(*args, **kwargs)
+        self.slots = {'rootfs.0': {'state': 'booted'},
+                      'rootfs.1': {'state': 'inactive'}}
+        self.slot_queries = 0
+        self.connected_before_install = []
+
+    async def install_bundle(self, action_id):
+        self.connected_before_install.append(self.dbus_connected)
+        with open(self.bundle_dl_location, 'rb') as fd:
+            self.slots['rootfs.1']['bundle.hash'] = \
+                hashlib.sha256(fd.read()).hexdigest()
+        await super(FakeSlotsClient, self).install_bundle(action_id)
+
+    async def slot_status(self):
+        self.connect_dbus()
+        self.slot_queries += 1
+        return dict(self.slots), 'rootfs.1'
+
+
+def create_deployment_app(loop):
+    async def deployment(request):
+        hashes = {'md5': hashlib.md5(ARTIFACT).hexdigest()}
+        if request.app['sha256']:
+            hashes['sha256'] = hashlib.sha256(ARTIFACT).hexdigest()
+        return web.json_response({'deployment': {'chunks': [{'artifacts': [{
+            'filename': 'bundle.raucb',
+            'hashes': hashes,
+            '_links': {'download-http': {
+                'href': 'http://{}/artifact'.format(request.host)}},
+        }]}]}})
+
+    async def artifact(request):
+        request.app['downloads'] += 1
+        return web.Response(body=ARTIFACT)
+
+    async def feedback(request):
+        data = await request.json()
+        if data['status']['execution'] == 'closed':
+            request.app['results'].append(
+                data['status']['result']['finished'])
+        return web.Response()
+
+    app = web.Application()
+    app['sha256'] = True
+    app['downloads'] = 0
+    app['results'] = []
+    app.router.add_route('GET', TARGET + '/deploymentBase/{action}',
+                         deployment)
+    app.router.add_route('GET', '/artifact', artifact)
+    app.router.add_route('POST', TARGET + '/deploymentBase/{action}/feedback',
+                         feedback)
+    return app
+
+
+async def deploy(client, rauc_client, action_id):
+    base = {'_links': {'deploymentBase': {
+        'href': 'http://{}:{}{}/deploymentBase/{}?c=1'.format(
+            client.host, client.port, TARGET, action_id)}}}
+    results = client.server.app['results']
+    count = len(results)
+    await rauc_client.process_deployment(base)
+    # final feedback follows RAUC's Completed signal
+    while len(results) == count:
+        await asyncio.sleep(0.01)
+    return results[-1]
+
+
+async def test_skip_installed_bundle_fake_rauc(test_client, tmpdir):
+    client = await test_client(create_deployment_app)
+    app = client.server.app
+    rauc_client = FakeSlotsClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True)
+
+    # without SHA256 hash, the slot status is not queried and D-Bus is only
+    # connected for the installation
+    app['sha256'] = False
+    assert await deploy(client, rauc_client, 1) == 'success'
+    assert app['downloads'] == 1
+    assert rauc_client.slot_queries == 0
+    assert rauc_client.connected_before_install == [False]
+
+    # another bundle was installed meanwhile
+    app['sha256'] = True
+    rauc_client.slots['rootfs.1']['bundle.hash'] = 'f' * 64
+    assert await deploy(client, rauc_client, 2) == 'success'
+    assert app['downloads'] == 2
+    assert rauc_client.slot_queries == 1
+
+    # re-sent deployment of the installed bundle is skipped
+    assert await deploy(client, rauc_client, 3) == 'success'
+    assert app['downloads'] == 2
+    assert rauc_client.slot_queries == 2
+    rauc_client.cleanup_dbus()
@@ -0,0 +1,54 @@
+from rauc_hawkbit.ddi.progress import DownloadProgress
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limited_events():
+    clock = Clock()
+    events = []
+    progress = DownloadProgress(events.append, total=1000, interval=1.0,
+                                clock=clock)
+
+    # many small chunks within one interval produce no event
+    for _ in range(10):
+        progress.update(10)
+    assert events == []
+
+    clock.now += 1
+    progress.update(100)
+    assert len(events) == 1
+    event = events[0]
+    assert event.received == 200
+    assert event.percentage == 20
+    assert event.throughput == 200
+    assert event.eta == 4
+
+    # throughput is smoothed
+    clock.now += 1
+    progress.update(400)
+    assert len(events) == 2
+    assert 200 < events[1].throughput < 400
+
+    progress.finish()
+    assert len(events) == 3
+
+
+def test_unknown_total():
+    clock = Clock()
+    events = []
+    progress = DownloadProgress(events.append, received=500, clock=clock)
+
+    clock.now += 2
+    progress.update(100)
+    progress.finish()
+
+    assert events[0].received == 600
+    assert events[0].percentage is None
+    assert events[0].eta is None
+    assert events[0].throughput == 50
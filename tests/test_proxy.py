@@ -0,0 +1,236 @@
+import asyncio
+import errno
+import hashlib
+import os
+import aiohttp
+import pytest
+from aiohttp import web
+
+from rauc_hawkbit.proxy import ArtifactStore, CachingProxy
+
+ARTIFACT = os.urandom(512 * 1024)
+ARTIFACT_MD5 = hashlib.md5(ARTIFACT).hexdigest()
+HEADERS = {'Authorization': 'TargetToken secret'}
+ARTIFACT_PATH = '/DEFAULT/controller/v1/test-target/softwaremodules/7/artifacts/bundle.raucb'
+
+
+def create_upstream(host_ref, counter, gate=None):
+    async def deployment(request):
+        href = 'http://{}{}'.format(host_ref[0], ARTIFACT_PATH)
+        return web.json_response({
+            'id': '3',
+            'deployment': {
+                'chunks': [{
+                    'artifacts': [{
+                        'filename': 'bundle.raucb',
+                        'hashes': {'md5': ARTIFACT_MD5},
+                        '_links': {'download-http': {'href': href},
+                                   'md5sum-http': {
+                                       'href': href + '.MD5SUM'}}
+                    }]
+                }]
+            }
+        })
+
+    async def artifact(request):
+        if request.headers.get('Authorization') != 'TargetToken secret':
+            raise web.HTTPUnauthorized()
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Length': str(len(ARTIFACT))})
+        counter.append(request.headers.get('Authorization'))
+        resp = web.StreamResponse()
+        resp.content_length = len(ARTIFACT)
+        await resp.prepare(request)
+        half = len(ARTIFACT) // 2
+        await resp.write(ARTIFACT[:half])
+        # give concurrent requests time to pile up
+        await (gate.wait() if gate else asyncio.sleep(0.1))
+        await resp.write(ARTIFACT[half:])
+        return resp
+
+    async def md5sum(request):
+        return web.Response(text='{}  bundle.raucb'.format(ARTIFACT_MD5))
+
+    app = web.Application()
+    app.router.add_route(
+        'GET', '/DEFAULT/controller/v1/test-target/deploymentBase/3', deployment)
+    app.router.add_get(ARTIFACT_PATH, artifact)
+    app.router.add_route('GET', ARTIFACT_PATH + '.MD5SUM', md5sum)
+    return app
+
+
+async def start_proxy(test_server, test_client, session, tmpdir, counter,
+                      gate=None):
+    host_ref = []
+    upstream = await test_server(create_upstream(host_ref, counter, gate))
+    host_ref.append('{}:{}'.format(upstream.host, upstream.port))
+    proxy = CachingProxy(session, host_ref[0], False,
+                         ArtifactStore(str(tmpdir.join('store'))))
+    client = await test_client(proxy.app())
+
+    resp = await client.get(
+        '/DEFAULT/controller/v1/test-target/deploymentBase/3',
+        headers=HEADERS)
+    assert resp.status == 200
+    deployment = await resp.json()
+    href = deployment['deployment']['chunks'][0]['artifacts'][0]['_links']['download-http']['href']
+    assert host_ref[0] not in href
+    return proxy, client
+
+
+async def test_single_flight(test_server, test_client, tmpdir):
+    counter = []
+    async with aiohttp.ClientSession() as session:
+        proxy, client = await start_proxy(test_server, test_client, session,
+                                          tmpdir, counter)
+
+        async def download():
+            resp = await client.get(ARTIFACT_PATH, headers=HEADERS)
+            assert resp.status == 200
+            return await resp.read()
+
+        results = await asyncio.gather(*[download() for _ in range(50)])
+        assert all(result == ARTIFACT for result in results)
+        assert counter == ['TargetToken secret']
+        assert proxy.upstream_fetches == 1
+
+        resp = await client.get(ARTIFACT_PATH,
+                                headers={'Range': 'bytes=100-199', **HEADERS})
+        assert resp.status == 206
+        assert await resp.read() == ARTIFACT[100:200]
+        assert proxy.upstream_fetches == 1
+
+        # not announced in deploymentBase, forwarded
+        resp = await client.get(ARTIFACT_PATH + '.MD5SUM', headers=HEADERS)
+        assert (await resp.text()).startswith(ARTIFACT_MD5)
+        assert proxy.upstream_fetches == 1
+
+
+async def test_streams_while_fetching(test_server, test_client, tmpdir):
+    counter = []
+    gate = asyncio.Event()
+    async with aiohttp.ClientSession() as session:
+        proxy, client = await start_proxy(test_server, test_client, session,
+                                          tmpdir, counter, gate)
+
+        resp = await client.get(ARTIFACT_PATH, headers=HEADERS)
+        assert resp.status == 200
+        assert resp.content_length == len(ARTIFACT)
+        # first half arrives while upstream is stalled
+        first = await resp.content.readexactly(len(ARTIFACT) // 2)
+        assert first == ARTIFACT[:len(first)]
+
+        ranged = asyncio.ensure_future(client.get(
+            ARTIFACT_PATH, headers={'Range': 'bytes=1000-', **HEADERS}))
+        gate.set()
+        assert first + await resp.read() == ARTIFACT
+        ranged = await ranged
+        assert ranged.status == 206
+        assert await ranged.read() == ARTIFACT[1000:]
+        assert proxy.upstream_fetches == 1
+
+
+async def test_checks_credentials(test_server, test_client, tmpdir):
+    counter = []
+    async with aiohttp.ClientSession() as session:
+        proxy, client = await start_proxy(test_server, test_client, session,
+                                          tmpdir, counter)
+        resp = await client.get(ARTIFACT_PATH, headers=HEADERS)
+        assert await resp.read() == ARTIFACT
+
+        # cached, but still not served without valid credentials
+        resp = await client.get(ARTIFACT_PATH)
+        assert resp.status == 401
+        resp = await client.get(
+            ARTIFACT_PATH, headers={'Authorization': 'TargetToken wrong'})
+        assert resp.status == 401
+
+        # other tenant, unknown to the proxy, is forwarded
+        resp = await client.get(ARTIFACT_PATH.replace('DEFAULT', 'OTHER'),
+                                headers=HEADERS)
+        assert resp.status == 404
+        assert counter == ['TargetToken secret']
+
+
+async def test_aborts_corrupt_fetch(test_server, test_client, tmpdir):
+    counter = []
+    async with aiohttp.ClientSession() as session:
+        proxy, client = await start_proxy(test_server, test_client, session,
+                                          tmpdir, counter)
+        key = ('DEFAULT', '7', 'bundle.raucb')
+        proxy.known_hashes[key] = 'f' * 32
+
+        resp = await client.get(ARTIFACT_PATH, headers=HEADERS)
+        assert resp.status == 200
+        with pytest.raises(aiohttp.ClientPayloadError):
+            await resp.read()
+        assert proxy.store.get('f' * 32, 'DEFAULT') is None
+        assert proxy.store.get(ARTIFACT_MD5, 'DEFAULT') is None
+
+
+async def test_streams_unknown_artifacts(test_server, test_client, tmpdir):
+    counter = []
+    gate = asyncio.Event()
+    async with aiohttp.ClientSession() as session:
+        proxy, client = await start_proxy(test_server, test_client, session,
+                                          tmpdir, counter, gate)
+        # e.g. after a restart of the proxy
+        proxy.known_hashes.clear()
+
+        resp = await client.get(ARTIFACT_PATH, headers=HEADERS)
+        assert resp.status == 200
+        assert resp.content_length == len(ARTIFACT)
+        # forwarded while upstream is stalled, not buffered
+        first = await resp.content.readexactly(len(ARTIFACT) // 2)
+        gate.set()
+        assert first + await resp.read() == ARTIFACT
+        assert proxy.upstream_fetches == 0
+
+
+async def test_cache_write_error(test_server, test_client, tmpdir):
+    counter = []
+    async with aiohttp.ClientSession() as session:
+        proxy, client = await start_proxy(test_server, test_client, session,
+                                          tmpdir, counter)
+
+        def put(md5sum, tmp_path, namespace=None):
+            path = proxy.store.path(md5sum, namespace)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fd:
+                fd.write(b'partial')
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        proxy.store.put = put
+        resp = await client.head(ARTIFACT_PATH, headers=HEADERS)
+        assert resp.status == 502
+        assert proxy.store.get(ARTIFACT_MD5, 'DEFAULT') is None
+        assert not [name for name in os.listdir(proxy.store.directory)
+                    if name.startswith('.incoming-')]
+
+
+def test_store_eviction(tmpdir):
+    store = ArtifactStore(str(tmpdir), max_size=2500)
+    for i in range(3):
+        md5sum = '{:032x}'.format(i)
+        tmp_path = store.tempfile()
+        with open(tmp_path, 'wb') as fd:
+            fd.write(b'x' * 1000)
+        os.utime(tmp_path, (i, i))
+        store.put(md5sum, tmp_path)
+
+    assert store.get('{:032x}'.format(0)) is None
+    assert store.get('{:032x}'.format(1)) is not None
+    assert store.get('{:032x}'.format(2)) is not None
+
+    # namespaces share the size limit
+    tmp_path = store.tempfile()
+    with open(tmp_path, 'wb') as fd:
+        fd.write(b'x' * 1000)
+    store.put('{:032x}'.format(3), tmp_path, 'tenant')
+    assert store.get('{:032x}'.format(3)) is None
+    assert store.get('{:032x}'.format(3), 'tenant') is not None
+    assert store.get('{:032x}'.format(1)) is None
+    with pytest.raises(ValueError):
+        store.get('../etc/passwd')
+    with pytest.raises(ValueError):
+        store.get('{:032x}'.format(3), '..')
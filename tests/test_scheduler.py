@@ -0,0 +1,76 @@
+import asyncio
+
+from rauc_hawkbit.ddi.scheduler import RequestClass, RequestScheduler
+
+
+async def run(scheduler, request_class, order, hold=0.0):
+    async with scheduler.slot(request_class):
+        order.append(request_class)
+        await asyncio.sleep(hold)
+
+
+async def test_priority_order():
+    scheduler = RequestScheduler(max_requests=1)
+    order = []
+
+    bulk = asyncio.ensure_future(run(scheduler, RequestClass.bulk, order, 0.1))
+    await asyncio.sleep(0.01)
+    waiting = [asyncio.ensure_future(run(scheduler, request_class, order))
+               for request_class in (RequestClass.bulk, RequestClass.poll,
+                                     RequestClass.control)]
+    await asyncio.gather(bulk, *waiting)
+
+    assert order == [RequestClass.bulk, RequestClass.control,
+                     RequestClass.poll, RequestClass.bulk]
+    stats = scheduler.statistics()
+    assert stats['bulk']['requests'] == 2
+    assert stats['control']['max_delay'] > 0.05
+    assert stats['bulk']['queued'] == 0
+
+
+async def test_class_limit():
+    scheduler = RequestScheduler()
+    order = []
+
+    bulk = [asyncio.ensure_future(run(scheduler, RequestClass.bulk, order, 0.1))
+            for _ in range(2)]
+    await asyncio.sleep(0.01)
+    # control requests are not blocked by the waiting bulk transfer
+    await asyncio.wait_for(run(scheduler, RequestClass.control, order), 0.05)
+    await asyncio.gather(*bulk)
+
+    assert order == [RequestClass.bulk, RequestClass.control,
+                     RequestClass.bulk]
+
+
+async def test_cancel_waiting():
+    scheduler = RequestScheduler(max_requests=1)
+    order = []
+
+    bulk = asyncio.ensure_future(run(scheduler, RequestClass.bulk, order, 0.05))
+    await asyncio.sleep(0.01)
+    poll = asyncio.ensure_future(run(scheduler, RequestClass.poll, order))
+    await asyncio.sleep(0.01)
+    poll.cancel()
+    await bulk
+    await run(scheduler, RequestClass.control, order)
+
+    assert order == [RequestClass.bulk, RequestClass.control]
+    assert scheduler.running == 0
+
+
+async def test_bulk_pause():
+    scheduler = RequestScheduler(max_bulk_pause=1.0)
+    loop = asyncio.get_event_loop()
+
+    control = asyncio.ensure_future(
+        run(scheduler, RequestClass.control, [], 0.1))
+    await asyncio.sleep(0.01)
+    start = loop.time()
+    await scheduler.bulk_checkpoint()
+    assert 0.05 < loop.time() - start < 0.5
+    await control
+
+    start = loop.time()
+    await scheduler.bulk_checkpoint()
+    assert loop.time() - start < 0.05
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+from rauc_hawkbit.fake_rauc import RAUC_INTERFACE
+from rauc_hawkbit.soak import (
+    SimulatedInstallClient, SoakError, SoakHarness, SoakReport, SoakSample,
+    VirtualClockLoop, growth)
+
+
+def test_virtual_clock():
+    loop = VirtualClockLoop()
+    start = time.monotonic()
+    try:
+        loop.run_until_complete(asyncio.sleep(24 * 3600))
+        assert loop.time() >= 24 * 3600
+    finally:
+        loop.close()
+    assert time.monotonic() - start < 1
+
+
+def test_growth():
+    assert growth([5, 5, 5, 5]) == 0
+    assert growth([1, 2, 3, 4]) == pytest.approx(3)
+    # a single outlier is not a trend
+    assert growth([5, 5, 50, 5, 5, 5, 5, 5, 5, 5]) < 10
+
+
+def test_leak_detected():
+    samples = [SoakSample(cycle, cycle * 3600, 0, 8 + cycle // 2, 4,
+                          1000 * cycle, 0, 0) for cycle in range(20)]
+    report = SoakReport(samples, 5, SoakHarness.default_tolerances, 0, [], 0)
+    assert set(report.leaks()) == {'fds'}
+    with pytest.raises(SoakError):
+        report.check()
+
+
+def test_soak():
+    # two weeks of 12 hour polls with a deployment every two days
+    report = SoakHarness(cycles=28, deployment_every=4).run()
+
+    assert report.virtual_time > 13 * 24 * 3600
+    assert report.elapsed < 60
+    assert report.deployments >= 5
+    assert report.results == ['success'] * report.deployments
+    # PropertiesChanged and Completed, subscribed once
+    assert report.samples[-1].subscriptions == 2
+    report.check()
+
+
+class ResubscribingClient(SimulatedInstallClient):
+    async def install_bundle(self, action_id):
+        await super(ResubscribingClient, self).install_bundle(action_id)
+        # subscribes again for each installation
+        self.new_signal_subscription(RAUC_INTERFACE, 'Completed',
+                                     self.complete_callback)
+
+
+class ResubscribingHarness(SoakHarness):
+    def create_client(self, session, host, bundle_dl_location):
+        return ResubscribingClient(
+            session, host, False, 'DEFAULT', 'soak', 'token',
+            {'MAC': 'ff:ff:ff:ff:ff:ff'}, bundle_dl_location,
+            lambda result: None, lazy_dbus=True)
+
+
+def test_subscription_leak_detected():
+    report = ResubscribingHarness(cycles=16, deployment_every=2).run()
+    assert 'subscriptions' in report.leaks()
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from aiohttp import web
+
+from rauc_hawkbit.rauc_dbus_ddi_client import RaucDBUSDDIClient
+
+# Budgets are relative to a baseline process only importing asyncio and
+# aiohttp, so they hold on slower machines. RAUC_HAWKBIT_BUDGET_SCALE scales
+# the time budgets further, e.g. for emulated or heavily loaded CI runners.
+BUDGET_SCALE = float(os.environ.get('RAUC_HAWKBIT_BUDGET_SCALE', '1'))
+# importing the client library, including aiohttp (measured: 0.9-1.6 times
+# the baseline import)
+STARTUP_TIME_FACTOR = 2.5
+# rauc-hawkbit-client from exec to its first poll (measured: 0.9-1.1 times
+# the baseline from exec to exit)
+DAEMON_STARTUP_TIME_FACTOR = 2.5
+# RSS of rauc-hawkbit-client at its first poll above the baseline RSS
+# (measured: 2 MiB)
+DAEMON_RSS_BUDGET = 16 * 1024  # KiB
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONFIG = '''
+[client]
+hawkbit_server = {host}
+ssl = false
+tenant_id = DEFAULT
+target_name = test-target
+auth_token = token
+mac_address = ff:ff:ff:ff:ff:ff
+bundle_download_location = {bundle}
+log_level = warn
+'''
+
+# modules which must only be loaded when needed
+LAZY_MODULES = [
+    'gi',
+    'aiohttp.web',
+    'rauc_hawkbit.delta',
+    'rauc_hawkbit.peer',
+    'rauc_hawkbit.proxy',
+    'rauc_hawkbit.mirrors',
+    'rauc_hawkbit.governor',
+    'rauc_hawkbit.local_source',
+    'rauc_hawkbit.watchdog',
+    'rauc_hawkbit.ddi.cancel_action',
+    'rauc_hawkbit.ddi.softwaremodules',
+]
+
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.monotonic()
+import {module}
+elapsed = time.monotonic() - start
+with open('/proc/self/status') as status:
+    rss = [int(line.split()[1]) for line in status
+           if line.startswith('VmRSS:')][0]
+print(json.dumps({{
+    'time': elapsed,
+    'rss': rss,
+    'modules': sorted(sys.modules),
+}}))
+'''
+
+
+def read_rss(pid):
+    """Returns the current RSS of a process in KiB."""
+    with open('/proc/{}/status'.format(pid)) as status:
+        return [int(line.split()[1]) for line in status
+                if line.startswith('VmRSS:')][0]
+
+
+def measure_startup(module='rauc_hawkbit.rauc_dbus_ddi_client'):
+    """
+    Returns import time, RSS and loaded modules of a new interpreter
+    importing ``module`` and its time from exec to exit.
+    """
+    start = time.monotonic()
+    output = subprocess.check_output(
+        [sys.executable, '-c', STARTUP_SCRIPT.format(module=module)])
+    startup = json.loads(output.decode())
+    startup['total_time'] = time.monotonic() - start
+    return startup
+
+
+def measure_baseline(runs=3):
+    """Fastest of several interpreters importing only asyncio and aiohttp."""
+    measurements = [measure_startup('asyncio, aiohttp') for _ in range(runs)]
+    return {
+        'time': min(startup['time'] for startup in measurements),
+        'total_time': min(startup['total_time'] for startup in measurements),
+        'rss': min(startup['rss'] for startup in measurements),
+    }
+
+
+def test_startup_budget():
+    baseline = measure_baseline()
+    startup = min((measure_startup() for _ in range(3)),
+                  key=lambda startup: startup['time'])
+
+    assert startup['time'] < \
+        baseline['time'] * STARTUP_TIME_FACTOR * BUDGET_SCALE
+
+
+def test_lazy_imports():
+    startup = measure_startup()
+
+    for module in LAZY_MODULES:
+        assert module not in startup['modules']
+
+
+def create_app(loop):
+    async def base(request):
+        return web.json_response({
+            'config': {'polling': {'sleep': '12:00:00'}},
+            '_links': {'configData': {'href': 'configData'}},
+        })
+
+    async def config_data(request):
+        request.app['identified'] = True
+        return web.Response()
+
+    app = web.Application()
+    app['identified'] = False
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target', base)
+    app.router.add_route(
+        'PUT', '/DEFAULT/controller/v1/test-target/configData', config_data)
+    return app
+
+
+async def test_poll_before_dbus(test_client, tmpdir):
+    client = await test_client(create_app)
+    rauc_client = RaucDBUSDDIClient(
+        client.session, '{}:{}'.format(client.host, client.port), False,
+        'DEFAULT', 'test-target', None, {'MAC': 'ff:ff:ff:ff:ff:ff'},
+        str(tmpdir.join('bundle.raucb')), lambda result: None,
+        lazy_dbus=True)
+
+    try:
+        await asyncio.wait_for(rauc_client.poll_base_resource(), 0.5)
+    except asyncio.TimeoutError:
+        pass
+
+    assert client.server.app['identified']
+    assert not rauc_client.dbus_connected
+    rauc_client.cleanup_dbus()
+
+
+async def start_daemon(test_server, tmpdir, extra_config='',
+                       stdout=subprocess.DEVNULL):
+    """Returns (process, event set on the first poll) of rauc-hawkbit-client."""
+    polled = asyncio.Event()
+
+    async def base(request):
+        polled.set()
+        return web.json_response({
+            'config': {'polling': {'sleep': '12:00:00'}},
+            '_links': {},
+        })
+
+    app = web.Application()
+    app.router.add_route('GET', '/DEFAULT/controller/v1/test-target', base)
+    server = await test_server(app)
+
+    config = tmpdir.join('config.cfg')
+    config.write(CONFIG.format(host='{}:{}'.format(server.host, server.port),
+                               bundle=tmpdir.join('bundle.raucb')) +
+                 extra_config)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, 'bin', 'rauc-hawkbit-client'),
+        '-c', str(config), env=env, stdout=stdout)
+    return process, polled
+
+
+async def test_daemon_startup_budget(test_server, tmpdir):
+    baseline = measure_baseline()
+    start = time.monotonic()
+    process, polled = await start_daemon(test_server, tmpdir)
+    try:
+        await asyncio.wait_for(polled.wait(), 10)
+        elapsed = time.monotonic() - start
+        rss = read_rss(process.pid)
+    finally:
+        process.terminate()
+        await process.wait()
+
+    assert elapsed < \
+        baseline['total_time'] * DAEMON_STARTUP_TIME_FACTOR * BUDGET_SCALE
+    assert rss - baseline['rss'] < DAEMON_RSS_BUDGET
+
+
+async def test_daemon_statistics(test_server, tmpdir):
+    process, polled = await start_daemon(
+        test_server, tmpdir,
+        '[governor]\nenabled = true\n[watchdog]\nenabled = true\n',
+        stdout=subprocess.PIPE)
+    try:
+        await asyncio.wait_for(polled.wait(), 10)
+        process.send_signal(signal.SIGUSR1)
+        line = await asyncio.wait_for(process.stdout.readline(), 10)
+    finally:
+        process.terminate()
+        await process.wait()
+
+    prefix = b'Statistics: '
+    assert line.startswith(prefix)
+    statistics = json.loads(line[len(prefix):].decode())
+    assert statistics['scheduler']['governor']['state'] == 'normal'
+    assert 'histogram' in statistics['watchdog']
@@ -0,0 +1,218 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import queue
+import aiohttp
+from aiohttp import web
+
+from rauc_hawkbit.proxy import ArtifactStore
+from rauc_hawkbit.supervisor import Supervisor, Target, Worker, shard
+
+ARTIFACT = os.urandom(512 * 1024)
+MD5 = hashlib.md5(ARTIFACT).hexdigest()
+
+
+def install(target_name, action_id, path):
+    # module level, passed to worker processes (with a different ARTIFACT)
+    return os.path.getsize(path) == len(ARTIFACT)
+
+
+def create_hawkbit_app():
+    app = web.Application()
+    app['downloads'] = 0
+    app['feedback'] = {}
+    app['canceled'] = {}
+
+    async def base(request):
+        target = request.match_info['target']
+        if target == 'broken':
+            # no polling config
+            return web.json_response({'_links': {}})
+        links = {}
+        if target == 'canceled' and target not in app['canceled']:
+            links['cancelAction'] = {
+                'href': 'http://{}/DEFAULT/controller/v1/{}/cancelAction/'
+                        '5'.format(request.host, target)}
+        elif target not in app['feedback']:
+            links['deploymentBase'] = {
+                'href': 'http://{}/DEFAULT/controller/v1/{}/deploymentBase/'
+                        '{}?c=1'.format(request.host, target, target)}
+        return web.json_response({
+            'config': {'polling': {'sleep': '00:00:01'}},
+            '_links': links,
+        })
+
+    async def deployment(request):
+        return web.json_response({'deployment': {'chunks': [{'artifacts': [{
+            'hashes': {'md5': MD5},
+            '_links': {'download-http': {
+                'href': 'http://{}/artifact'.format(request.host)}},
+        }]}]}})
+
+    async def feedback(request):
+        data = await request.json()
+        app['feedback'][request.match_info['target']] = data
+        return web.Response()
+
+    async def cancel_action(request):
+        return web.json_response({'id': '5', 'cancelAction': {'stopId': '4'}})
+
+    async def cancel_feedback(request):
+        data = await request.json()
+        app['canceled'][request.match_info['target']] = data
+        return web.Response()
+
+    async def artifact(request):
+        app['downloads'] += 1
+        return web.Response(body=ARTIFACT)
+
+    app.router.add_route('GET', '/DEFAULT/controller/v1/{target}', base)
+    app.router.add_route(
+        'GET', '/DEFAULT/controller/v1/{target}/deploymentBase/{action}',
+        deployment)
+    app.router.add_route(
+        'POST', '/DEFAULT/controller/v1/{target}/deploymentBase/{action}/feedback',
+        feedback)
+    app.router.add_route(
+        'GET', '/DEFAULT/controller/v1/{target}/cancelAction/{action}',
+        cancel_action)
+    app.router.add_route(
+        'POST', '/DEFAULT/controller/v1/{target}/cancelAction/{action}/feedback',
+        cancel_feedback)
+    app.router.add_route('GET', '/artifact', artifact)
+    return app
+
+
+def test_shard_stable():
+    targets = [Target('target-{}'.format(i), 'token', {}) for i in range(100)]
+    shards = shard(targets, 4)
+    assert sorted(sum(shards, []), key=targets.index) == targets
+    assert all(shards)
+    assert shard(list(reversed(targets)), 4) == shards
+
+    # balanced for small fleets
+    shards = shard(targets[:6], 4)
+    assert sorted(len(targets) for targets in shards) == [1, 1, 2, 2]
+
+
+async def test_supervisor(test_server, tmpdir, caplog):
+    server = await test_server(create_hawkbit_app())
+    targets = [Target('target-{}'.format(i), 'token', {}) for i in range(6)]
+    # fails in one of the workers
+    broken = Target('broken', 'token', {})
+    supervisor = Supervisor('{}:{}'.format(server.host, server.port), False,
+                            'DEFAULT', targets + [broken],
+                            str(tmpdir.join('store')), workers=2,
+                            handler=install, metrics_interval=0.5)
+    loop = asyncio.get_event_loop()
+    supervisor.start()
+    try:
+        while len(supervisor.results) < len(targets):
+            await loop.run_in_executor(None, supervisor.collect, 0.1)
+            await asyncio.sleep(0.1)
+    finally:
+        await loop.run_in_executor(None, supervisor.stop)
+
+    assert all(result.success for result in supervisor.results)
+    assert sorted(server.app['feedback']) == [t.name for t in targets]
+    # artifact shared between targets and workers
+    assert server.app['downloads'] == 1
+    # lock files are removed once the artifact is stored
+    assert not [name for name in os.listdir(str(tmpdir.join('store')))
+                if name.startswith('.lock-')]
+    statistics = supervisor.statistics()
+    assert statistics['deployments'] == len(targets)
+    assert statistics['downloads'] == 1
+    assert statistics['workers'] == 2
+    assert statistics['errors'] >= 1
+    # logged by the worker process
+    assert any(record.processName.startswith('rauc-hawkbit-worker') and
+               'broken: polling failed' in record.getMessage()
+               for record in caplog.records)
+
+
+async def test_worker_errors_and_cancel(test_server, tmpdir):
+    server = await test_server(create_hawkbit_app())
+    targets = [Target(name, 'token', {})
+               for name in ('broken', 'canceled', 'target-0')]
+    events = queue.Queue()
+    async with aiohttp.ClientSession() as session:
+        worker = Worker(0, session, '{}:{}'.format(server.host, server.port),
+                        False, 'DEFAULT', targets,
+                        ArtifactStore(str(tmpdir.join('store'))), events,
+                        handler=install, wait_on_error=0.1)
+        task = asyncio.ensure_future(worker.run())
+        try:
+            for _ in range(50):
+                if 'target-0' in server.app['feedback'] and \
+                        'canceled' in server.app['feedback']:
+                    break
+                await asyncio.sleep(0.1)
+            # the broken target keeps being retried
+            assert not task.done()
+        finally:
+            task.cancel()
+            await asyncio.wait([task])
+
+    assert worker.metrics['errors'] >= 2
+    assert worker.metrics['cancellations'] == 1
+    status = server.app['canceled']['canceled']['status']
+    assert status['execution'] == 'closed'
+    # deployment after cancelation
+    assert server.app['feedback']['canceled']['status']['result'][
+        'finished'] == 'success'
+
+
+async def test_worker_without_handler(test_server, tmpdir):
+    server = await test_server(create_hawkbit_app())
+    events = queue.Queue()
+    async with aiohttp.ClientSession() as session:
+        worker = Worker(0, session, '{}:{}'.format(server.host, server.port),
+                        False, 'DEFAULT', [Target('target-0', 'token', {})],
+                        ArtifactStore(str(tmpdir.join('store'))), events)
+        task = asyncio.ensure_future(worker.run())
+        try:
+            for _ in range(50):
+                if 'target-0' in server.app['feedback']:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            task.cancel()
+            await asyncio.wait([task])
+
+    status = server.app['feedback']['target-0']['status']
+    assert status['result']['finished'] == 'failure'
+    assert status['details'] == ['No deployment handler configured']
+    assert server.app['downloads'] == 0
+    _, result = events.get_nowait()
+    assert not result.success
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+async def test_download_canceled_while_locked(tmpdir):
+    store = ArtifactStore(str(tmpdir.join('store')))
+    worker = Worker(0, None, None, False, 'DEFAULT', [], store, queue.Queue())
+    # another worker is downloading
+    fd = os.open(os.path.join(store.directory, '.lock-{}'.format(MD5)),
+                 os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    fds = open_fds()
+
+    task = asyncio.ensure_future(worker.download(None, '/artifact', MD5))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.wait([task])
+    # still in use by flock() in the executor
+    assert open_fds() == fds + 1
+
+    os.close(fd)
+    for _ in range(50):
+        if open_fds() == fds - 1:
+            break
+        await asyncio.sleep(0.02)
+    assert open_fds() == fds - 1
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from rauc_hawkbit.watchdog import LagWatchdog
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+async def test_blocking_call():
+    watchdog = LagWatchdog(interval=0.01, threshold=0.1)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.1)
+        blocking_call()
+        await asyncio.sleep(0.1)
+    finally:
+        await watchdog.stop()
+
+    call, = watchdog.blocking_calls
+    assert call.duration >= 0.2
+    assert 'blocking_call' in call.location
+    assert any('test_blocking_call' in line for line in call.stack)
+
+    statistics = watchdog.statistics()
+    assert statistics['max'] >= 0.2
+    histogram = statistics['histogram']
+    assert histogram[float('inf')] == statistics['count']
+    # one sample above 250ms
+    assert histogram[0.25] == statistics['count'] - 1
+
+
+async def test_no_blocking_call():
+    watchdog = LagWatchdog(interval=0.01, threshold=0.1)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.3)
+    finally:
+        await watchdog.stop()
+
+    assert watchdog.count > 10
+    assert not watchdog.blocking_calls